@@ -2,44 +2,146 @@
 import time
 from threading import Lock
 
+import metrics
+from instrumentation import timed_function
+
 _lock = Lock()
 _cache = {}
+_person_versions = {}  # { person_id: 最後の書き込みバージョン }
+_last_version = 0
 
 MONTH_CACHE_TTL_SEC = 90  # 例：30秒（10でも60でもOK）
+# 期限切れの値も、この秒数までは上流（Airtable）の障害時の代わりに使えるよう残しておく（cache_get_stale）
+CACHE_STALE_SEC = 3600
 
 def month_key(person_id: str, year: int, month: int) -> str:
     return f"airtable:month:{person_id}:{year:04d}-{month:02d}"
 
-def cache_get(key: str):
+def record_key(person_id: str, record_id: str) -> str:
+    return f"airtable:record:{person_id}:{record_id}"
+
+def fragment_key(name: str, person_id: str, year: int, month: int) -> str:
+    """描画済み HTML 断片のキー。値には元データ（当月キャッシュ）のバージョンを含めて保存する。"""
+    return f"fragment:{name}:{person_id}:{year:04d}-{month:02d}"
+
+def _key_class(key: str) -> str:
+    """メトリクス用のキー分類（"airtable:month:..." → "month"）。"""
+    parts = key.split(":")
+    return parts[1] if parts[0] == "airtable" and len(parts) > 1 else parts[0]
+
+def next_version() -> int:
+    """単調増加するバージョン番号（マイクロ秒のタイムスタンプ基準なのでワーカー間でも大小比較できる）。"""
+    global _last_version
+    with _lock:
+        _last_version = max(_last_version + 1, time.time_ns() // 1000)
+        return _last_version
+
+def bump_person_version(person_id: str) -> int:
+    """PersonID の書き込みバージョンを進めて返す（作成・更新・削除の成功時に呼ぶ）。"""
+    v = next_version()
+    with _lock:
+        _person_versions[str(person_id)] = v
+    return v
+
+def get_person_version(person_id: str) -> int:
+    """このプロセスで最後に記録された PersonID の書き込みバージョン（無ければ0）。"""
+    with _lock:
+        return _person_versions.get(str(person_id), 0)
+
+def _get_item(key: str):
+    """有効な (value, expire_at, version, revision) を返す。無い・期限切れなら None。"""
     now = time.time()
     with _lock:
         item = _cache.get(key)
         if not item:
-            return None
-        value, expire_at = item
-        if expire_at < now:
-            _cache.pop(key, None)
-            return None
-        return value
-
-def cache_set(key: str, value, ttl_sec: int):
+            result = "miss"
+        elif item[1] < now:
+            if item[1] + CACHE_STALE_SEC < now:
+                _cache.pop(key, None)
+            result = "expired"
+        else:
+            result = "hit"
+    metrics.CACHE_EVENTS.inc(key_class=_key_class(key), result=result)
+    return item if result == "hit" else None
+
+@timed_function("cache")
+def cache_get_entry(key: str):
+    """(value, version) を返す。無い・期限切れなら (None, 0)。"""
+    item = _get_item(key)
+    if item is None:
+        return None, 0
+    return item[0], item[2]
+
+@timed_function("cache")
+def cache_get_entry_revision(key: str):
+    """
+    (value, version, revision) を返す。無い・期限切れなら (None, 0, 0)。
+    revision は値が保存し直されるたびに変わる（write-through で version が変わらない場合も）ので、
+    描画済みの HTML など派生データのキーに使う。
+    """
+    item = _get_item(key)
+    if item is None:
+        return None, 0, 0
+    return item[0], item[2], item[3]
+
+def cache_get(key: str):
+    return cache_get_entry(key)[0]
+
+def cache_get_stale(key: str):
+    """
+    期限切れでも CACHE_STALE_SEC 以内なら (value, revision) を返す（無ければ (None, 0)）。
+    上流に接続できないときに、古いデータで応答するために使う。
+    """
+    now = time.time()
+    with _lock:
+        item = _cache.get(key)
+    if not item or item[1] + CACHE_STALE_SEC < now:
+        return None, 0
+    metrics.CACHE_EVENTS.inc(key_class=_key_class(key), result="stale")
+    return item[0], item[3]
+
+@timed_function("cache")
+def cache_set(key: str, value, ttl_sec: int, version: int = None) -> int:
+    """
+    version は「この値がどの時点までの書き込みを反映しているか」。
+    省略時は現在のバージョン（新しく取得・作成した値用）。
+    Airtable から取得した値は取得開始時点のバージョンを、既存の値を書き換える write-through は
+    元の値のバージョンを渡すこと（元の値が他のワーカーの書き込みより古い場合に、追い越したことにしない）。
+    保存した値の revision を返す。
+    """
+    revision = next_version()
+    if version is None:
+        version = revision
     expire_at = time.time() + ttl_sec
     with _lock:
-        _cache[key] = (value, expire_at)
+        _cache[key] = (value, expire_at, version, revision)
+    return revision
 
 def cache_delete(key: str):
     with _lock:
-        _cache.pop(key, None)
+        removed = _cache.pop(key, None) is not None
+    if removed:
+        metrics.CACHE_EVENTS.inc(key_class=_key_class(key), result="invalidated")
 
 # --- ここから追加：キャッシュの行操作（Airtable追加コールなし） ---
 
+def month_cache_find_record(person_id: str, year: int, month: int, record_id: str):
+    """当月キャッシュが存在する場合、その中から record_id の行(dict)を返す。無ければ None。"""
+    rows = cache_get(month_key(person_id, year, month))
+    if rows is None:
+        return None
+    for r in rows:
+        if str(r.get("id")) == str(record_id):
+            return dict(r)
+    return None
+
 def month_cache_remove_record(person_id: str, year: int, month: int, record_id: str,
                               ttl_sec: int = MONTH_CACHE_TTL_SEC) -> bool:
     ...
 
     """当月キャッシュが存在する場合、その中の record_id を1件削除して保存し直す。"""
     key = month_key(person_id, year, month)
-    rows = cache_get(key)
+    rows, version = cache_get_entry(key)
     if rows is None:
         return False
     new_rows = [r for r in rows if str(r.get("id")) != str(record_id)]
@@ -47,7 +149,7 @@ def month_cache_remove_record(person_id: str, year: int, month: int, record_id:
         # 見つからなかった（キャッシュ不整合 or 未キャッシュ）
         return False
     new_rows.sort(key=lambda x: x.get("WorkDay", "9999-12-31"))
-    cache_set(key, new_rows, ttl_sec)
+    cache_set(key, new_rows, ttl_sec, version=version)
     return True
 
 def month_cache_update_record(person_id: str, year: int, month: int, record_id: str, fields: dict,
@@ -59,7 +161,7 @@ def month_cache_update_record(person_id: str, year: int, month: int, record_id:
     fields例: {"WorkDay": "...", "WorkOutput": 123}
     """
     key = month_key(person_id, year, month)
-    rows = cache_get(key)
+    rows, version = cache_get_entry(key)
     if rows is None:
         return False
 
@@ -78,7 +180,7 @@ def month_cache_update_record(person_id: str, year: int, month: int, record_id:
         return False
 
     new_rows.sort(key=lambda x: x.get("WorkDay", "9999-12-31"))
-    cache_set(key, new_rows, ttl_sec)
+    cache_set(key, new_rows, ttl_sec, version=version)
     return True
 
 def month_cache_move_record(person_id: str, from_year: int, from_month: int, to_year: int, to_month: int, record_id: str, fields: dict,
@@ -92,8 +194,8 @@ def month_cache_move_record(person_id: str, from_year: int, from_month: int, to_
     from_key = month_key(person_id, from_year, from_month)
     to_key   = month_key(person_id, to_year, to_month)
 
-    from_rows = cache_get(from_key)
-    to_rows   = cache_get(to_key)
+    from_rows, from_version = cache_get_entry(from_key)
+    to_rows, to_version = cache_get_entry(to_key)
 
     if from_rows is None and to_rows is None:
         return False
@@ -111,7 +213,7 @@ def month_cache_move_record(person_id: str, from_year: int, from_month: int, to_
         # fromに存在していたら保存し直し
         if moved_row is not None:
             kept.sort(key=lambda x: x.get("WorkDay", "9999-12-31"))
-            cache_set(from_key, kept, ttl_sec)
+            cache_set(from_key, kept, ttl_sec, version=from_version)
 
     # 2) to側へ入れる（toキャッシュがある場合のみ）
     if to_rows is not None:
@@ -131,7 +233,7 @@ def month_cache_move_record(person_id: str, from_year: int, from_month: int, to_
         if not replaced:
             new_to.append(dict(moved_row))
         new_to.sort(key=lambda x: x.get("WorkDay", "9999-12-31"))
-        cache_set(to_key, new_to, ttl_sec)
+        cache_set(to_key, new_to, ttl_sec, version=to_version)
         return True
 
     # toキャッシュが無い場合は fromだけ整えた（or 何もできなかった）
@@ -1,22 +1,26 @@
 # airtable_service.py
 import os
-import requests
+import time
+import threading
 import logging
 
-
-from airtable_cache import cache_get, cache_set, cache_delete, month_key, MONTH_CACHE_TTL_SEC
+import data_services
+import mirror
+import outbox
+import metrics
+from circuit_breaker import CircuitBreaker
+from instrumentation import timed
+from airtable_cache import (
+    cache_get, cache_get_entry, cache_get_entry_revision, cache_get_stale, cache_set, cache_delete, month_key, record_key,
+    month_cache_find_record, next_version, bump_person_version, MONTH_CACHE_TTL_SEC
+)
 
 
 MONTH_CACHE_TTL = 60  # まず60秒でOK（30〜300秒で調整）
-# このモジュール用のロガーを設定
+RECORD_CACHE_TTL_SEC = 120  # 編集画面用の単一レコード詳細キャッシュ
 logger = logging.getLogger(__name__)
-# 基本的なロガー設定 (app.py側の設定とは独立して、このモジュール単体でもログ出力できるように)
-if not logger.hasHandlers(): # ハンドラが重複してログが二重に出力されるのを防ぐ
-    handler = logging.StreamHandler() # コンソールに出力
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO) # このモジュールからのログはINFOレベル以上を出力
+# キャッシュのヒット等はページ表示のたびに出るので別ロガーにする（logging_setup で間引かれる）
+cache_logger = logging.getLogger(f"{__name__}.cache")
 
 # ==== Airtable 設定 ====
 AIRTABLE_TOKEN = os.environ.get("AIRTABLE_TOKEN")
@@ -26,11 +30,141 @@ if not AIRTABLE_TOKEN or not AIRTABLE_BASE_ID:
     logger.critical("Airtableの環境変数 (AIRTABLE_TOKEN, AIRTABLE_BASE_ID_BookSKY) が設定されていません。Airtable連携機能は動作しません。")
     # これらの値がない場合、以降の関数は正常に動作しないため、早期に警告を出す
 
+# 送信箱からの再送で重複作成しないための upsert キー列（各 TablePersonID_* に同名のテキスト列が必要）。
+# 未設定なら通常の作成(POST)を行い、送信箱側の一意キーで二重登録のみ防ぐ。
+AIRTABLE_IDEMPOTENCY_FIELD = os.environ.get("AIRTABLE_IDEMPOTENCY_FIELD", "")
+
+# API の接続先。ベンチマークでは benchmarks/fake_airtable.py のローカルサーバーを指す
+AIRTABLE_API_URL = os.environ.get("AIRTABLE_API_URL", "https://api.airtable.com/v0").rstrip("/")
+
 HEADERS = {
     "Authorization": f"Bearer {AIRTABLE_TOKEN}",
     "Content-Type": "application/json"
 }
 
+# ==== 接続プール ====
+# Airtable への接続（TLS）を使い回す。プロセスごとに1つ作り、fork 後の子プロセスでは作り直す
+AIRTABLE_POOL_SIZE = int(os.environ.get("AIRTABLE_POOL_SIZE", "10"))
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+# 最後に Airtable から応答を受け取った時刻（time.monotonic。0 はまだ一度も無い）。/readyz の判定用
+_last_response_at = 0.0
+AIRTABLE_WARM_SEC = float(os.environ.get("AIRTABLE_WARM_SEC", "120"))
+
+# ==== 障害時の扱い ====
+# 連続で失敗（通信エラー・タイムアウト・5xx）したら、しばらく Airtable を呼ばずに即座にエラーにする
+# （リクエストのスレッドがタイムアウトまで待たされて詰まらないように）。その間、読み出しは古いキャッシュ・ミラーで応答する。
+# 各呼び出しの timeout は上限として扱い、実際には直近の所要時間から決めた値を使う。
+AIRTABLE_BREAKER = CircuitBreaker(
+    "airtable",
+    failure_threshold=int(os.environ.get("AIRTABLE_BREAKER_FAILURES", "5")),
+    reset_sec=float(os.environ.get("AIRTABLE_BREAKER_RESET_SEC", "30")),
+    min_timeout_sec=float(os.environ.get("AIRTABLE_TIMEOUT_MIN_SEC", "2")),
+)
+
+_requests_module = None
+
+def _requests():
+    """
+    requests モジュールを返す（import app を軽くするため、最初に使うときに import する。スレッドセーフ）。
+    例外クラスも except _requests().RequestException のようにここから参照する。
+    """
+    global _requests_module
+    if _requests_module is None:
+        with _http_session_lock:
+            if _requests_module is None:
+                import requests
+                import requests.adapters
+                _requests_module = requests
+    return _requests_module
+
+def _get_http_session():
+    """Airtable 用の接続プール付きセッション（requests.Session）を返す（スレッドセーフ・fork 対応）。"""
+    global _http_session, _http_session_pid
+    session = _http_session
+    if session is not None and _http_session_pid == os.getpid():
+        return session
+    requests = _requests()
+    with _http_session_lock:
+        if _http_session is None or _http_session_pid != os.getpid():
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=AIRTABLE_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session = session
+            _http_session_pid = os.getpid()
+        return _http_session
+
+def reset_http_session():
+    """親プロセスから引き継いだ接続プールを捨てる（gunicorn の post_fork から呼ぶ）。"""
+    global _http_session, _http_session_pid, _last_response_at
+    with _http_session_lock:
+        _http_session = None
+        _http_session_pid = None
+        _last_response_at = 0.0
+
+def has_connected() -> bool:
+    """このプロセスで一度でも Airtable から応答を受け取っていれば True（通信はしない）。"""
+    return _http_session_pid == os.getpid() and _last_response_at > 0
+
+def is_connection_warm() -> bool:
+    """このプロセスの接続プールで、最近 Airtable から応答を受け取っていれば True（通信はしない）。"""
+    return _http_session_pid == os.getpid() and time.monotonic() - _last_response_at < AIRTABLE_WARM_SEC
+
+def warm_connection() -> bool:
+    """
+    軽い API（meta/whoami）を1回呼んで接続プールに TLS 接続を張っておく。
+    ワーカー起動直後や /readyz で接続が冷えているときにバックグラウンドで呼ぶ。
+    """
+    if not AIRTABLE_TOKEN:
+        return False
+    try:
+        response = _airtable_request("GET", f"{AIRTABLE_API_URL}/meta/whoami", timeout=5)
+        return response.status_code < 500
+    except _requests().RequestException as e:
+        logger.warning("Airtable への接続の準備に失敗しました: %s", e)
+        return False
+
+def _airtable_request(method: str, url: str, **kwargs):
+    """
+    Airtable API への HTTP リクエスト（全呼び出しの共通入口）。
+    所要時間をリクエストのフェーズ "airtable" として計測し、メソッド・ステータス別のメトリクスを記録する。
+    AIRTABLE_BREAKER が open の間は通信せずに requests.ConnectionError を送出する（呼び出し元の通信エラーの処理で扱える）。
+    GET の timeout は上限で、実際には一覧(params あり)・単体ごとの直近の所要時間から決めた値を使う。
+    書き込み（POST/PATCH/DELETE）は途中で打ち切ると反映されたか分からなくなるので、渡された timeout のまま待つ。
+    """
+    global _last_response_at
+    op = f"{method}:list" if "params" in kwargs else method
+    if not AIRTABLE_BREAKER.allow_request():
+        metrics.AIRTABLE_REQUESTS.inc(method=method, status="circuit_open")
+        raise _requests().ConnectionError("Airtable への接続を一時停止中です（連続して失敗したため）。しばらくしてから再度お試しください。")
+    admitted_at = time.monotonic()
+    if method == "GET":
+        kwargs["timeout"] = AIRTABLE_BREAKER.timeout(kwargs.get("timeout", 10), op=op)
+    started = time.perf_counter()
+    status = "error"
+    timed_out = False
+    try:
+        with timed("airtable"):
+            response = _get_http_session().request(method, url, headers=HEADERS, **kwargs)
+        status = response.status_code
+        _last_response_at = time.monotonic()
+        return response
+    except _requests().Timeout:
+        timed_out = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        if timed_out:
+            AIRTABLE_BREAKER.record_failure(elapsed, op=op, started_at=admitted_at)
+        elif status == "error" or status >= 500:
+            AIRTABLE_BREAKER.record_failure(started_at=admitted_at)
+        else:
+            AIRTABLE_BREAKER.record_success(elapsed, op=op, started_at=admitted_at)
+        metrics.AIRTABLE_REQUESTS.inc(method=method, status=status)
+        metrics.AIRTABLE_REQUEST_DURATION.observe(elapsed, method=method)
+
 def _build_airtable_url(person_id: str, record_id: str = None) -> str | None:
     """
     指定されたPersonIDとオプションのRecordIDに基づいてAirtableのテーブル/レコードURLを構築します。
@@ -44,160 +178,370 @@ def _build_airtable_url(person_id: str, record_id: str = None) -> str | None:
         return None
         
     table_name = f"TablePersonID_{person_id}"
-    base_url = f"https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{table_name}"
+    base_url = f"{AIRTABLE_API_URL}/{AIRTABLE_BASE_ID}/{table_name}"
     if record_id:
         return f"{base_url}/{record_id}"
     return base_url
 
-def create_airtable_record(person_id: str, workcord: str, workname: str, bookname: str,
-                           workoutput: int, workprocess: str, unitprice: float, workday: str):
-    """Airtableに新しいレコードを作成。成功時に当月キャッシュがあれば差分追加で更新する。"""
-    url = _build_airtable_url(person_id)
-    if not url:
-        return None, "⚠ AirtableのURL構築に失敗しました（設定不備の可能性）。", None
-
+def _extract_error_message(response) -> str:
+    """Airtableのエラーレスポンスからユーザー表示用のメッセージを取り出します。"""
+    err_msg = "詳細不明"
+    try:
+        err_detail = response.json().get('error', {})
+        if isinstance(err_detail, dict): err_msg = err_detail.get('message', '詳細不明')
+        elif isinstance(err_detail, str): err_msg = err_detail
+    except ValueError: err_msg = response.text if response.text else '詳細不明'
+    return err_msg
+
+def _build_create_fields(person_id: str, workcord: str, workname: str, bookname: str,
+                         workoutput: int, workprocess: str, unitprice: float, workday: str) -> dict:
+    """新規レコード作成用の fields を組み立てます（WorkCord は整数化、失敗時は0）。"""
     try:
         workcord_int = int(workcord) if workcord else 0
     except ValueError:
         logger.warning(f"WorkCord '{workcord}' を整数に変換できませんでした。0として扱います。 (PersonID: {person_id})")
         workcord_int = 0
+    return {
+        "WorkCord": workcord_int,
+        "WorkName": str(workname),
+        "BookName": str(bookname),
+        "WorkOutput": int(workoutput),
+        "WorkProcess": str(workprocess),
+        "UnitPrice": float(unitprice),
+        "WorkDay": workday
+    }
 
-    data = {
-        "fields": {
-            "WorkCord": workcord_int,
-            "WorkName": str(workname),
-            "BookName": str(bookname),
-            "WorkOutput": int(workoutput),
-            "WorkProcess": str(workprocess),
-            "UnitPrice": float(unitprice),
-            "WorkDay": workday
+def _append_to_month_cache(person_id: str, new_id: str, fields: dict):
+    """当月キャッシュが存在する場合のみ、作成したレコードを差分追加します（次の records でGETしない）。"""
+    try:
+        CACHE_TTL_SEC = 300
+        workday = fields["WorkDay"]
+        y = int(workday[:4]); m = int(workday[5:7])
+        key = month_key(person_id, y, m)
+        cached, version = cache_get_entry(key)
+        if cached is not None:
+            new_row = _process_record({"id": new_id, "fields": fields})
+            cached2 = list(cached) + [new_row]
+            cached2.sort(key=lambda x: x.get("WorkDay", "9999-12-31"))
+            # バージョンは元のまま（他のワーカーでの書き込みを反映していないかもしれないため）
+            cache_set(key, cached2, CACHE_TTL_SEC, version=version)
+            cache_logger.info("[CACHE WRITE-THROUGH] appended new record to %s", key)
+    except Exception as e:
+        logger.warning(f"キャッシュ差分更新に失敗（無視して継続）: {e}")
+
+def create_airtable_record(person_id: str, workcord: str, workname: str, bookname: str,
+                           workoutput: int, workprocess: str, unitprice: float, workday: str,
+                           idempotency_key: str = None):
+    """
+    新しいレコードを作成。
+    送信箱(outbox)が有効な場合はローカルに永続化して即座に (202, メッセージ, "outbox-N") を返し、
+    Airtable への送信はバックグラウンドのドレイナーが行う。無効な場合は直接 Airtable に送信する。
+    """
+    if not _build_airtable_url(person_id):
+        return None, "⚠ AirtableのURL構築に失敗しました（設定不備の可能性）。", None
+
+    fields = _build_create_fields(person_id, workcord, workname, bookname,
+                                  workoutput, workprocess, unitprice, workday)
+
+    if outbox.OUTBOX_ENABLED:
+        try:
+            row_id, created = outbox.enqueue(person_id, fields, idempotency_key)
+            logger.info("送信箱へ登録: OutboxID=%s, 新規=%s, PersonID=%s", row_id, created, person_id)
+            return 202, "✅ 送信を受け付けました（まもなく Airtable に反映されます）。", outbox.outbox_row_id(row_id)
+        except Exception as e:
+            # 送信箱が使えない場合は直接送信にフォールバック
+            logger.error(f"送信箱への登録に失敗しました。直接送信します: {e}", exc_info=True)
+
+    return _send_airtable_record(person_id, fields, idempotency_key)
+
+def _send_airtable_record(person_id: str, fields: dict, idempotency_key: str = None):
+    """
+    Airtableにレコードを1件作成し (status, message, new_id) を返す。成功時に当月キャッシュがあれば差分追加する。
+    AIRTABLE_IDEMPOTENCY_FIELD が設定されている場合は、そのフィールドに idempotency_key を入れて
+    upsert するので、同じキーで再送しても重複レコードにならない。
+    """
+    url = _build_airtable_url(person_id)
+    if not url:
+        return None, "⚠ AirtableのURL構築に失敗しました（設定不備の可能性）。", None
+
+    use_upsert = bool(AIRTABLE_IDEMPOTENCY_FIELD and idempotency_key)
+    if use_upsert:
+        data = {
+            "performUpsert": {"fieldsToMergeOn": [AIRTABLE_IDEMPOTENCY_FIELD]},
+            "records": [{"fields": {**fields, AIRTABLE_IDEMPOTENCY_FIELD: idempotency_key}}]
         }
-    }
+    else:
+        data = {"fields": fields}
 
     try:
-        logger.info(f"Airtableへのレコード作成開始: URL={url}, PersonID={person_id}")
-        response = requests.post(url, headers=HEADERS, json=data, timeout=10)
+        logger.debug("Airtableへのレコード作成開始: URL=%s, PersonID=%s", url, person_id)
+        response = _airtable_request("PATCH" if use_upsert else "POST", url, json=data, timeout=10)
         response.raise_for_status()
         resp_json = response.json()
-        new_id = resp_json.get("id")
+        if use_upsert:
+            new_id = (resp_json.get("records") or [{}])[0].get("id")
+        else:
+            new_id = resp_json.get("id")
 
         # ✅ Airtable成功コードは 200/201 両方あり得る
         status = response.status_code
         if status not in (200, 201) or not new_id:
             return status, "⚠ 送信は完了したようですがID取得に失敗しました。", None
 
-        # ✅ キャッシュが存在するなら “差分追加” して更新（次の records でGETしない）
-        try:
-            from airtable_cache import cache_get, cache_set, month_key
-            CACHE_TTL_SEC = 300
-            y = int(workday[:4]); m = int(workday[5:7])
-            key = month_key(person_id, y, m)
-            cached = cache_get(key)
-            if cached is not None:
-                new_row = {
-                    "id": new_id,
-                    "WorkDay": workday,
-                    "WorkCD": workcord_int,
-                    "WorkName": str(workname),
-                    "WorkProcess": str(workprocess),
-                    "UnitPrice": float(unitprice),
-                    "WorkOutput": int(workoutput),
-                }
-                cached2 = list(cached) + [new_row]
-                cached2.sort(key=lambda x: x.get("WorkDay", "9999-12-31"))
-                cache_set(key, cached2, CACHE_TTL_SEC)
-                logger.info(f"[CACHE WRITE-THROUGH] appended new record to {key}")
-        except Exception as e:
-            logger.warning(f"キャッシュ差分更新に失敗（無視して継続）: {e}")
+        # ✅ 書き込みバージョンを進めてから “差分追加” する（キャッシュ側のバージョンが追い越すように）
+        bump_person_version(person_id)
+        _append_to_month_cache(person_id, new_id, fields)
+        mirror.upsert_record(person_id, new_id, fields)
 
-        logger.info(f"Airtableへのレコード作成成功: ID={new_id}, PersonID={person_id}")
+        logger.info("Airtableへのレコード作成成功: ID=%s, PersonID=%s", new_id, person_id)
         return status, "✅ Airtable にデータを送信しました！", new_id
 
-    except requests.exceptions.HTTPError as http_err:
-        err_msg = "詳細不明"
-        try:
-            err_detail = http_err.response.json().get('error', {})
-            if isinstance(err_detail, dict):
-                err_msg = err_detail.get('message', '詳細不明')
-            elif isinstance(err_detail, str):
-                err_msg = err_detail
-        except ValueError:
-            err_msg = http_err.response.text if http_err.response.text else '詳細不明'
-
-        logger.error(f"Airtableレコード作成エラー (HTTPError): {http_err.response.status_code} {err_msg} - URL: {url} - Data: {data.get('fields')}")
+    except _requests().HTTPError as http_err:
+        err_msg = _extract_error_message(http_err.response)
+        logger.error(f"Airtableレコード作成エラー (HTTPError): {http_err.response.status_code} {err_msg} - URL: {url} - Data: {fields}")
         return http_err.response.status_code, f"⚠ 送信エラー (HTTP {http_err.response.status_code}): {err_msg}", None
 
-    except requests.RequestException as e:
-        logger.error(f"Airtableレコード作成エラー (RequestException): {str(e)} - URL: {url} - Data: {data.get('fields')}", exc_info=True)
+    except _requests().RequestException as e:
+        logger.error(f"Airtableレコード作成エラー (RequestException): {str(e)} - URL: {url} - Data: {fields}", exc_info=True)
         return None, f"⚠ 送信エラー: {str(e)}", None
 
+AIRTABLE_BATCH_SIZE = 10  # Airtable の1リクエストで作成できる最大件数
 
-    
+def can_upsert_batch(idempotency_keys: list = None) -> bool:
+    """create_airtable_records_batch を同じキーで再送しても重複しない（upsert になる）か。"""
+    return bool(AIRTABLE_IDEMPOTENCY_FIELD and idempotency_keys)
 
+def create_airtable_records_batch(person_id: str, fields_list: list, idempotency_keys: list = None):
+    """
+    1人分のレコードを最大 AIRTABLE_BATCH_SIZE 件まとめて作成し (status, message, [new_id, ...]) を返す。
+    成功時は fields_list と同じ順で ID が返り、当月キャッシュがあれば差分追加する。
+    AIRTABLE_IDEMPOTENCY_FIELD が設定されていて idempotency_keys（fields_list と同じ順）を渡した場合は
+    upsert するので、同じキーで再送しても重複レコードにならない。
+    """
+    if not fields_list or len(fields_list) > AIRTABLE_BATCH_SIZE:
+        return None, f"⚠ 1回に作成できるのは 1〜{AIRTABLE_BATCH_SIZE} 件です。", []
+    url = _build_airtable_url(person_id)
+    if not url:
+        return None, "⚠ AirtableのURL構築に失敗しました（設定不備の可能性）。", []
 
+    if can_upsert_batch(idempotency_keys):
+        method = "PATCH"
+        data = {
+            "performUpsert": {"fieldsToMergeOn": [AIRTABLE_IDEMPOTENCY_FIELD]},
+            "records": [{"fields": {**f, AIRTABLE_IDEMPOTENCY_FIELD: key}} for f, key in zip(fields_list, idempotency_keys)]
+        }
+    else:
+        method = "POST"
+        data = {"records": [{"fields": f} for f in fields_list]}
 
+    try:
+        response = _airtable_request(method, url, json=data, timeout=30)
+        response.raise_for_status()
+        new_ids = [r.get("id") for r in response.json().get("records", [])]
+        if len(new_ids) != len(fields_list) or not all(new_ids):
+            return response.status_code, "⚠ 送信は完了したようですがID取得に失敗しました。", []
+
+        bump_person_version(person_id)
+        for new_id, fields in zip(new_ids, fields_list):
+            _append_to_month_cache(person_id, new_id, fields)
+            mirror.upsert_record(person_id, new_id, fields)
+        logger.info("Airtableへの一括作成成功: %d件, PersonID=%s", len(new_ids), person_id)
+        return response.status_code, f"✅ {len(new_ids)} 件を Airtable に送信しました。", new_ids
+
+    except _requests().HTTPError as http_err:
+        err_msg = _extract_error_message(http_err.response)
+        logger.error("Airtable一括作成エラー (HTTPError): %s %s - PersonID=%s, %d件",
+                     http_err.response.status_code, err_msg, person_id, len(fields_list))
+        return http_err.response.status_code, f"⚠ 送信エラー (HTTP {http_err.response.status_code}): {err_msg}", []
+
+    except _requests().RequestException as e:
+        logger.error("Airtable一括作成エラー (RequestException): %s - PersonID=%s", e, person_id, exc_info=True)
+        return None, f"⚠ 送信エラー: {str(e)}", []
+
+def start_outbox_drainer():
+    """送信箱のドレイナーを起動する（キャッシュ反映は _send_airtable_record 内で行われる）。"""
+    if outbox.OUTBOX_ENABLED:
+        outbox.start_drainer(_send_airtable_record)
+
+def _mirror_fetch_pages(person_id: str, since):
+    """ミラー同期用: since（UNIX 時刻）以降に更新されたレコードを、加工せずページ単位で yield します（None なら全件）。"""
+    formula = modified_since_formula(since) if since is not None else ""
+    return iter_airtable_record_pages(person_id, formula, raw=True)
+
+def _on_mirror_changed(person_id: str, months: set):
+    """同期で行が変わった月の当月キャッシュを捨てる（次の表示でミラーから読み直す）。"""
+    for year, month in months:
+        cache_delete(month_key(person_id, year, month))
+
+def start_mirror_sync():
+    """ミラー（mirror.py）の同期スレッドを起動する（MIRROR_ENABLED=0 なら何もしない）。"""
+    if AIRTABLE_TOKEN and AIRTABLE_BASE_ID:
+        mirror.start_sync(lambda: data_services.get_cached_personid_data()[1],
+                          _mirror_fetch_pages, _on_mirror_changed)
+
+
+RECORD_FIELDS = ["WorkDay","WorkCord","WorkName","WorkProcess","UnitPrice","WorkOutput","BookName"]
+
+def _month_formula(target_year: int, target_month: int) -> str:
+    """指定年月のレコードを抽出する filterByFormula を返します。"""
+    return f"AND(YEAR({{WorkDay}})={target_year}, MONTH({{WorkDay}})={target_month})"
+
+def _process_record(record: dict) -> dict:
+    """Airtableのレコード(JSON)を records 画面用の行(dict)に変換します。"""
+    fields = record.get("fields", {})
+    return {
+        "id": record.get("id", "不明なID"),
+        "WorkDay": fields.get("WorkDay", "9999-12-31"),
+        "WorkCD": fields.get("WorkCord", "不明"),
+        "WorkName": fields.get("WorkName", "不明"),
+        "BookName": fields.get("BookName", ""),
+        "WorkProcess": fields.get("WorkProcess", "不明"),
+        "UnitPrice": fields.get("UnitPrice", "不明"),
+        "WorkOutput": fields.get("WorkOutput", "0"),
+    }
 
-def get_airtable_records_for_month(person_id: str, target_year: int, target_month: int, force_refresh: bool = False):
-    """指定されたPersonIDと年月のレコードをAirtableから取得（短TTLキャッシュ + 強制更新対応）。"""
+def modified_since_formula(since: float) -> str:
+    """since（UNIX 時刻）より後に更新されたレコードを抽出する filterByFormula を返します。"""
+    iso = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(since)) + f".{int(since * 1000) % 1000:03d}Z"
+    return f"IS_AFTER(LAST_MODIFIED_TIME(), '{iso}')"
 
-    # ✅ まずキャッシュ（強制更新でなければ）
-    key = None
-    CACHE_TTL_SEC = 10  # ← まず10秒推奨（運用により 5〜30秒で調整）
-    if not force_refresh:
-        try:
-            from airtable_cache import cache_get, cache_set, month_key
-            key = month_key(person_id, target_year, target_month)
-            cached = cache_get(key)
-            if cached is not None:
-                logger.info(f"[CACHE HIT] {key}")
-                return cached
-        except Exception as e:
-            logger.warning(f"キャッシュ参照失敗（無視）: {e}")
+def workday_range_formula(start_date, end_date_exclusive) -> str:
+    """start_date 以上 end_date_exclusive 未満の WorkDay を抽出する filterByFormula を返します。"""
+    return (f"AND(NOT(IS_BEFORE({{WorkDay}}, '{start_date:%Y-%m-%d}')), "
+            f"IS_BEFORE({{WorkDay}}, '{end_date_exclusive:%Y-%m-%d}'))")
 
+def iter_airtable_record_pages(person_id: str, formula: str, page_size: int = 100, raw: bool = False):
+    """
+    filterByFormula に一致するレコードを、Airtableのページ(最大100件)単位で
+    offset を辿りながら順に yield します（各ページは _process_record 済みの行リスト。
+    raw=True なら Airtable の {"id", "fields"} のまま）。formula が空なら全件。
+    メモリ上に全件を保持しないため、エクスポートなど件数の多い処理向けです。
+    通信エラー時は requests.RequestException（_requests().RequestException）をそのまま送出します。
+    """
     url = _build_airtable_url(person_id)
     if not url:
-        return []
+        return
 
     params = {
-        "filterByFormula": f"AND(YEAR({{WorkDay}})={target_year}, MONTH({{WorkDay}})={target_month})",
-        "fields[]": ["WorkDay","WorkCord","WorkName","WorkProcess","UnitPrice","WorkOutput","BookName"],
+        "fields[]": RECORD_FIELDS,
         "sort[0][field]": "WorkDay",
         "sort[0][direction]": "asc",
-        "pageSize": 100
+        "pageSize": page_size
     }
-
-    try:
-        response = requests.get(url, headers=HEADERS, params=params, timeout=15)
+    if formula:
+        params["filterByFormula"] = formula
+    while True:
+        response = _airtable_request("GET", url, params=params, timeout=15)
         response.raise_for_status()
-        records_data = response.json().get("records", [])
+        body = response.json()
+        records = body.get("records", [])
+        yield records if raw else [_process_record(r) for r in records]
+        offset = body.get("offset")
+        if not offset:
+            break
+        params["offset"] = offset
+
+def _month_day_range(target_year: int, target_month: int) -> tuple[str, str]:
+    """指定年月の WorkDay の範囲（初日, 翌月初日）を YYYY-MM-DD で返します。"""
+    next_year, next_month = (target_year + 1, 1) if target_month == 12 else (target_year, target_month + 1)
+    return f"{target_year:04d}-{target_month:02d}-01", f"{next_year:04d}-{next_month:02d}-01"
+
+def iter_record_pages_for_range(person_id: str, start_date, end_date_exclusive, page_size: int = 100):
+    """
+    WorkDay が start_date 以上 end_date_exclusive 未満のレコードをページ単位で yield します（エクスポート用）。
+    ミラーが使えればミラーから、使えなければ Airtable から読みます。
+    """
+    if mirror.is_ready(person_id):
+        rows = mirror.list_records(person_id, f"{start_date:%Y-%m-%d}", f"{end_date_exclusive:%Y-%m-%d}")
+        for i in range(0, len(rows), page_size):
+            yield [_process_record(r) for r in rows[i:i + page_size]]
+        return
+    yield from iter_airtable_record_pages(person_id, workday_range_formula(start_date, end_date_exclusive),
+                                          page_size)
+
+def get_airtable_records_for_month(person_id: str, target_year: int, target_month: int,
+                                   force_refresh: bool = False, min_version: int = 0):
+    """
+    指定されたPersonIDと年月のレコードをAirtableから取得（キャッシュ + 強制更新対応）。
+    min_version: 呼び出し元（セッション）が最後に行った書き込みのバージョン。
+    キャッシュのバージョンがそれ以上なら自分の書き込みは反映済みなのでキャッシュを返し、
+    遅れている場合だけ Airtable から取り直す（read-your-writes）。
+    """
+    return get_airtable_records_for_month_entry(person_id, target_year, target_month,
+                                                force_refresh=force_refresh, min_version=min_version)[0]
 
+def get_airtable_records_for_month_entry(person_id: str, target_year: int, target_month: int,
+                                         force_refresh: bool = False, min_version: int = 0):
+    """
+    get_airtable_records_for_month と同じだが、(行のリスト, 当月キャッシュの revision) を返す。
+    revision は当月キャッシュが書き換わるたびに変わるので、表示用の派生データ（描画済みの表など）の
+    キーに使える。キャッシュに保存できなかった場合は 0。
+    キャッシュが無いときは、ミラー（mirror.py）が使えればミラーから、使えなければ Airtable から読む
+    （force_refresh の場合は常に Airtable）。
+    """
+
+    # ✅ まずキャッシュ（強制更新でなければ）
+    key = month_key(person_id, target_year, target_month)
+    CACHE_TTL_SEC = MONTH_CACHE_TTL_SEC  # 自分の書き込みはバージョンで保証されるので長めでOK
+    if not force_refresh:
+        try:
+            cached, cached_version, cached_revision = cache_get_entry_revision(key)
+            if cached is not None:
+                if cached_version >= min_version:
+                    cache_logger.info("[CACHE HIT] %s", key)
+                    return cached, cached_revision
+                cache_logger.info("[CACHE BEHIND] %s version=%s < %s", key, cached_version, min_version)
+        except Exception as e:
+            logger.warning(f"キャッシュ参照失敗（無視）: {e}")
+
+    if not _build_airtable_url(person_id):
+        return [], 0
+
+    try:
+        # 取得開始時点のバージョン（取得中に他で書き込まれても「遅れ」と判定できるように）
+        fetch_version = next_version()
         processed_records = []
-        for record in records_data:
-            fields = record.get("fields", {})
-            processed_records.append({
-                "id": record.get("id", "不明なID"),
-                "WorkDay": fields.get("WorkDay", "9999-12-31"),
-                "WorkCD": fields.get("WorkCord", "不明"),
-                "WorkName": fields.get("WorkName", "不明"),
-                "WorkProcess": fields.get("WorkProcess", "不明"),
-                "UnitPrice": fields.get("UnitPrice", "不明"),
-                "WorkOutput": fields.get("WorkOutput", "0"),
-            })
-
-        # ✅ キャッシュ保存（短TTL）
+        if not force_refresh and mirror.is_ready(person_id):
+            # ✅ 自分の書き込みはミラーに即時反映済みなので、ミラーから読んでも read-your-writes は保たれる
+            processed_records = [_process_record(r) for r in
+                                 mirror.list_records(person_id, *_month_day_range(target_year, target_month))]
+            cache_logger.info("[MIRROR READ] %s rows=%d", key, len(processed_records))
+        else:
+            # ✅ 100件を超える月も取りこぼさないよう offset を辿って全ページ取得
+            for page in iter_airtable_record_pages(person_id, _month_formula(target_year, target_month)):
+                processed_records.extend(page)
+
+        # ✅ キャッシュ保存
         try:
-            from airtable_cache import cache_set, month_key
-            key = month_key(person_id, target_year, target_month)
-            cache_set(key, processed_records, CACHE_TTL_SEC)
-            logger.info(f"[CACHE SET] {key} ttl={CACHE_TTL_SEC}s")
+            revision = cache_set(key, processed_records, CACHE_TTL_SEC, version=fetch_version)
+            cache_logger.info("[CACHE SET] %s ttl=%ss", key, CACHE_TTL_SEC)
         except Exception as e:
             logger.warning(f"キャッシュ保存失敗（無視）: {e}")
+            revision = 0
 
-        return processed_records
+        return processed_records, revision
 
     except Exception as e:
         logger.error(f"Airtableレコード取得エラー: {e}", exc_info=True)
-        return []
+        return _stale_month_records(person_id, target_year, target_month)
+
+def _stale_month_records(person_id: str, target_year: int, target_month: int):
+    """
+    Airtable から取得できなかったときの代わりの (行のリスト, revision)。
+    期限切れの当月キャッシュ → 遅れているミラー の順に探し、どちらも無ければ ([], 0)。
+    """
+    stale, stale_revision = cache_get_stale(month_key(person_id, target_year, target_month))
+    if stale is not None:
+        logger.warning("Airtable から取得できないため古いキャッシュを表示します: PersonID=%s, %s-%s",
+                       person_id, target_year, target_month)
+        return stale, stale_revision
+    if mirror.is_ready(person_id, allow_stale=True):
+        logger.warning("Airtable から取得できないため同期が遅れているミラーを表示します: PersonID=%s, %s-%s",
+                       person_id, target_year, target_month)
+        # 同期で書き換わったら別の revision として扱われるよう、キャッシュには保存しない
+        return [_process_record(r) for r in
+                mirror.list_records(person_id, *_month_day_range(target_year, target_month))], 0
+    return [], 0
 
 
 
@@ -209,49 +553,90 @@ def delete_airtable_record(person_id: str, record_id: str):
         return False, "⚠ AirtableのURL構築に失敗しました（設定不備の可能性）。"
 
     try:
-        logger.info(f"Airtableレコード削除開始: URL={url}, PersonID={person_id}, RecordID={record_id}")
-        response = requests.delete(url, headers=HEADERS, timeout=10)
+        logger.debug("Airtableレコード削除開始: URL=%s, PersonID=%s, RecordID=%s", url, person_id, record_id)
+        response = _airtable_request("DELETE", url, timeout=10)
         response.raise_for_status()
-        logger.info(f"Airtableレコード削除成功: RecordID={record_id}, PersonID={person_id}")
+        cache_delete(record_key(person_id, record_id))
+        bump_person_version(person_id)
+        mirror.delete_record(person_id, record_id)
+        logger.info("Airtableレコード削除成功: RecordID=%s, PersonID=%s", record_id, person_id)
         return True, "✅ レコードを削除しました！"
-    except requests.exceptions.HTTPError as http_err:
-        err_msg = "詳細不明"
-        try:
-            err_detail = http_err.response.json().get('error', {})
-            if isinstance(err_detail, dict): err_msg = err_detail.get('message', '詳細不明')
-            elif isinstance(err_detail, str): err_msg = err_detail
-        except ValueError: err_msg = http_err.response.text if http_err.response.text else '詳細不明'
+    except _requests().HTTPError as http_err:
+        err_msg = _extract_error_message(http_err.response)
         logger.error(f"Airtableレコード削除エラー (HTTPError): {http_err.response.status_code} {err_msg} - URL: {url}")
         return False, f"❌ 削除に失敗しました (HTTP {http_err.response.status_code}): {err_msg}"
-    except requests.RequestException as e:
+    except _requests().RequestException as e:
         logger.error(f"Airtableレコード削除エラー (RequestException): {str(e)} - URL: {url}", exc_info=True)
         return False, f"❌ 削除に失敗しました: {str(e)}"
 
 def get_airtable_record_details(person_id: str, record_id: str):
     """指定されたレコードIDの詳細データをAirtableから取得します（編集画面用）。"""
+    record_data, error_message, _ = _fetch_record_details(person_id, record_id)
+    return record_data, error_message
+
+def _fetch_record_details(person_id: str, record_id: str):
+    """get_airtable_record_details の本体。(fields, エラーメッセージ, HTTP ステータス or None) を返します。"""
     url = _build_airtable_url(person_id, record_id)
     if not url:
-        return None, "⚠ AirtableのURL構築に失敗しました（設定不備の可能性）。"
+        return None, "⚠ AirtableのURL構築に失敗しました（設定不備の可能性）。", 0
 
     try:
-        logger.info(f"Airtableレコード詳細取得開始: URL={url}, PersonID={person_id}, RecordID={record_id}")
-        response = requests.get(url, headers=HEADERS, timeout=10)
+        logger.debug("Airtableレコード詳細取得開始: URL=%s, PersonID=%s, RecordID=%s", url, person_id, record_id)
+        response = _airtable_request("GET", url, timeout=10)
         response.raise_for_status()
         record_data = response.json().get("fields", {})
-        logger.info(f"Airtableレコード詳細取得成功: RecordID={record_id}, PersonID={person_id}")
-        return record_data, None # データとエラーメッセージなし
-    except requests.exceptions.HTTPError as http_err:
-        err_msg = "詳細不明"
-        try:
-            err_detail = http_err.response.json().get('error', {})
-            if isinstance(err_detail, dict): err_msg = err_detail.get('message', '詳細不明')
-            elif isinstance(err_detail, str): err_msg = err_detail
-        except ValueError: err_msg = http_err.response.text if http_err.response.text else '詳細不明'
+        logger.debug("Airtableレコード詳細取得成功: RecordID=%s, PersonID=%s", record_id, person_id)
+        return record_data, None, response.status_code # データとエラーメッセージなし
+    except _requests().HTTPError as http_err:
+        err_msg = _extract_error_message(http_err.response)
         logger.error(f"Airtableレコード詳細取得エラー (HTTPError): {http_err.response.status_code} {err_msg} - URL: {url}")
-        return None, f"❌ レコード取得に失敗しました (HTTP {http_err.response.status_code}): {err_msg}"
-    except requests.RequestException as e:
+        return None, f"❌ レコード取得に失敗しました (HTTP {http_err.response.status_code}): {err_msg}", http_err.response.status_code
+    except _requests().RequestException as e:
         logger.error(f"Airtableレコード詳細取得エラー (RequestException): {str(e)} - URL: {url}", exc_info=True)
-        return None, f"❌ レコード取得に失敗しました: {str(e)}"
+        return None, f"❌ レコード取得に失敗しました: {str(e)}", None
+
+def get_record_details_cached(person_id: str, record_id: str, year: int = None, month: int = None):
+    """
+    編集画面用のレコード詳細を返します（戻り値は get_airtable_record_details と同じ）。
+      1) 一覧表示に使った当月キャッシュ(year/month)に行があればそこから組み立てる
+      2) 単一レコード詳細キャッシュ
+      3) どちらも無ければ Airtable から取得し、詳細キャッシュに保存
+      4) Airtable に接続できなければ、期限切れの詳細キャッシュ・ミラーから
+    """
+    if year and month:
+        row = month_cache_find_record(person_id, year, month, record_id)
+        if row is not None:
+            cache_logger.info("[CACHE HIT] record %s from month cache %s-%s", record_id, year, month)
+            return {
+                "WorkDay": row.get("WorkDay"),
+                "WorkCord": row.get("WorkCD"),
+                "WorkName": row.get("WorkName"),
+                "BookName": row.get("BookName", ""),
+                "WorkProcess": row.get("WorkProcess"),
+                "UnitPrice": row.get("UnitPrice"),
+                "WorkOutput": row.get("WorkOutput"),
+            }, None
+
+    key = record_key(person_id, record_id)
+    cached = cache_get(key)
+    if cached is not None:
+        cache_logger.info("[CACHE HIT] %s", key)
+        return dict(cached), None
+
+    record_data, error_message, status = _fetch_record_details(person_id, record_id)
+    if record_data is not None and not error_message:
+        cache_set(key, record_data, RECORD_CACHE_TTL_SEC)
+        return record_data, error_message
+
+    # Airtable に接続できなかった（通信エラー・5xx）場合は、古い詳細キャッシュ・ミラーで代わりに表示する
+    if status is None or status >= 500:
+        stale, _ = cache_get_stale(key)
+        if stale is None and mirror.is_ready(person_id, allow_stale=True):
+            stale = mirror.get_record(person_id, record_id)
+        if stale is not None:
+            logger.warning("Airtable から取得できないため保存済みのレコード詳細を表示します: RecordID=%s", record_id)
+            return dict(stale), None
+    return record_data, error_message
 
 def update_airtable_record_fields(person_id: str, record_id: str, fields_to_update: dict):
     """Airtableの既存レコードの指定されたフィールドを更新します。"""
@@ -261,20 +646,18 @@ def update_airtable_record_fields(person_id: str, record_id: str, fields_to_upda
 
     data = {"fields": fields_to_update}
     try:
-        logger.info(f"Airtableレコード更新開始: URL={url}, Data={data}, PersonID={person_id}, RecordID={record_id}")
-        response = requests.patch(url, headers=HEADERS, json=data, timeout=10)
+        logger.debug("Airtableレコード更新開始: URL=%s, Data=%s, PersonID=%s, RecordID=%s", url, data, person_id, record_id)
+        response = _airtable_request("PATCH", url, json=data, timeout=10)
         response.raise_for_status()
-        logger.info(f"Airtableレコード更新成功: RecordID={record_id}, PersonID={person_id}")
+        cache_delete(record_key(person_id, record_id))
+        bump_person_version(person_id)
+        mirror.patch_record(person_id, record_id, fields_to_update)
+        logger.info("Airtableレコード更新成功: RecordID=%s, PersonID=%s", record_id, person_id)
         return True, "✅ レコードを更新しました！" # 成功時はメッセージのみを返す
-    except requests.exceptions.HTTPError as http_err:
-        err_msg = "詳細不明"
-        try:
-            err_detail = http_err.response.json().get('error', {})
-            if isinstance(err_detail, dict): err_msg = err_detail.get('message', '詳細不明')
-            elif isinstance(err_detail, str): err_msg = err_detail
-        except ValueError: err_msg = http_err.response.text if http_err.response.text else '詳細不明'
+    except _requests().HTTPError as http_err:
+        err_msg = _extract_error_message(http_err.response)
         logger.error(f"Airtableレコード更新エラー (HTTPError): {http_err.response.status_code} {err_msg} - URL: {url}")
         return False, f"❌ 更新に失敗しました (HTTP {http_err.response.status_code}): {err_msg}"
-    except requests.RequestException as e:
+    except _requests().RequestException as e:
         logger.error(f"Airtableレコード更新エラー (RequestException): {str(e)} - URL: {url}", exc_info=True)
         return False, f"❌ 更新に失敗しました: {str(e)}"
\ No newline at end of file
@@ -0,0 +1,295 @@
+# airtable_service_async.py
+"""
+airtable_service.py の非同期(asyncio + httpx)版。
+戻り値の形式は同期版と同じ:
+  - create_airtable_record        -> (status, message, new_id)
+  - get_airtable_records_for_month -> [row, ...]
+  - delete_airtable_record / update_airtable_record_fields -> (ok, message)
+  - get_airtable_record_details   -> (fields or None, error_message or None)
+
+バッチ処理やバックグラウンドタスクでは async 関数を1つのイベントループ上で
+asyncio.gather して並行実行できます。既存の Flask ルート（同期）からは
+run_sync / gather_sync を使うと、専用スレッドのイベントループ上で実行されます。
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import httpx
+
+import mirror
+from airtable_cache import (
+    cache_get_entry, cache_set, cache_delete, month_key, record_key, next_version, bump_person_version,
+    MONTH_CACHE_TTL_SEC
+)
+from airtable_service import (
+    AIRTABLE_BREAKER,
+    HEADERS,
+    RECORD_FIELDS,
+    _build_airtable_url,
+    _build_create_fields,
+    _append_to_month_cache,
+    _extract_error_message,
+    _month_day_range,
+    _month_formula,
+    _process_record,
+    _stale_month_records,
+)
+
+logger = logging.getLogger(__name__)
+
+# Airtable の API レート制限 (5 req/sec/base) を超えにくいよう、同時接続数を抑える
+MAX_CONNECTIONS = 5
+
+# イベントループごとに AsyncClient を1つ持つ（ループをまたいで共有できないため）
+_clients = weakref.WeakKeyDictionary()
+
+
+def _get_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            headers=HEADERS,
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def _request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    Airtable への非同期リクエスト。同期版 _airtable_request と同じブレーカー（AIRTABLE_BREAKER）で
+    失敗を数え、open の間は通信せずに httpx.ConnectError を送出する。GET の timeout は上限として扱い、
+    書き込みは渡された timeout のまま待つ（同期版と同じ）。
+    """
+    op = f"{method}:list" if "params" in kwargs else method
+    if not AIRTABLE_BREAKER.allow_request():
+        raise httpx.ConnectError("Airtable への接続を一時停止中です（連続して失敗したため）。")
+    admitted_at = time.monotonic()
+    if method == "GET":
+        kwargs["timeout"] = AIRTABLE_BREAKER.timeout(kwargs.get("timeout", 10), op=op)
+    started = time.perf_counter()
+    try:
+        response = await _get_client().request(method, url, **kwargs)
+    except httpx.TimeoutException:
+        AIRTABLE_BREAKER.record_failure(time.perf_counter() - started, op=op, started_at=admitted_at)
+        raise
+    except Exception:
+        AIRTABLE_BREAKER.record_failure(started_at=admitted_at)
+        raise
+    if response.status_code >= 500:
+        AIRTABLE_BREAKER.record_failure(started_at=admitted_at)
+    else:
+        AIRTABLE_BREAKER.record_success(time.perf_counter() - started, op=op, started_at=admitted_at)
+    return response
+
+
+async def create_airtable_record(person_id: str, workcord: str, workname: str, bookname: str,
+                                 workoutput: int, workprocess: str, unitprice: float, workday: str):
+    """Airtableに新しいレコードを作成（非同期版）。成功時に当月キャッシュがあれば差分追加する。"""
+    url = _build_airtable_url(person_id)
+    if not url:
+        return None, "⚠ AirtableのURL構築に失敗しました（設定不備の可能性）。", None
+
+    data = {"fields": _build_create_fields(person_id, workcord, workname, bookname,
+                                           workoutput, workprocess, unitprice, workday)}
+    try:
+        logger.info(f"[async] Airtableへのレコード作成開始: PersonID={person_id}")
+        response = await _request("POST", url, json=data, timeout=10)
+        response.raise_for_status()
+        new_id = response.json().get("id")
+
+        status = response.status_code
+        if status not in (200, 201) or not new_id:
+            return status, "⚠ 送信は完了したようですがID取得に失敗しました。", None
+
+        bump_person_version(person_id)
+        _append_to_month_cache(person_id, new_id, data["fields"])
+        mirror.upsert_record(person_id, new_id, data["fields"])
+        logger.info(f"[async] Airtableへのレコード作成成功: ID={new_id}, PersonID={person_id}")
+        return status, "✅ Airtable にデータを送信しました！", new_id
+
+    except httpx.HTTPStatusError as http_err:
+        err_msg = _extract_error_message(http_err.response)
+        logger.error(f"[async] Airtableレコード作成エラー (HTTPError): {http_err.response.status_code} {err_msg} - URL: {url}")
+        return http_err.response.status_code, f"⚠ 送信エラー (HTTP {http_err.response.status_code}): {err_msg}", None
+    except httpx.HTTPError as e:
+        logger.error(f"[async] Airtableレコード作成エラー (RequestError): {e!r} - URL: {url}", exc_info=True)
+        return None, f"⚠ 送信エラー: {str(e)}", None
+
+
+async def iter_airtable_record_pages(person_id: str, formula: str, page_size: int = 100):
+    """同期版 iter_airtable_record_pages の非同期ジェネレータ版（offset を辿ってページ単位で yield）。"""
+    url = _build_airtable_url(person_id)
+    if not url:
+        return
+
+    params = {
+        "filterByFormula": formula,
+        "fields[]": RECORD_FIELDS,
+        "sort[0][field]": "WorkDay",
+        "sort[0][direction]": "asc",
+        "pageSize": page_size
+    }
+    while True:
+        response = await _request("GET", url, params=params, timeout=15)
+        response.raise_for_status()
+        body = response.json()
+        yield [_process_record(r) for r in body.get("records", [])]
+        offset = body.get("offset")
+        if not offset:
+            break
+        params["offset"] = offset
+
+
+async def get_airtable_records_for_month(person_id: str, target_year: int, target_month: int,
+                                         force_refresh: bool = False, min_version: int = 0):
+    """
+    指定されたPersonIDと年月のレコードを取得（非同期版、キャッシュとバージョンは同期版と共有）。
+    同期版と同じく、キャッシュが無ければミラーが使えればミラーから読み、Airtable から取得できなければ
+    期限切れのキャッシュ → 遅れているミラーの順に代わりを返す。
+    """
+    key = month_key(person_id, target_year, target_month)
+    if not force_refresh:
+        cached, cached_version = cache_get_entry(key)
+        if cached is not None and cached_version >= min_version:
+            return cached
+
+    if not _build_airtable_url(person_id):
+        return []
+
+    try:
+        fetch_version = next_version()
+        processed_records = []
+        if not force_refresh and mirror.is_ready(person_id):
+            processed_records = [_process_record(r) for r in
+                                 mirror.list_records(person_id, *_month_day_range(target_year, target_month))]
+        else:
+            async for page in iter_airtable_record_pages(person_id, _month_formula(target_year, target_month)):
+                processed_records.extend(page)
+        try:
+            cache_set(key, processed_records, MONTH_CACHE_TTL_SEC, version=fetch_version)
+        except Exception as e:
+            logger.warning(f"[async] キャッシュ保存失敗（無視）: {e}")
+        return processed_records
+    except Exception as e:
+        logger.error(f"[async] Airtableレコード取得エラー: {e}", exc_info=True)
+        return _stale_month_records(person_id, target_year, target_month)[0]
+
+
+async def delete_airtable_record(person_id: str, record_id: str):
+    """指定されたレコードIDのデータをAirtableから削除します（非同期版）。"""
+    url = _build_airtable_url(person_id, record_id)
+    if not url:
+        return False, "⚠ AirtableのURL構築に失敗しました（設定不備の可能性）。"
+
+    try:
+        response = await _request("DELETE", url, timeout=10)
+        response.raise_for_status()
+        cache_delete(record_key(person_id, record_id))
+        bump_person_version(person_id)
+        mirror.delete_record(person_id, record_id)
+        logger.info(f"[async] Airtableレコード削除成功: RecordID={record_id}, PersonID={person_id}")
+        return True, "✅ レコードを削除しました！"
+    except httpx.HTTPStatusError as http_err:
+        err_msg = _extract_error_message(http_err.response)
+        logger.error(f"[async] Airtableレコード削除エラー (HTTPError): {http_err.response.status_code} {err_msg} - URL: {url}")
+        return False, f"❌ 削除に失敗しました (HTTP {http_err.response.status_code}): {err_msg}"
+    except httpx.HTTPError as e:
+        logger.error(f"[async] Airtableレコード削除エラー (RequestError): {e!r} - URL: {url}", exc_info=True)
+        return False, f"❌ 削除に失敗しました: {str(e)}"
+
+
+async def get_airtable_record_details(person_id: str, record_id: str):
+    """指定されたレコードIDの詳細データをAirtableから取得します（非同期版）。"""
+    url = _build_airtable_url(person_id, record_id)
+    if not url:
+        return None, "⚠ AirtableのURL構築に失敗しました（設定不備の可能性）。"
+
+    try:
+        response = await _request("GET", url, timeout=10)
+        response.raise_for_status()
+        return response.json().get("fields", {}), None
+    except httpx.HTTPStatusError as http_err:
+        err_msg = _extract_error_message(http_err.response)
+        logger.error(f"[async] Airtableレコード詳細取得エラー (HTTPError): {http_err.response.status_code} {err_msg} - URL: {url}")
+        return None, f"❌ レコード取得に失敗しました (HTTP {http_err.response.status_code}): {err_msg}"
+    except httpx.HTTPError as e:
+        logger.error(f"[async] Airtableレコード詳細取得エラー (RequestError): {e!r} - URL: {url}", exc_info=True)
+        return None, f"❌ レコード取得に失敗しました: {str(e)}"
+
+
+async def update_airtable_record_fields(person_id: str, record_id: str, fields_to_update: dict):
+    """Airtableの既存レコードの指定されたフィールドを更新します（非同期版）。"""
+    url = _build_airtable_url(person_id, record_id)
+    if not url:
+        return False, "⚠ AirtableのURL構築に失敗しました（設定不備の可能性）。"
+
+    try:
+        response = await _request("PATCH", url, json={"fields": fields_to_update}, timeout=10)
+        response.raise_for_status()
+        cache_delete(record_key(person_id, record_id))
+        bump_person_version(person_id)
+        mirror.patch_record(person_id, record_id, fields_to_update)
+        logger.info(f"[async] Airtableレコード更新成功: RecordID={record_id}, PersonID={person_id}")
+        return True, "✅ レコードを更新しました！"
+    except httpx.HTTPStatusError as http_err:
+        err_msg = _extract_error_message(http_err.response)
+        logger.error(f"[async] Airtableレコード更新エラー (HTTPError): {http_err.response.status_code} {err_msg} - URL: {url}")
+        return False, f"❌ 更新に失敗しました (HTTP {http_err.response.status_code}): {err_msg}"
+    except httpx.HTTPError as e:
+        logger.error(f"[async] Airtableレコード更新エラー (RequestError): {e!r} - URL: {url}", exc_info=True)
+        return False, f"❌ 更新に失敗しました: {str(e)}"
+
+
+# ===== 同期ファサード（Flask ルートなど同期コードから使う） =====
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    """専用スレッドで動き続けるイベントループを返す（初回呼び出し時に起動）。"""
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="airtable-async-loop", daemon=True)
+            thread.start()
+            _loop = loop
+        return _loop
+
+
+def run_sync(coro, timeout: float = 30):
+    """
+    コルーチンをバックグラウンドのイベントループで実行し、結果を同期的に返す。
+    timeout までに終わらなければコルーチンを取り消してから TimeoutError を送出する
+    （呼び出し元がエラーを受け取った後に、書き込みが終わってキャッシュやバージョンが変わらないように）。
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, _get_background_loop())
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise
+
+
+def gather_sync(*coros, timeout: float = 60):
+    """
+    複数のコルーチンを1つのイベントループ上で並行実行し、結果を引数順のリストで返す。
+    timeout を過ぎたら run_sync と同じく全部を取り消す。
+    """
+    async def _gather():
+        return await asyncio.gather(*coros)
+    return run_sync(_gather(), timeout)
+
+
+def reset_background_loop():
+    """fork 後の子プロセスなどで、親から引き継いだループとクライアントを破棄する。"""
+    global _loop
+    with _loop_lock:
+        _loop = None
+        _clients.clear()
@@ -1,8 +1,14 @@
 # app.py
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 import logging
 
+# 他モジュールの import 時に出るログも同じ形式・出力先になるよう、最初に設定する
+# （出力はキュー経由で専用スレッドが行う。書式・間引きの設定は logging_setup.py）
+from logging_setup import init_logging
+init_logging(logging.DEBUG if os.environ.get('FLASK_DEBUG') == '1' else logging.INFO)
+
 # データサービスモジュールから初期ロード用関数をインポート
 from data_services import (
     load_personid_data,
@@ -14,30 +20,26 @@ from data_services import (
 from blueprints.api import api_bp  # 既存のAPI Blueprint
 from blueprints.ui import ui_bp    # 新しく作成したUI Blueprint
 from blueprints.auth import auth_bp # ★★★ auth_bp をインポート ★★★
+from blueprints.ops import ops_bp   # 運用向け（/metrics など）
+from blueprints.profiling import profiling_bp  # 管理者用プロファイリング
+from airtable_service import start_outbox_drainer, start_mirror_sync
+import instrumentation
+import profiling
+import realtime
 app = Flask(__name__)
+# 本番（Procfile）ではプラットフォームのルーターを経由するので、request.remote_addr はルーターのアドレスになる。
+# 信頼するプロキシの段数だけ X-Forwarded-For / X-Forwarded-Proto を読んで利用者の IP・スキームに直す
+# （ログイン試行回数の IP ごとの制限などで使う。プロキシを通さずに公開する場合は TRUSTED_PROXY_COUNT=0）
+TRUSTED_PROXY_COUNT = int(os.environ.get("TRUSTED_PROXY_COUNT", "1"))
+if TRUSTED_PROXY_COUNT > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT, x_proto=TRUSTED_PROXY_COUNT)
 # 環境変数からSECRET_KEYを読み込む
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "a_very_strong_default_secret_key_for_dev_only_CHANGE_ME")
 
 # ===== ロギング設定 =====
-# (既存のロギング設定はそのまま、または必要に応じて調整)
-for handler in app.logger.handlers[:]: 
-    app.logger.removeHandler(handler)
-stream_handler = logging.StreamHandler()
-formatter = logging.Formatter(
-    '%(asctime)s %(levelname)s: %(message)s [in %(module)s:%(lineno)d]'
-)
-stream_handler.setFormatter(formatter)
-app.logger.addHandler(stream_handler)
-if os.environ.get('FLASK_DEBUG') == '1':
-    app.debug = True
-    app.logger.setLevel(logging.DEBUG)
-    stream_handler.setLevel(logging.DEBUG)
-else:
-    app.debug = False
-    app.logger.setLevel(logging.INFO)
-    stream_handler.setLevel(logging.INFO)
-app.logger.info("アプリケーションのロギングが初期化されました。")
-app.logger.info(f"FLASK_DEBUG: {os.environ.get('FLASK_DEBUG')}, app.debug: {app.debug}")
+app.debug = os.environ.get('FLASK_DEBUG') == '1'
+app.logger.info("アプリケーションのロギングが初期化されました。 FLASK_DEBUG=%s, app.debug=%s",
+                os.environ.get('FLASK_DEBUG'), app.debug)
 # ===== ロギング設定ここまで =====
 
 
@@ -66,10 +68,25 @@ app.logger.info(f"FLASK_DEBUG: {os.environ.get('FLASK_DEBUG')}, app.debug: {app.
 # @app.route("/get_unitprice", methods=["GET"]) def get_unitprice(): ... (削除)
 
 
+# リクエストごとのフェーズ計測（Server-Timing ヘッダ・ルート別レイテンシ集計）
+instrumentation.init_app(app)
+# 管理者が有効にしたときだけ CPU プロファイルの対象リクエストを記録する（無効時は何もしない）
+profiling.init_app(app)
+
 # Blueprint を登録
 app.register_blueprint(api_bp)  # 既存のAPI Blueprint (通常 /api プレフィックス付き)
 app.register_blueprint(ui_bp)   # 新しいUI Blueprint (プレフィックスなし)
 app.register_blueprint(auth_bp) # ★★★ auth_bp を登録 ★★★
+app.register_blueprint(ops_bp)  # 運用向け（/metrics など）
+app.register_blueprint(profiling_bp)  # 管理者用プロファイリング（/admin/profile）
+
+# records 画面へのリアルタイム通知（SocketIO。REALTIME_ENABLED=0 で無効）
+realtime.init_app(app)
+
+# 送信箱(outbox)のドレイナーを起動（OUTBOX_ENABLED=0 なら何もしない）
+start_outbox_drainer()
+# Airtable のローカルミラーの同期を起動（MIRROR_ENABLED=0 なら何もしない）
+start_mirror_sync()
 
 if __name__ == "__main__":
     app.logger.info("アプリケーション起動: 初期データキャッシュを開始します...")
@@ -0,0 +1,173 @@
+# auth_service.py
+"""
+ログイン（PIN照合）のホットパス用ヘルパー。
+
+werkzeug の check_password_hash (scrypt/pbkdf2) はわざと重い処理なので、
+  - 専用の小さなスレッドプールで実行し、同時に走る照合数と待ち行列の長さを制限する
+    （始業時のログイン集中でページ表示用のスレッドやCPUを食い潰さない）
+  - PersonID / IP ごとの試行回数を数え、上限を超えたらハッシュ計算の前に拒否する
+  - 照合に成功した (PersonID, PINハッシュ, PIN) の組を短時間だけ記憶し、再ログインではハッシュ計算を省く
+    （PIN そのものは保持せず、プロセスごとの乱数鍵による HMAC だけを保持する）
+"""
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import check_password_hash
+
+logger = logging.getLogger(__name__)
+
+HASH_WORKERS = int(os.environ.get("LOGIN_HASH_WORKERS", "2"))   # 同時に実行する照合の数
+HASH_QUEUE_LIMIT = int(os.environ.get("LOGIN_HASH_QUEUE", "8"))  # 実行待ちとして受け付ける数
+HASH_TIMEOUT_SEC = 5.0
+
+VERIFIED_CACHE_TTL_SEC = 300
+VERIFIED_CACHE_MAX = 1000
+
+ATTEMPT_WINDOW_SEC = 300
+MAX_FAILURES_PER_PERSON = 5    # PersonID ごとの失敗回数の上限（ATTEMPT_WINDOW_SEC 内）
+# IP ごとの試行回数の上限（ATTEMPT_WINDOW_SEC 内）。工場の Wi-Fi は全員が同じ IP になるので大きめに。
+# IP は app.py の ProxyFix が X-Forwarded-For から求めた利用者のもの（ルーターのアドレスではない）
+MAX_ATTEMPTS_PER_IP = int(os.environ.get("LOGIN_MAX_ATTEMPTS_PER_IP", "300"))
+
+
+class LoginBusyError(Exception):
+    """照合の待ち行列が一杯で、今は受け付けられない。"""
+
+
+# ===== 照合用スレッドプール =====
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_QUEUE_LIMIT)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="pin-hash")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+# ===== 照合成功キャッシュ =====
+_cache_secret = secrets.token_bytes(32)
+_verified = {}  # { hmac_digest: expire_at }
+_verified_lock = threading.Lock()
+
+
+def _verified_key(person_id, pin_hash: str, pin: str) -> bytes:
+    msg = f"{person_id}\0{pin_hash}\0{pin}".encode("utf-8")
+    return hmac.new(_cache_secret, msg, hashlib.sha256).digest()
+
+
+def _verified_get(key: bytes) -> bool:
+    now = time.time()
+    with _verified_lock:
+        expire_at = _verified.get(key)
+        if expire_at is None:
+            return False
+        if expire_at < now:
+            _verified.pop(key, None)
+            return False
+        return True
+
+
+def _verified_set(key: bytes):
+    now = time.time()
+    with _verified_lock:
+        if len(_verified) >= VERIFIED_CACHE_MAX:
+            for k in [k for k, exp in _verified.items() if exp < now] or list(_verified)[:VERIFIED_CACHE_MAX // 10]:
+                _verified.pop(k, None)
+        _verified[key] = now + VERIFIED_CACHE_TTL_SEC
+
+
+def verify_pin(person_id, pin_hash: str, pin: str) -> bool:
+    """
+    PIN を照合する。照合成功キャッシュにあればハッシュ計算を省略する。
+    待ち行列が一杯なら LoginBusyError を送出する。
+    """
+    if not pin_hash or not pin:
+        return False
+    key = _verified_key(person_id, pin_hash, pin)
+    if _verified_get(key):
+        return True
+
+    if not _slots.acquire(blocking=False):
+        raise LoginBusyError()
+    try:
+        future = _get_executor().submit(check_password_hash, pin_hash, pin)
+    except Exception:
+        _slots.release()
+        raise
+    # 枠はハッシュ計算が実際に終わったとき（待ち行列から取り消せたときを含む）に返す。
+    # タイムアウトで待つのをやめても、計算が始まっていれば終わるまで枠を使い続ける
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        ok = future.result(timeout=HASH_TIMEOUT_SEC)
+    except FutureTimeoutError:
+        future.cancel()
+        raise LoginBusyError()
+
+    if ok:
+        _verified_set(key)
+    return ok
+
+
+# ===== 試行回数の制限 =====
+_attempts_lock = threading.Lock()
+_failures_by_person = {}  # { person_id: deque[time] }
+_attempts_by_ip = {}      # { ip: deque[time] }
+
+
+def _prune(events: deque, now: float):
+    while events and events[0] < now - ATTEMPT_WINDOW_SEC:
+        events.popleft()
+
+
+def _sweep(table: dict, now: float):
+    """期限切れの記録しか無いキーを取り除く（辞書が際限なく大きくならないように）。"""
+    for key in list(table):
+        _prune(table[key], now)
+        if not table[key]:
+            del table[key]
+
+
+def check_login_allowed(person_id, ip: str) -> tuple[bool, int]:
+    """
+    ハッシュ計算の前に呼ぶ。(許可するか, 再試行まで待つ秒数) を返す。
+    許可した場合は IP の試行回数として記録する。
+    """
+    now = time.time()
+    with _attempts_lock:
+        if len(_attempts_by_ip) > 10000 or len(_failures_by_person) > 10000:
+            _sweep(_attempts_by_ip, now)
+            _sweep(_failures_by_person, now)
+        ip_events = _attempts_by_ip.setdefault(ip, deque())
+        _prune(ip_events, now)
+        person_events = _failures_by_person.setdefault(person_id, deque())
+        _prune(person_events, now)
+
+        if len(ip_events) >= MAX_ATTEMPTS_PER_IP:
+            return False, int(ip_events[0] + ATTEMPT_WINDOW_SEC - now) + 1
+        if len(person_events) >= MAX_FAILURES_PER_PERSON:
+            return False, int(person_events[0] + ATTEMPT_WINDOW_SEC - now) + 1
+        ip_events.append(now)
+        return True, 0
+
+
+def record_login_failure(person_id):
+    with _attempts_lock:
+        _failures_by_person.setdefault(person_id, deque()).append(time.time())
+
+
+def reset_login_failures(person_id):
+    with _attempts_lock:
+        _failures_by_person.pop(person_id, None)
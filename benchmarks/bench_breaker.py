@@ -0,0 +1,96 @@
+# benchmarks/bench_breaker.py
+"""
+Airtable が応答しなくなったときの、サーキットブレーカーと適応タイムアウトの効果を測るベンチマーク。
+Airtable は代替（fake_airtable.py）を使う。
+
+    python benchmarks/bench_breaker.py [--persons 8] [--requests 32] [--threads 8] [--hang-sec 20]
+
+  1. 平常時      : 月表示を繰り返して所要時間を観測し、適応タイムアウトがどこまで縮むかを見る
+  2. 障害時      : Airtable の応答を --hang-sec 秒遅らせ、月表示（キャッシュは期限切れ）を並行して呼ぶ。
+                   ブレーカーなし（従来の固定タイムアウト）と、ありで、1リクエストの時間と古いデータで応答できた割合を比べる
+  3. 復旧        : 遅延を戻し、half_open の試し呼び出しで closed に戻るまでの時間
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_airtable import FakeAirtable, FakeAirtableServer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--persons", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=32, help="障害時に呼ぶ月表示の回数")
+    parser.add_argument("--threads", type=int, default=8, help="同時に処理するリクエスト数（ワーカーのスレッド数）")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="平常時の応答遅延")
+    parser.add_argument("--hang-sec", type=float, default=20.0, help="障害時の応答遅延")
+    args = parser.parse_args()
+
+    today = date.today()
+    pids = [str(pid) for pid in range(1, args.persons + 1)]
+    airtable = FakeAirtable(latency_ms=args.latency_ms)
+    airtable.seed(range(1, args.persons + 1), 40, today.year, today.month)
+    server = FakeAirtableServer(airtable)
+    os.environ["AIRTABLE_API_URL"] = server.start()
+    os.environ.setdefault("AIRTABLE_TOKEN", "bench")
+    os.environ.setdefault("AIRTABLE_BASE_ID_BookSKY", "appBench")
+    os.environ["OUTBOX_ENABLED"] = "0"
+    os.environ["MIRROR_ENABLED"] = "0"
+    os.environ["AIRTABLE_BREAKER_RESET_SEC"] = "3"
+    logging.disable(logging.CRITICAL)
+
+    import airtable_service
+    from circuit_breaker import CircuitBreaker
+
+    # 毎回 Airtable から取り直す（期限切れの値は古いデータとして残る）
+    airtable_service.MONTH_CACHE_TTL_SEC = 0
+    breaker = airtable_service.AIRTABLE_BREAKER
+
+    def read(pid: str):
+        started = time.perf_counter()
+        rows, _ = airtable_service.get_airtable_records_for_month_entry(pid, today.year, today.month)
+        return time.perf_counter() - started, bool(rows)
+
+    # 1. 平常時
+    for _ in range(5):
+        for pid in pids:
+            read(pid)
+    print(f"normal: latency={args.latency_ms:.0f}ms  adaptive timeout GET:list = "
+          f"{breaker.timeout(15, op='GET:list'):.2f}s (ceiling 15s)")
+
+    # 2. 障害時
+    def outage(label: str):
+        airtable.latency_ms = args.hang_sec * 1000
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            results = list(pool.map(read, [pids[i % len(pids)] for i in range(args.requests)]))
+        elapsed = time.perf_counter() - started
+        airtable.latency_ms = args.latency_ms
+        times = sorted(t for t, _ in results)
+        served = sum(1 for _, ok in results if ok)
+        print(f"{label:<16} total {elapsed:6.2f}s  per request p50 {times[len(times) // 2]:6.2f}s  "
+              f"max {times[-1]:6.2f}s  served stale {served}/{len(results)}")
+
+    airtable_service.AIRTABLE_BREAKER = CircuitBreaker("bench-no-breaker", failure_threshold=10 ** 9)
+    outage("without breaker")
+    airtable_service.AIRTABLE_BREAKER = breaker
+    outage("with breaker")
+    print(f"{'':<16} state={breaker.state}")
+
+    # 3. 復旧
+    started = time.perf_counter()
+    while breaker.state != "closed":
+        read(pids[0])
+        time.sleep(0.1)
+    print(f"recovered to closed after {time.perf_counter() - started:.2f}s (reset {breaker.reset_sec:.0f}s)")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
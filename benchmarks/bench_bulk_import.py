@@ -0,0 +1,108 @@
+# benchmarks/bench_bulk_import.py
+"""
+CSV 一括取り込み（POST /api/import/records）と、1行ずつの登録（POST / を行数分）を比べるベンチマーク。
+Airtable / Google Sheets は代替（fake_airtable.py / fake_gspread.py）を使う。
+
+    python benchmarks/bench_bulk_import.py [--rows 200] [--persons 5] [--latency-ms 150] [--invalid-ratio 0.05]
+
+どちらも IMPORT_RATE_LIMIT_PER_SEC（既定 4 req/sec）の間隔で Airtable に送る前提で比べる
+（1行ずつの登録は同じ間隔で POST / を順に送る）。
+出力: rows/sec、Airtable 呼び出し回数、作成件数、検証エラー件数
+"""
+import argparse
+import csv
+import io
+import logging
+import os
+import random
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_airtable import FakeAirtable, FakeAirtableServer
+from fake_gspread import FakeGspreadClient, build_master_data, install
+
+COLUMNS = ["PersonID", "WorkDay", "WorkCD", "WorkName", "WorkProcess", "WorkOutput"]
+
+
+def build_rows(n: int, persons: int, invalid_ratio: float, workday: str) -> list:
+    rnd = random.Random(0)
+    rows = []
+    for i in range(n):
+        row = {"PersonID": str(rnd.randint(1, persons)), "WorkDay": workday, "WorkCD": str(100 + i % 500),
+               "WorkName": f"作業{i % 500}", "WorkProcess": rnd.choice(["製本", "断裁", "丁合"]),
+               "WorkOutput": str(rnd.randint(1, 300))}
+        if rnd.random() < invalid_ratio:
+            row["WorkProcess"] = "存在しない行程"
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--persons", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=150.0)
+    parser.add_argument("--invalid-ratio", type=float, default=0.05)
+    parser.add_argument("--rate-per-sec", type=float, default=4.0, help="IMPORT_RATE_LIMIT_PER_SEC")
+    args = parser.parse_args()
+
+    airtable = FakeAirtable(args.latency_ms)
+    server = FakeAirtableServer(airtable)
+    os.environ["AIRTABLE_API_URL"] = server.start()
+    os.environ.setdefault("AIRTABLE_TOKEN", "bench")
+    os.environ.setdefault("AIRTABLE_BASE_ID_BookSKY", "appBench")
+    os.environ["OUTBOX_ENABLED"] = "0"
+    os.environ["ADMIN_PERSON_IDS"] = "1"
+    os.environ["IMPORT_RATE_LIMIT_PER_SEC"] = str(args.rate_per_sec)
+    logging.disable(logging.ERROR)
+
+    import auth_service
+    import data_services
+    from app import app
+
+    install(data_services, FakeGspreadClient(build_master_data(persons=args.persons)))
+    auth_service.MAX_ATTEMPTS_PER_IP = 10 ** 9
+    client = app.test_client()
+    client.post("/auth/login", data={"personid": "1", "pin": "1234"})
+    rows = build_rows(args.rows, args.persons, args.invalid_ratio, date.today().isoformat())
+    print(f"rows={args.rows} persons={args.persons} latency={args.latency_ms}ms rate={args.rate_per_sec}/s")
+
+    # 1行ずつ（入力フォームを行数分送信する。フォームは行程をマスターで検証しないので不正な行もそのまま登録される）
+    airtable.reset_stats()
+    interval = 1.0 / args.rate_per_sec
+    started = time.perf_counter()
+    created = 0
+    for row in rows:
+        sent_at = time.perf_counter()
+        per_person = app.test_client()
+        per_person.post("/auth/login", data={"personid": row["PersonID"], "pin": "1234"})
+        response = per_person.post("/", data={
+            "workcd": row["WorkCD"], "workname": row["WorkName"], "workprocess": row["WorkProcess"],
+            "workoutput": row["WorkOutput"], "workday": row["WorkDay"]})
+        created += response.status_code == 302
+        time.sleep(max(0.0, interval - (time.perf_counter() - sent_at)))
+    elapsed = time.perf_counter() - started
+    print(f"{'row by row':<12} {args.rows / elapsed:8.1f} rows/s  elapsed={elapsed:6.1f}s  "
+          f"airtable calls={airtable.snapshot_stats().get('total', 0)}  created={created}")
+
+    # CSV 一括取り込み
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, COLUMNS)
+    writer.writeheader()
+    writer.writerows(rows)
+    airtable.reset_stats()
+    started = time.perf_counter()
+    response = client.post("/api/import/records", data=buf.getvalue().encode("utf-8"), content_type="text/csv")
+    elapsed = time.perf_counter() - started
+    summary = response.get_json()["summary"]
+    print(f"{'bulk import':<12} {args.rows / elapsed:8.1f} rows/s  elapsed={elapsed:6.1f}s  "
+          f"airtable calls={airtable.snapshot_stats().get('total', 0)}  created={summary['created']}  "
+          f"invalid={summary['invalid']}  batches={summary['batches']}  (server rows/sec={summary['rows_per_sec']})")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
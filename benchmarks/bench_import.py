@@ -0,0 +1,81 @@
+# benchmarks/bench_import.py
+"""
+import app にかかる時間のベンチマーク（python -X importtime の集計）。外部サービスには接続しない。
+
+    python benchmarks/bench_import.py [--runs 5] [--top 15] [--baseline <git rev>]
+
+--baseline を指定すると、そのリビジョンのツリーを一時ディレクトリに展開して同じ測定を行い、
+現在の作業ツリーと並べて出力する（例: --baseline HEAD~1 で変更前と比較）。
+出力:
+  - import app    : -X importtime による app の累積 import 時間（中央値）
+  - process       : インタプリタ起動から import 完了までのプロセス全体の時間（中央値）
+  - heavy modules : import 時に読み込まれた重い外部モジュール（gspread / oauth2client / requests / httpx）
+  - top           : 累積時間の大きい順（最後の1回分）
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ("gspread", "oauth2client", "requests", "httpx")
+SNIPPET = ("import sys; import app; "
+           "print('HEAVY=' + ','.join(sorted({m.split('.')[0] for m in sys.modules} & set(sys.argv[1:]))))")
+
+
+def measure_once(src_dir: str) -> tuple:
+    env = dict(os.environ, OUTBOX_ENABLED="0", AIRTABLE_TOKEN="bench", AIRTABLE_BASE_ID_BookSKY="appBench",
+               SERVICE_ACCOUNT_FILE=os.path.join(tempfile.gettempdir(), "no-such-service-account.json"))
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", SNIPPET, *HEAVY],
+                          cwd=src_dir, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, self_us, cumulative_us, name = [p.strip() for p in line.replace("import time:", "|", 1).split("|")]
+        rows.append((int(cumulative_us), name))
+    app_us = next((us for us, name in rows if name == "app"), 0)
+    heavy = next((line[len("HEAVY="):] for line in proc.stdout.splitlines() if line.startswith("HEAVY=")), "")
+    return app_us / 1000, elapsed * 1000, heavy, rows
+
+
+def measure(label: str, src_dir: str, runs: int, top: int):
+    measure_once(src_dir)  # .pyc を作るための1回目は集計しない
+    results = [measure_once(src_dir) for _ in range(runs)]
+    app_ms = statistics.median(r[0] for r in results)
+    process_ms = statistics.median(r[1] for r in results)
+    print(f"{label}: import app {app_ms:7.1f} ms   process {process_ms:7.1f} ms   "
+          f"heavy modules: {results[-1][2] or '(none)'}")
+    for us, name in sorted(results[-1][3], reverse=True)[:top]:
+        print(f"    {us / 1000:8.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--baseline", help="比較するリビジョン（git rev）")
+    args = parser.parse_args()
+
+    if args.baseline:
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = os.path.join(tmp, "baseline.tar")
+            subprocess.run(["git", "-C", ROOT, "archive", "-o", archive, args.baseline], check=True)
+            src = os.path.join(tmp, "src")
+            with tarfile.open(archive) as tar:
+                tar.extractall(src)
+            measure(f"baseline ({args.baseline})", src, args.runs, args.top)
+    measure("working tree", ROOT, args.runs, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# benchmarks/bench_logging.py
+"""
+ログ出力のオーバーヘッド（1リクエストあたり）を測るベンチマーク。外部サービスには接続しない。
+
+    python benchmarks/bench_logging.py [--requests 3000] [--rounds 3] [--sink-delay-us 0]
+
+次の設定で同じリクエスト（品名検索・records 表示（キャッシュヒット））を実行し、
+ログ無効との差を 1リクエストあたりのマイクロ秒で出力する:
+  - disabled          : ログ無効（基準）
+  - sync text         : 以前の構成に相当（リクエストスレッドで整形・書き込み、間引きなし）
+  - queue json        : logging_setup（キュー + 出力スレッド）、間引きなし
+  - queue json+sample : logging_setup の既定（高頻度ロガーを間引く）
+--sink-delay-us で 1書き込みあたりの遅延を与えると、stdout が詰まった場合の影響を見られる。
+"""
+import argparse
+import io
+import logging
+import os
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_airtable import FakeAirtable, FakeAirtableServer
+from fake_gspread import FakeGspreadClient, build_master_data, install
+
+
+class SlowSink(io.TextIOBase):
+    """書き込みごとに遅延する出力先（内容は捨てる）。"""
+
+    def __init__(self, delay_us: float):
+        self.delay = delay_us / 1_000_000
+        self.writes = 0
+
+    def write(self, s):
+        self.writes += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=3000, help="設定ごとのリクエスト数（2種類を交互に実行）")
+    parser.add_argument("--sink-delay-us", type=float, default=0.0)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    today = date.today()
+    airtable = FakeAirtable()
+    airtable.seed([1], 40, today.year, today.month)
+    server = FakeAirtableServer(airtable)
+    os.environ["AIRTABLE_API_URL"] = server.start()
+    os.environ.setdefault("AIRTABLE_TOKEN", "bench")
+    os.environ.setdefault("AIRTABLE_BASE_ID_BookSKY", "appBench")
+    os.environ["OUTBOX_ENABLED"] = "0"
+
+    import data_services
+    import logging_setup
+    from app import app
+
+    install(data_services, FakeGspreadClient(build_master_data(persons=1)))
+    client = app.test_client()
+    client.post("/auth/login", data={"personid": "1", "pin": "1234"})
+    records_url = f"/records/{today.year}/{today.month}"
+    client.get(records_url)  # 当月キャッシュを作る
+
+    def run() -> float:
+        started = time.perf_counter()
+        for i in range(args.requests // 2):
+            client.get(f"/api/get_worknames?workcd={100 + i % 900}")
+            client.get(records_url)
+        return (time.perf_counter() - started) / (args.requests // 2 * 2)
+
+    def configure(name: str) -> SlowSink:
+        sink = SlowSink(args.sink_delay_us)
+        logging.disable(logging.NOTSET)
+        if name == "disabled":
+            logging.disable(logging.CRITICAL)
+        elif name == "sync text":
+            logging_setup.shutdown_logging()
+            root = logging.getLogger()
+            for handler in root.handlers[:]:
+                root.removeHandler(handler)
+            handler = logging.StreamHandler(sink)
+            handler.setFormatter(logging.Formatter(logging_setup.TEXT_FORMAT))
+            root.addHandler(handler)
+            root.setLevel(logging.INFO)
+        elif name == "queue json":
+            logging_setup.init_logging(logging.INFO, "json", sink, sample_rates={})
+        else:
+            logging_setup.init_logging(logging.INFO, "json", sink)
+        return sink
+
+    configure("disabled")
+    run()  # ウォームアップ
+    names = ("disabled", "sync text", "queue json", "queue json+sample")
+    best, lines = {}, {}
+    for _ in range(args.rounds):  # 設定を交互に繰り返し、各設定の最小値を採る（ノイズ対策）
+        for name in names:
+            sink = configure(name)
+            per_request = run()
+            logging_setup.shutdown_logging()  # キューに残った分を書き出してから書き込み回数を数える
+            best[name] = min(best.get(name, per_request), per_request)
+            lines[name] = sink.writes / args.requests
+    logging.disable(logging.NOTSET)
+    for name in names:
+        print(f"{name:<18} {best[name] * 1e6:9.1f} us/req  overhead={(best[name] - best['disabled']) * 1e6:8.1f} us/req  "
+              f"lines/req={lines[name]:.2f}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# benchmarks/bench_login.py
+"""
+ログイン（PIN照合）の処理能力を測るベンチマーク。Google Sheets / Airtable には接続しない。
+
+    python benchmarks/bench_login.py [--seconds 5] [--threads 8]
+
+出力:
+  - raw check_password_hash        : werkzeug のハッシュ照合そのもの（1スレッド = 1コアあたり）
+  - verify_pin (cold)              : 照合成功キャッシュなし、専用プール経由
+  - verify_pin (cached)            : 照合成功キャッシュあり（再ログイン）
+  - /auth/login POST (Flask client): 試行回数チェック・セッション発行まで含めたエンドツーエンド
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+import auth_service
+
+
+def _run(label, func, seconds, threads=1):
+    count = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        nonlocal count
+        n = 0
+        while time.perf_counter() < deadline:
+            func()
+            n += 1
+        with lock:
+            count += n
+
+    ts = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {count / elapsed:10.1f} /sec  (threads={threads})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    pin_hash = generate_password_hash("1234")
+    print(f"hash method: {pin_hash.split('$', 1)[0]}, cpu_count={os.cpu_count()}, "
+          f"LOGIN_HASH_WORKERS={auth_service.HASH_WORKERS}")
+
+    _run("raw check_password_hash", lambda: check_password_hash(pin_hash, "1234"), args.seconds)
+
+    def cold():
+        auth_service._verified.clear()
+        try:
+            auth_service.verify_pin(1, pin_hash, "1234")
+        except auth_service.LoginBusyError:
+            pass
+    _run("verify_pin (cold, bounded pool)", cold, args.seconds, args.threads)
+
+    auth_service.verify_pin(1, pin_hash, "1234")
+    _run("verify_pin (cached)", lambda: auth_service.verify_pin(1, pin_hash, "1234"), args.seconds, args.threads)
+
+    os.environ.setdefault("OUTBOX_ENABLED", "0")
+    import data_services
+    from app import app
+    app.logger.setLevel(logging.WARNING)  # ログ出力のコストを測定に含めない
+    data_services.PERSON_ID_DICT = {1: {"name": "bench", "pin_hash": pin_hash}}
+    data_services.PERSON_ID_LIST = [1]
+    data_services.last_personid_load_time = time.time()
+    auth_service.MAX_ATTEMPTS_PER_IP = 10 ** 9
+
+    def login():
+        with app.test_client() as c:
+            c.post("/auth/login", data={"personid": "1", "pin": "1234"})
+    _run("/auth/login POST (cached verify)", login, args.seconds, args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# benchmarks/bench_mirror.py
+"""
+ローカルミラー（mirror.py）の同期の速さと、月表示の読み出しの速さを測るベンチマーク。
+Airtable は代替（fake_airtable.py）を使う。
+
+    python benchmarks/bench_mirror.py [--persons 20] [--records 200] [--latency-ms 150] [--rate-limit 5]
+
+  1. 全件同期        : 全員分を取り込む時間と件数/秒
+  2. 差分同期        : 一部の行を更新・追加した後、更新分だけを取り込む時間と取得件数（全件との比較）
+  3. 削除の反映      : Airtable で削除した行が、差分同期では残り、全件同期で消えること
+  4. 月表示（キャッシュなし）: Airtable から読む場合とミラーから読む場合の1回あたりの時間
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_airtable import FakeAirtable, FakeAirtableServer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--persons", type=int, default=20)
+    parser.add_argument("--records", type=int, default=200, help="1人・1か月あたりのレコード数（3か月分作る）")
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Airtable 代替の応答遅延")
+    parser.add_argument("--rate-limit", type=float, default=5.0, help="同期の送信レート（req/sec、0 で無制限）")
+    parser.add_argument("--changes", type=int, default=30, help="差分同期の前に更新・追加する行数")
+    args = parser.parse_args()
+
+    this_month = date.today().replace(day=1)
+    months = [this_month, (this_month - timedelta(days=1)).replace(day=1)]
+    months.append((months[1] - timedelta(days=1)).replace(day=1))
+    pids = list(range(1, args.persons + 1))
+    airtable = FakeAirtable(latency_ms=args.latency_ms)
+    for m in months:
+        airtable.seed(pids, args.records, m.year, m.month)
+    server = FakeAirtableServer(airtable)
+    os.environ["AIRTABLE_API_URL"] = server.start()
+    os.environ.setdefault("AIRTABLE_TOKEN", "bench")
+    os.environ.setdefault("AIRTABLE_BASE_ID_BookSKY", "appBench")
+    os.environ["OUTBOX_ENABLED"] = "0"
+    os.environ["MIRROR_DB_PATH"] = os.path.join(tempfile.mkdtemp(), "mirror.sqlite3")
+    logging.disable(logging.WARNING)
+
+    import airtable_service
+    import mirror
+    from airtable_cache import cache_delete, month_key
+    from ratelimit import RateLimiter
+
+    limiter = RateLimiter(args.rate_limit)
+    # 初期データは直前に作ったばかりなので、差分取得の重なり（既定60秒）を縮めないと全件が差分に入ってしまう
+    mirror.CURSOR_OVERLAP_SEC = 0.5
+    time.sleep(1.0)
+    total_rows = args.persons * args.records * len(months)
+    print(f"persons={args.persons} rows={total_rows} latency={args.latency_ms:.0f}ms rate_limit={args.rate_limit}/s")
+
+    def run_round(label: str):
+        airtable.reset_stats()
+        started = time.perf_counter()
+        totals = mirror.sync_round(pids, airtable_service._mirror_fetch_pages, limiter=limiter)
+        elapsed = time.perf_counter() - started
+        summary = {k: sum(t[k] for t in totals.values()) for k in ("fetched", "changed", "deleted")}
+        print(f"{label:<12} {elapsed:7.2f}s  GET={airtable.snapshot_stats().get('GET', 0):4d}  "
+              f"fetched={summary['fetched']:6d} ({summary['fetched'] / elapsed:8.1f} rows/s)  "
+              f"changed={summary['changed']:5d}  deleted={summary['deleted']:4d}")
+        return summary
+
+    # 1. 全件同期
+    run_round("full")
+
+    # 2. 差分同期（更新と追加。同期の遅れ = 変更してから差分同期が終わるまで）
+    rnd = random.Random(1)
+    changed_at = time.perf_counter()
+    for i in range(args.changes):
+        table = f"TablePersonID_{rnd.choice(pids)}"
+        if i % 3 == 0:
+            airtable.create(table, {"WorkDay": this_month.isoformat(), "WorkCord": 101, "WorkName": "追加",
+                                    "WorkProcess": "製本", "UnitPrice": 1.5, "WorkOutput": 1})
+        else:
+            record_id = rnd.choice(list(airtable._tables[table]))
+            airtable.patch(table, record_id, {"fields": {"WorkOutput": rnd.randrange(1, 500)}})
+    summary = run_round("incremental")
+    print(f"{'':<12} lag after {args.changes} changes: {time.perf_counter() - changed_at:.2f}s "
+          f"(+ up to {mirror.MIRROR_SYNC_INTERVAL_SEC:.0f}s sync interval)")
+
+    # 3. 削除の反映
+    table = f"TablePersonID_{pids[0]}"
+    for record_id in list(airtable._tables[table])[:5]:
+        airtable.delete(table, record_id)
+    run_round("incremental")
+    mirror._connect().execute("UPDATE sync_state SET last_full_at = 1")  # 全件同期の時期にする
+    run_round("full")
+
+    # 4. 月表示（キャッシュなし）
+    def cold_read(use_mirror: bool) -> float:
+        mirror.MIRROR_ENABLED = use_mirror
+        started = time.perf_counter()
+        for pid in pids:
+            cache_delete(month_key(str(pid), this_month.year, this_month.month))
+            rows, _ = airtable_service.get_airtable_records_for_month_entry(str(pid), this_month.year,
+                                                                            this_month.month)
+            assert len(rows) >= args.records - 5
+        return (time.perf_counter() - started) / len(pids)
+
+    airtable_read, mirror_read = cold_read(False), cold_read(True)
+    print(f"cold month read: airtable {airtable_read * 1000:7.2f} ms   mirror {mirror_read * 1000:7.2f} ms   "
+          f"({airtable_read / mirror_read:.0f}x)")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
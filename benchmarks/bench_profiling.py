@@ -0,0 +1,101 @@
+# benchmarks/bench_profiling.py
+"""
+プロファイラー（profiling.py）を有効にしたときのオーバーヘッドを測るベンチマーク。
+Airtable・Google Sheets は代替（fake_airtable.py / fake_gspread.py）を使う。
+
+    python benchmarks/bench_profiling.py [--requests 1000] [--threads 4] [--interval-ms 10]
+
+records (warm) と worknames を次の状態で実行し、スループットと p50/p95/p99 を比べる:
+  - off        : 何も有効にしない（フックの真偽値の確認だけ）
+  - cpu        : CPU サンプリング（時間指定。全リクエストを interval ごとに採取）
+  - tracemalloc: メモリ追跡（frames=10）
+最後に、CPU プロファイルの collapsed 形式の先頭と、tracemalloc の差分の上位を表示する。
+"""
+import argparse
+import collections
+import logging
+import os
+import sys
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_routes import run_scenario
+from fake_airtable import FakeAirtable, FakeAirtableServer
+from fake_gspread import FakeGspreadClient, build_master_data, install
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000, help="シナリオごとのリクエスト数")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--interval-ms", type=float, default=10.0, help="CPU サンプリングの間隔")
+    parser.add_argument("--persons", type=int, default=20)
+    args = parser.parse_args()
+
+    today = date.today()
+    airtable = FakeAirtable(latency_ms=20.0)
+    airtable.seed(range(1, args.persons + 1), 40, today.year, today.month)
+    server = FakeAirtableServer(airtable)
+    os.environ["AIRTABLE_API_URL"] = server.start()
+    os.environ.setdefault("AIRTABLE_TOKEN", "bench")
+    os.environ.setdefault("AIRTABLE_BASE_ID_BookSKY", "appBench")
+    os.environ["OUTBOX_ENABLED"] = "0"
+    os.environ["MIRROR_ENABLED"] = "0"
+    logging.disable(logging.ERROR)
+
+    import auth_service
+    import data_services
+    import profiling
+    from app import app
+
+    install(data_services, FakeGspreadClient(build_master_data(persons=args.persons)))
+    auth_service.MAX_ATTEMPTS_PER_IP = 10 ** 9
+    records_url = f"/records/{today.year}/{today.month}"
+
+    def logged_in_client(t):
+        client = app.test_client()
+        client.post("/auth/login", data={"personid": str(t % args.persons + 1), "pin": "1234"})
+        return client
+
+    def records_warm(client, i):
+        return client.get(records_url)
+
+    def worknames(client, i):
+        return client.get(f"/api/get_worknames?workcd={100 + i % 900}")
+
+    def run_all(label: str):
+        run_scenario(f"records {label}", logged_in_client, records_warm, args.requests, args.threads, airtable)
+        run_scenario(f"worknames {label}", logged_in_client, worknames, args.requests, args.threads, airtable)
+
+    run_all("off")  # 1回目はキャッシュを温めるため捨てる
+    print("-" * 40)
+    run_all("off")
+
+    profiling.start_cpu_profile(seconds=profiling.PROFILE_MAX_SEC, interval_ms=args.interval_ms)
+    run_all("cpu")
+    profiling.stop_cpu_profile()
+
+    profiling.start_memory_trace(10)
+    run_all("tracemalloc")
+    diff = profiling.memory_diff(top=5)
+    profiling.stop_memory_trace()
+
+    status = profiling.get_cpu_profile()
+    print(f"\ncpu profile: samples={status['samples']} cpu={status['cpu_ms']}ms "
+          f"wall={status['wall_ms']}ms stacks={status['stacks']}")
+    # 末尾（最も内側）の関数ごとに合計した上位
+    leaves = collections.Counter()
+    for line in profiling.collapsed_stacks("cpu").splitlines():
+        frames, micros = line.rsplit(" ", 1)
+        leaves[frames.rsplit(";", 1)[-1]] += int(micros)
+    for leaf, micros in leaves.most_common(5):
+        print(f"  {micros / 1000:9.1f} ms  {leaf}")
+    print(f"tracemalloc: +{diff['total_diff_kb']:.1f} KiB (overhead {diff['tracemalloc_overhead_kb']:.1f} KiB)")
+    for item in diff["top"]:
+        print(f"  {item['size_diff_kb']:+9.1f} KiB  {item['count_diff']:+7d}  {item['site']}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
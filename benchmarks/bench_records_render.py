@@ -0,0 +1,86 @@
+# benchmarks/bench_records_render.py
+"""
+records 画面の表（明細・集計）の描画キャッシュの効果を測るベンチマーク。
+Airtable / Google Sheets は代替（fake_airtable.py / fake_gspread.py）を使う。
+
+    python benchmarks/bench_records_render.py [--records 300] [--requests 300] [--rounds 3]
+
+当月キャッシュが温まった状態で、次の2つのシナリオを描画キャッシュの有効・無効で比べる:
+  - repeat    : 同じ月を繰り返し表示
+  - prev/next : 3か月分を前月・次月と行き来する
+出力: 1リクエストあたりの時間と、records_table_render_seconds から求めた表の描画時間（hit / miss の平均）
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_airtable import FakeAirtable, FakeAirtableServer
+from fake_gspread import FakeGspreadClient, build_master_data, install
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=300, help="1か月あたりのレコード数")
+    parser.add_argument("--requests", type=int, default=300, help="シナリオごとのリクエスト数")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    this_month = date.today().replace(day=1)
+    months = [this_month, (this_month - timedelta(days=1)).replace(day=1)]
+    months.append((months[1] - timedelta(days=1)).replace(day=1))
+    airtable = FakeAirtable()
+    for m in months:
+        airtable.seed([1], args.records, m.year, m.month)
+    server = FakeAirtableServer(airtable)
+    os.environ["AIRTABLE_API_URL"] = server.start()
+    os.environ.setdefault("AIRTABLE_TOKEN", "bench")
+    os.environ.setdefault("AIRTABLE_BASE_ID_BookSKY", "appBench")
+    os.environ["OUTBOX_ENABLED"] = "0"
+    logging.disable(logging.ERROR)
+
+    import data_services
+    import metrics
+    from app import app
+    from blueprints import ui
+
+    install(data_services, FakeGspreadClient(build_master_data(persons=1)))
+    client = app.test_client()
+    client.post("/auth/login", data={"personid": "1", "pin": "1234"})
+    urls = [f"/records/{m.year}/{m.month}" for m in months]
+    for url in urls:
+        client.get(url)  # 当月キャッシュを作る
+
+    def run(paths: list) -> float:
+        started = time.perf_counter()
+        for i in range(args.requests):
+            client.get(paths[i % len(paths)])
+        return (time.perf_counter() - started) / args.requests
+
+    def render_avg(result: str) -> float:
+        entry = metrics.RECORDS_TABLE_RENDER._values.get((result,))
+        return entry["sum"] / entry["count"] * 1000 if entry and entry["count"] else 0.0
+
+    print(f"records/month={args.records} requests={args.requests}")
+    scenarios = (("repeat", urls[:1]), ("prev/next", urls + urls[-2:0:-1]))
+    for label, paths in scenarios:
+        best = {}
+        for _ in range(args.rounds):  # 有効・無効を交互に繰り返し、最小値を採る（ノイズ対策）
+            for enabled in (False, True):
+                ui.RECORDS_FRAGMENT_CACHE = enabled
+                run(paths)  # 描画キャッシュを作る（無効時はウォームアップ）
+                per_request = run(paths)
+                best[enabled] = min(best.get(enabled, per_request), per_request)
+        print(f"{label:<10} no cache {best[False] * 1000:7.2f} ms/req   fragment cache {best[True] * 1000:7.2f} ms/req   "
+              f"saved {(best[False] - best[True]) * 1000:6.2f} ms/req ({(1 - best[True] / best[False]) * 100:4.1f}%)")
+    print(f"table render avg: miss/disabled {max(render_avg('miss'), render_avg('disabled')):.3f} ms   "
+          f"hit {render_avg('hit'):.3f} ms")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# benchmarks/bench_routes.py
+"""
+主要ルートのベンチマーク。ローカルの Airtable 代替サーバー（fake_airtable.py）と
+gspread 代替（fake_gspread.py）を使うので、本物のサービスには接続しない。
+
+    python benchmarks/bench_routes.py [--requests 300] [--threads 4] [--latency-ms 150] [--rate-limit 0]
+
+Flask のテストクライアントで次のシナリオを実行し、スループットと p50/p95/p99 を出力する:
+  - login              : POST /auth/login（照合成功キャッシュあり）
+  - index POST         : POST /（1件登録。OUTBOX_ENABLED=0 なら Airtable へ直接送信）
+  - records (warm)     : GET /records/<y>/<m>（当月キャッシュあり）
+  - records (cold)     : GET /records/<y>/<m>（毎回キャッシュを消して Airtable から取得）
+  - worknames          : GET /api/get_worknames?workcd=...
+「airtable/req」は 1 リクエストあたりの Airtable 呼び出し回数（代替サーバーの集計値）。
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_airtable import FakeAirtable, FakeAirtableServer
+from fake_gspread import FakeGspreadClient, build_master_data, install
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(label, make_client, step, total_requests, threads, airtable: FakeAirtable):
+    """
+    threads 本のスレッドで合計 total_requests 回 step(client, i) を実行し、結果を1行で出力する。
+    step は Flask のレスポンスを返す。ステータスが 400 以上ならエラーとして数える。
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    counter = iter(range(total_requests))
+    clients = [make_client(t) for t in range(threads)]
+    airtable.reset_stats()
+
+    def worker(client):
+        nonlocal errors
+        local, local_errors = [], 0
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            started = time.perf_counter()
+            response = step(client, i)
+            local.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors += local_errors
+
+    ts = [threading.Thread(target=worker, args=(c,)) for c in clients]
+    started = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    calls = airtable.snapshot_stats().get("total", 0)
+    print(f"{label:<18} {len(latencies) / elapsed:9.1f} req/s  "
+          f"p50={percentile(latencies, 0.50) * 1000:7.1f}ms  "
+          f"p95={percentile(latencies, 0.95) * 1000:7.1f}ms  "
+          f"p99={percentile(latencies, 0.99) * 1000:7.1f}ms  "
+          f"errors={errors}  airtable/req={calls / max(1, len(latencies)):.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300, help="シナリオごとのリクエスト数")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Airtable 代替の応答遅延")
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="429 を返す割合 (0.0〜1.0)")
+    parser.add_argument("--persons", type=int, default=50)
+    parser.add_argument("--records", type=int, default=40, help="PersonID ごとの当月レコード数")
+    parser.add_argument("--outbox", action="store_true", help="送信箱を有効にして index POST を測る")
+    args = parser.parse_args()
+
+    today = date.today()
+    airtable = FakeAirtable(args.latency_ms, args.jitter_ms, args.rate_limit)
+    airtable.seed(range(1, args.persons + 1), args.records, today.year, today.month)
+    server = FakeAirtableServer(airtable)
+    api_url = server.start()
+
+    # アプリの import より前に接続先を設定する
+    os.environ["AIRTABLE_API_URL"] = api_url
+    os.environ.setdefault("AIRTABLE_TOKEN", "bench")
+    os.environ.setdefault("AIRTABLE_BASE_ID_BookSKY", "appBench")
+    os.environ["OUTBOX_ENABLED"] = "1" if args.outbox else "0"
+    if args.outbox:
+        os.environ.setdefault("OUTBOX_DB_PATH", os.path.join(tempfile.gettempdir(), "bench_outbox.sqlite3"))
+    # ログ出力のコストを測定に含めない（429 注入時のエラーログも件数は airtable/req に表れる）
+    logging.disable(logging.ERROR)
+
+    import airtable_cache
+    import auth_service
+    import data_services
+    from app import app
+
+    install(data_services, FakeGspreadClient(build_master_data(persons=args.persons)))
+    auth_service.MAX_ATTEMPTS_PER_IP = 10 ** 9
+    print(f"fake Airtable: {api_url}  latency={args.latency_ms}±{args.jitter_ms}ms  "
+          f"rate_limit={args.rate_limit}  threads={args.threads}  outbox={args.outbox}")
+
+    def anonymous_client(t):
+        return app.test_client()
+
+    def logged_in_client(t):
+        client = app.test_client()
+        client.post("/auth/login", data={"personid": str(t % args.persons + 1), "pin": "1234"})
+        return client
+
+    def login(client, i):
+        with app.test_client() as c:
+            return c.post("/auth/login", data={"personid": str(i % args.persons + 1), "pin": "1234"})
+
+    def index_post(client, i):
+        return client.post("/", data={
+            "workcd": "100", "workname": "作業0", "bookname_hidden": "書籍0",
+            "workoutput": str(i % 50 + 1), "workprocess": "製本", "workday": today.isoformat(),
+        })
+
+    records_url = f"/records/{today.year}/{today.month}"
+
+    def records_warm(client, i):
+        return client.get(records_url)
+
+    def records_cold(client, i):
+        airtable_cache._cache.clear()
+        return client.get(records_url)
+
+    def worknames(client, i):
+        return client.get(f"/api/get_worknames?workcd={100 + i % 900}")
+
+    # 照合成功キャッシュを温めておく（scrypt のコストは bench_login.py で別に測る）
+    for t in range(args.persons):
+        logged_in_client(t)
+
+    run_scenario("login", anonymous_client, login, args.requests, args.threads, airtable)
+    run_scenario("index POST", logged_in_client, index_post, args.requests, args.threads, airtable)
+    run_scenario("records (warm)", logged_in_client, records_warm, args.requests, args.threads, airtable)
+    run_scenario("records (cold)", logged_in_client, records_cold, args.requests, args.threads, airtable)
+    run_scenario("worknames", anonymous_client, worknames, args.requests, args.threads, airtable)
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# benchmarks/bench_search.py
+"""
+品名・書名検索のインデックス（search_index.py）の作成時間・メモリ・検索時間を測るベンチマーク。
+
+    python benchmarks/bench_search.py [--entries 100000] [--queries 2000] [--limit 30]
+
+  1. 作成      : --entries 件の WorkCord データ（漢字・ひらがな・カタカナ・英数字の書名。半角カナ・全角英数字を含む）
+                 からインデックスを作る時間と、tracemalloc で測ったメモリ（インデックス分）
+  2. 検索      : 項目の一部（2〜6文字。半分はカタカナ ⇔ ひらがな・全角 ⇔ 半角を入れ替える）で検索し、p50/p95/p99
+  3. 比較      : 同じ検索語で全件を調べる場合（正規化済みの文字列に対する in）。結果の件数が一致することも確かめる
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+import unicodedata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search_index
+
+KANJI = ["製本", "断裁", "上巻", "下巻", "日本", "歴史", "物語", "辞典", "図鑑", "教科書", "問題集", "文学",
+         "数学", "科学", "世界", "旅行", "料理", "入門", "完全", "改訂", "新版", "年鑑", "地図", "全集"]
+HIRAGANA = ["こども", "はじめて", "やさしい", "たのしい", "ことば", "おはなし", "さんすう", "えほん", "どうぶつ"]
+KATAKANA = ["ガイド", "ブック", "ドリル", "テキスト", "ワーク", "ノート", "カタログ", "パズル", "レシピ", "マップ"]
+LATIN = ["Python", "Java", "SQL", "Web", "AI", "DX", "Excel", "2024", "第2版", "vol.3"]
+
+
+def make_title(rnd: random.Random) -> str:
+    words = [rnd.choice(rnd.choice((KANJI, KANJI, HIRAGANA, KATAKANA, LATIN))) for _ in range(rnd.randint(2, 4))]
+    title = rnd.choice(("", " ", "・")).join(words)
+    if rnd.random() < 0.2:  # 半角カナ・全角英数字で登録されたもの
+        title = "".join(_HANKAKU.get(ch, ch) for ch in title) if rnd.random() < 0.5 else title.translate(_ZENKAKU)
+    return title
+
+
+# 全角カナ → 半角カナ（NFKC の逆。濁点付きは2文字になる）
+_HANKAKU = {}
+for code in range(0xFF66, 0xFF9E):
+    full = unicodedata.normalize("NFKC", chr(code))
+    _HANKAKU[full] = chr(code)
+    for mark, han in (("゙", "ﾞ"), ("゚", "ﾟ")):
+        voiced = unicodedata.normalize("NFC", full + mark)
+        if len(voiced) == 1:
+            _HANKAKU[voiced] = chr(code) + han
+_ZENKAKU = {code: code + 0xFEE0 for code in range(0x21, 0x7F)}
+
+
+def vary(query: str, rnd: random.Random) -> str:
+    """入力の揺れ（カタカナ ⇔ ひらがな、全角 ⇔ 半角）。"""
+    choice = rnd.random()
+    if choice < 0.25:
+        return "".join(chr(ord(ch) + 0x60) if "ぁ" <= ch <= "ゖ" else ch for ch in query)
+    if choice < 0.5:
+        return "".join(chr(ord(ch) - 0x60) if "ァ" <= ch <= "ヶ" else ch for ch in query)
+    if choice < 0.6:
+        return query.translate(_ZENKAKU)
+    return query
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=30)
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    workcord_dict = {}
+    for i in range(args.entries):
+        workcord_dict.setdefault(str(100000 + i // 2), []).append(
+            {"workname": make_title(rnd), "bookname": make_title(rnd) if rnd.random() < 0.7 else ""})
+
+    # 1. 作成
+    tracemalloc.start()
+    index = search_index.SearchIndex(workcord_dict)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # tracemalloc 中は遅くなるので、時間はもう一度測る
+    started = time.perf_counter()
+    index = search_index.SearchIndex(workcord_dict)
+    build_sec = time.perf_counter() - started
+    stats = index.stats()
+    print(f"build: entries={stats['entries']} grams={sum(stats['grams'].values())} postings={stats['postings']}  "
+          f"{build_sec * 1000:.0f} ms  memory {current / 2 ** 20:.1f} MiB (peak {peak / 2 ** 20:.1f} MiB)")
+
+    # 2. 検索
+    queries = []
+    for _ in range(args.queries):
+        code, workname, bookname = index.entries[rnd.randrange(len(index.entries))]
+        text = rnd.choice([workname, workname, bookname or workname])
+        length = rnd.randint(2, 6)
+        start = rnd.randrange(max(1, len(text) - length + 1))
+        queries.append(vary(text[start:start + length], rnd))
+
+    def measure(func) -> list:
+        times = []
+        for query in queries:
+            started = time.perf_counter()
+            func(query)
+            times.append(time.perf_counter() - started)
+        return sorted(times)
+
+    indexed = measure(lambda q: index.search(q, args.limit))
+
+    # 3. 比較（全件の部分一致。正規化は済ませておく）
+    texts = index.texts
+
+    def linear(query):
+        q = search_index.normalize(query)
+        return [i for i, (code, workname, bookname) in enumerate(texts)
+                if code.startswith(q) or q in workname or q in bookname]
+
+    scanned = measure(linear)
+    matched = []
+    for query in queries[:200]:
+        expected = linear(query)
+        results, more = index.search(query, args.limit)
+        assert len(results) == min(len(expected), args.limit) and more == (len(expected) > args.limit), query
+        matched.append(len(expected))
+    for label, times in (("index", indexed), ("linear scan", scanned)):
+        print(f"{label:<12} p50={percentile(times, 0.5) * 1000:8.3f}ms  p95={percentile(times, 0.95) * 1000:8.3f}ms  "
+              f"p99={percentile(times, 0.99) * 1000:8.3f}ms  max={times[-1] * 1000:8.3f}ms")
+    matched.sort()
+    print(f"matches per query (limit {args.limit}): p50={percentile(matched, 0.5)}  "
+          f"p95={percentile(matched, 0.95)}  max={matched[-1]}")
+
+
+if __name__ == "__main__":
+    main()
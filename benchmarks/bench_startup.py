@@ -0,0 +1,112 @@
+# benchmarks/bench_startup.py
+"""
+起動時間のベンチマーク: サーバープロセスの起動から最初の 200 応答までの時間を測る。
+Airtable / Google Sheets は代替（fake_airtable.py / loadtest_app.py）を使う。
+
+    python benchmarks/bench_startup.py [--workers 4] [--sheets-latency-ms 1500] [--runs 3]
+
+次の構成をそれぞれ --runs 回起動して測る:
+  - gunicorn preload   : gunicorn.conf.py の既定（マスターでロードしてから fork）
+  - gunicorn no-preload: GUNICORN_PRELOAD=0（各ワーカーが import・ロードする）
+  - waitress           : waitress-serve（1プロセス、最初のリクエストでロード）
+出力:
+  - first 200   : 起動から、ログイン画面・品名検索・単価検索（3つのマスターデータを使う）が
+                  すべて 200 を返すまで
+  - all warm    : さらに続けて --probe 回ずつ確認し、全て 200 かつ --warm-ms 以下になるまで
+                  （preload なしでは、まだロードしていないワーカーに当たると遅い）
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_airtable import FakeAirtable, FakeAirtableServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _get_all(urls: list) -> bool:
+    """ログイン画面・品名検索・単価検索（3つのマスターデータ）がすべて 200 なら True。"""
+    try:
+        return all(requests.get(u, timeout=10).status_code == 200 for u in urls)
+    except requests.RequestException:
+        return False
+
+
+def measure(command: list, env: dict, urls: list, probe: int, warm_ms: float, timeout: float) -> tuple:
+    started = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=BENCH_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            start_new_session=True)
+    first_ok = all_warm = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if _get_all(urls):
+                first_ok = time.perf_counter() - started
+                break
+            time.sleep(0.02)
+        while first_ok is not None and time.perf_counter() - started < timeout:
+            slow = 0
+            for _ in range(probe):
+                t = time.perf_counter()
+                ok = _get_all(urls)
+                if not ok or (time.perf_counter() - t) * 1000 > warm_ms:
+                    slow += 1
+            if slow == 0:
+                all_warm = time.perf_counter() - started
+                break
+    finally:
+        os.killpg(proc.pid, signal.SIGTERM)
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            os.killpg(proc.pid, signal.SIGKILL)
+    return first_ok, all_warm
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--sheets-latency-ms", type=float, default=1500.0, help="Sheets 1シートの読み込み時間")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--probe", type=int, default=20)
+    parser.add_argument("--warm-ms", type=float, default=500.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    server = FakeAirtableServer(FakeAirtable())
+    env = dict(os.environ,
+               AIRTABLE_API_URL=server.start(),
+               LOADTEST_SHEETS_LATENCY_MS=str(args.sheets_latency_ms),
+               OUTBOX_ENABLED="0",
+               PYTHONPATH=ROOT)
+    base = f"http://127.0.0.1:{args.port}"
+    urls = [f"{base}/auth/login", f"{base}/api/get_worknames?workcd=100", f"{base}/api/get_unitprice?workprocess=製本"]
+    gunicorn = [sys.executable, "-m", "gunicorn", "-c", os.path.join(ROOT, "gunicorn.conf.py"),
+                "-b", f"127.0.0.1:{args.port}", "-w", str(args.workers), "--threads", str(args.threads),
+                "loadtest_app:app"]
+    configs = [
+        ("gunicorn preload", gunicorn, {"GUNICORN_PRELOAD": "1"}),
+        ("gunicorn no-preload", gunicorn, {"GUNICORN_PRELOAD": "0"}),
+        ("waitress", [sys.executable, "-m", "waitress", f"--port={args.port}", f"--threads={args.threads}",
+                      "loadtest_app:app"], {}),
+    ]
+    print(f"workers={args.workers} threads={args.threads} sheets_latency={args.sheets_latency_ms}ms/sheet")
+    for label, command, extra_env in configs:
+        for run in range(args.runs):
+            first_ok, all_warm = measure(command, {**env, **extra_env}, urls, args.probe, args.warm_ms, args.timeout)
+            fmt = lambda v: f"{v:6.2f}s" if v is not None else "  (timeout)"
+            print(f"{label:<20} run{run + 1}: first 200 {fmt(first_ok)}   all warm {fmt(all_warm)}")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+# benchmarks/fake_airtable.py
+"""
+ベンチマーク・負荷試験用のローカル Airtable 代替サーバー（本物の Airtable には接続しない）。
+
+このアプリが使う範囲の REST API だけを実装する:
+  - GET    /v0/<base>/<table>            一覧（filterByFormula / fields[] / sort / pageSize / offset）
+  - GET    /v0/<base>/<table>/<id>       1件取得
+  - POST   /v0/<base>/<table>            作成（{"fields": ...} または {"records": [...]} 最大10件）
+  - PATCH  /v0/<base>/<table>            performUpsert 付きの一括 upsert
+  - PATCH  /v0/<base>/<table>/<id>       フィールド更新
+  - DELETE /v0/<base>/<table>/<id>       削除
+  - GET    /v0/meta/whoami               トークンの確認（接続の準備に使う）
+filterByFormula はアプリが生成する形（AND / NOT / YEAR / MONTH / IS_BEFORE と {WorkDay}、
+IS_AFTER(LAST_MODIFIED_TIME(), '...')）だけを解釈し、
+それ以外は 422 INVALID_FILTER_BY_FORMULA を返す（アプリ側の式の変更に気付けるように）。
+
+遅延（--latency-ms / --jitter-ms）と 429 の注入（--rate-limit 割合）ができる。
+呼び出し回数は GET /__stats で取得、POST /__reset で 0 に戻せる（負荷試験での増幅率の計算用）。
+
+単体で起動:
+    python benchmarks/fake_airtable.py --port 8765 --latency-ms 150 --persons 50 --records 40
+アプリ側は AIRTABLE_API_URL=http://127.0.0.1:8765/v0 を指定して起動する。
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit, unquote
+
+MAX_PAGE_SIZE = 100
+MAX_RECORDS_PER_WRITE = 10
+
+
+class FormulaError(ValueError):
+    pass
+
+
+def _split_args(text: str) -> list:
+    """トップレベルのカンマで引数を分割する。"""
+    args, depth, quote, current = [], 0, None, ""
+    for ch in text:
+        if quote:
+            current += ch
+            if ch == quote:
+                quote = None
+            continue
+        if ch in "'\"":
+            quote = ch
+        elif ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif ch == "," and depth == 0:
+            args.append(current.strip())
+            current = ""
+            continue
+        current += ch
+    if current.strip():
+        args.append(current.strip())
+    return args
+
+
+_CALL_RE = re.compile(r"^([A-Z_]+)\((.*)\)$", re.S)
+_YEAR_MONTH_RE = re.compile(r"^(YEAR|MONTH)\(\{(\w+)\}\)\s*=\s*(\d+)$")
+_IS_BEFORE_RE = re.compile(r"^IS_BEFORE\(\{(\w+)\},\s*'([\d-]+)'\)$")
+_MODIFIED_AFTER_RE = re.compile(r"^IS_AFTER\(LAST_MODIFIED_TIME\(\),\s*'([\dT:.Z-]+)'\)$")
+# compile_formula の関数に渡す fields に、レコードの最終更新時刻を入れるキー
+MODIFIED_KEY = "__modifiedTime"
+
+
+def compile_formula(formula: str):
+    """filterByFormula を fields(dict) -> bool の関数に変換する。"""
+    formula = formula.strip()
+    if not formula:
+        return lambda fields: True
+
+    m = _YEAR_MONTH_RE.match(formula)
+    if m:
+        part, field, value = m.group(1), m.group(2), int(m.group(3))
+        index = 0 if part == "YEAR" else 1
+
+        def match_part(fields):
+            day = str(fields.get(field, ""))
+            try:
+                return int(day.split("-")[index]) == value
+            except (ValueError, IndexError):
+                return False
+        return match_part
+
+    m = _IS_BEFORE_RE.match(formula)
+    if m:
+        field, bound = m.group(1), m.group(2)
+        return lambda fields: bool(fields.get(field)) and str(fields.get(field)) < bound
+
+    m = _MODIFIED_AFTER_RE.match(formula)
+    if m:
+        bound = m.group(1)
+        return lambda fields: fields.get(MODIFIED_KEY, "") > bound
+
+    m = _CALL_RE.match(formula)
+    if m and m.group(1) in ("AND", "OR", "NOT"):
+        name = m.group(1)
+        parts = [compile_formula(arg) for arg in _split_args(m.group(2))]
+        if name == "AND":
+            return lambda fields: all(p(fields) for p in parts)
+        if name == "OR":
+            return lambda fields: any(p(fields) for p in parts)
+        if len(parts) != 1:
+            raise FormulaError(formula)
+        return lambda fields: not parts[0](fields)
+
+    raise FormulaError(formula)
+
+
+class FakeAirtable:
+    """テーブルごとのレコードを保持するインメモリの Airtable。スレッドセーフ。"""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, rate_limit_ratio: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.rate_limit_ratio = rate_limit_ratio
+        self._tables = {}   # { table_name: { record_id: record } }
+        self._offsets = {}  # { offset: (table, formula, sort, ids) }
+        self._lock = threading.Lock()
+        self._seq = 0
+        self.stats = Counter()
+
+    # ===== データ操作 =====
+    def _new_id(self) -> str:
+        self._seq += 1
+        return f"rec{self._seq:014d}"
+
+    def create(self, table: str, fields: dict) -> dict:
+        with self._lock:
+            now = _now_iso()
+            record = {"id": self._new_id(), "createdTime": now, "modifiedTime": now, "fields": dict(fields)}
+            self._tables.setdefault(table, {})[record["id"]] = record
+            return _copy(record)
+
+    def seed(self, person_ids, records_per_person: int, year: int, month: int):
+        """PersonID ごとに指定月のレコードを作成する。"""
+        rnd = random.Random(0)
+        first = date(year, month, 1)
+        days = ((first.replace(day=28) + timedelta(days=4)).replace(day=1) - first).days
+        for pid in person_ids:
+            for i in range(records_per_person):
+                self.create(f"TablePersonID_{pid}", {
+                    "WorkDay": (first + timedelta(days=i % days)).isoformat(),
+                    "WorkCord": 100 + rnd.randrange(900),
+                    "WorkName": f"作業{i}",
+                    "BookName": f"書籍{i % 7}",
+                    "WorkOutput": rnd.randrange(1, 500),
+                    "WorkProcess": rnd.choice(["製本", "断裁", "丁合"]),
+                    "UnitPrice": rnd.choice([1.5, 2.0, 0.8]),
+                })
+
+    def list(self, table: str, params: dict):
+        offset = params.get("offset", [None])[0]
+        page_size = min(int(params.get("pageSize", [MAX_PAGE_SIZE])[0]), MAX_PAGE_SIZE)
+        fields_filter = params.get("fields[]")
+        with self._lock:
+            if offset:
+                ids = self._offsets.pop(offset, None)
+                if ids is None:
+                    return 422, {"error": {"type": "LIST_RECORDS_ITERATOR_NOT_AVAILABLE"}}
+            else:
+                try:
+                    predicate = compile_formula(params.get("filterByFormula", [""])[0])
+                except FormulaError as e:
+                    return 422, {"error": {"type": "INVALID_FILTER_BY_FORMULA", "message": f"Unsupported formula: {e}"}}
+                rows = [r for r in self._tables.get(table, {}).values()
+                        if predicate({**r["fields"], MODIFIED_KEY: r["modifiedTime"]})]
+                sort_field = params.get("sort[0][field]", [None])[0]
+                if sort_field:
+                    reverse = params.get("sort[0][direction]", ["asc"])[0] == "desc"
+                    rows.sort(key=lambda r: str(r["fields"].get(sort_field, "")), reverse=reverse)
+                ids = [r["id"] for r in rows]
+
+            page_ids, rest = ids[:page_size], ids[page_size:]
+            table_rows = self._tables.get(table, {})
+            records = [_copy(table_rows[i], fields_filter) for i in page_ids if i in table_rows]
+            body = {"records": records}
+            if rest:
+                next_offset = f"itr{self._new_id()}"
+                self._offsets[next_offset] = rest
+                body["offset"] = next_offset
+            return 200, body
+
+    def get(self, table: str, record_id: str):
+        with self._lock:
+            record = self._tables.get(table, {}).get(record_id)
+            if record is None:
+                return 404, {"error": "NOT_FOUND"}
+            return 200, _copy(record)
+
+    def post(self, table: str, body: dict):
+        if "records" in body:
+            items = body["records"]
+            if len(items) > MAX_RECORDS_PER_WRITE:
+                return 422, {"error": {"type": "INVALID_RECORDS", "message": "Too many records"}}
+            return 200, {"records": [self.create(table, item.get("fields", {})) for item in items]}
+        return 200, self.create(table, body.get("fields", {}))
+
+    def patch(self, table: str, record_id: str, body: dict):
+        with self._lock:
+            rows = self._tables.setdefault(table, {})
+            if record_id:
+                record = rows.get(record_id)
+                if record is None:
+                    return 404, {"error": "NOT_FOUND"}
+                record["fields"].update(body.get("fields", {}))
+                record["modifiedTime"] = _now_iso()
+                return 200, _copy(record)
+
+            merge_on = (body.get("performUpsert") or {}).get("fieldsToMergeOn")
+            if not merge_on:
+                return 422, {"error": {"type": "INVALID_REQUEST_MISSING_FIELDS"}}
+            items = body.get("records", [])
+            if len(items) > MAX_RECORDS_PER_WRITE:
+                return 422, {"error": {"type": "INVALID_RECORDS", "message": "Too many records"}}
+            results = []
+            for item in items:
+                fields = item.get("fields", {})
+                existing = next((r for r in rows.values()
+                                 if all(r["fields"].get(f) == fields.get(f) for f in merge_on)), None)
+                if existing:
+                    existing["fields"].update(fields)
+                    existing["modifiedTime"] = _now_iso()
+                    results.append(_copy(existing))
+                else:
+                    now = _now_iso()
+                    record = {"id": self._new_id(), "createdTime": now, "modifiedTime": now, "fields": dict(fields)}
+                    rows[record["id"]] = record
+                    results.append(_copy(record))
+            return 200, {"records": results}
+
+    def delete(self, table: str, record_id: str):
+        with self._lock:
+            if self._tables.get(table, {}).pop(record_id, None) is None:
+                return 404, {"error": "NOT_FOUND"}
+            return 200, {"id": record_id, "deleted": True}
+
+    # ===== 注入・統計 =====
+    def before_request(self, method: str):
+        """遅延と 429 の注入。429 を返すべきなら True。"""
+        with self._lock:
+            self.stats[method] += 1
+            self.stats["total"] += 1
+        delay = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+        if self.rate_limit_ratio and random.random() < self.rate_limit_ratio:
+            with self._lock:
+                self.stats["rate_limited"] += 1
+            return True
+        return False
+
+    def snapshot_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats.clear()
+
+
+def _now_iso() -> str:
+    now = time.time()
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now)) + f".{int(now * 1000) % 1000:03d}Z"
+
+
+def _copy(record: dict, fields_filter=None) -> dict:
+    fields = record["fields"]
+    if fields_filter:
+        fields = {k: v for k, v in fields.items() if k in fields_filter}
+    return {"id": record["id"], "createdTime": record["createdTime"], "fields": dict(fields)}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive（本物の Airtable と同じく接続を使い回せるように）
+    airtable: FakeAirtable = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict, headers=None):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # クライアントがタイムアウトで切断した（遅延の注入時）
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode("utf-8"))
+
+    def _dispatch(self, method: str):
+        parts = urlsplit(self.path)
+        path = [unquote(p) for p in parts.path.split("/") if p]
+
+        if path == ["__stats"] and method == "GET":
+            return self._send(200, self.airtable.snapshot_stats())
+        if path == ["__reset"] and method == "POST":
+            self.airtable.reset_stats()
+            return self._send(200, {"ok": True})
+
+        if len(path) not in (3, 4) or path[0] != "v0":
+            return self._send(404, {"error": "NOT_FOUND"})
+        if not self.headers.get("Authorization", "").startswith("Bearer "):
+            return self._send(401, {"error": "AUTHENTICATION_REQUIRED"})
+        if path == ["v0", "meta", "whoami"] and method == "GET":
+            self.airtable.before_request(method)
+            return self._send(200, {"id": "usrFakeAirtable"})
+        body = self._read_json() if method in ("POST", "PATCH") else {}
+        if self.airtable.before_request(method):
+            return self._send(429, {"errors": [{"error": "RATE_LIMIT_REACHED",
+                                                "message": "Rate limit exceeded. Please try again later"}]},
+                              {"Retry-After": "30"})
+
+        table = path[2]
+        record_id = path[3] if len(path) == 4 else None
+        params = parse_qs(parts.query, keep_blank_values=True)
+        if method == "GET":
+            status, result = self.airtable.get(table, record_id) if record_id else self.airtable.list(table, params)
+        elif method == "POST" and not record_id:
+            status, result = self.airtable.post(table, body)
+        elif method == "PATCH":
+            status, result = self.airtable.patch(table, record_id, body)
+        elif method == "DELETE" and record_id:
+            status, result = self.airtable.delete(table, record_id)
+        else:
+            status, result = 404, {"error": "NOT_FOUND"}
+        self._send(status, result)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+
+class FakeAirtableServer:
+    """FakeAirtable をバックグラウンドスレッドの HTTP サーバーとして動かす。"""
+
+    def __init__(self, airtable: FakeAirtable = None, host: str = "127.0.0.1", port: int = 0):
+        self.airtable = airtable or FakeAirtable()
+        handler = type("Handler", (_Handler,), {"airtable": self.airtable})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def api_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v0"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="fake-airtable", daemon=True)
+        self._thread.start()
+        return self.api_url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="429 を返す割合 (0.0〜1.0)")
+    parser.add_argument("--persons", type=int, default=0, help="初期データを作る PersonID の数 (1..N)")
+    parser.add_argument("--records", type=int, default=40, help="PersonID ごとの初期レコード数（当月）")
+    args = parser.parse_args()
+
+    airtable = FakeAirtable(args.latency_ms, args.jitter_ms, args.rate_limit)
+    if args.persons:
+        today = date.today()
+        airtable.seed(range(1, args.persons + 1), args.records, today.year, today.month)
+    server = FakeAirtableServer(airtable, args.host, args.port)
+    print(f"fake Airtable listening on {server.api_url}  (AIRTABLE_API_URL={server.api_url})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# benchmarks/fake_gspread.py
+"""
+ベンチマーク用の gspread クライアント代替（Google Sheets には接続しない）。
+
+data_services が使う client.open(name).worksheet(name).get_all_records() だけを実装する。
+
+    from fake_gspread import FakeGspreadClient, build_master_data, install
+    install(data_services, FakeGspreadClient(build_master_data(persons=50, pin_hash=...)))
+"""
+import time
+
+from werkzeug.security import generate_password_hash
+
+
+class FakeWorksheet:
+    def __init__(self, records: list, latency_ms: float = 0.0):
+        self._records = records
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    def get_all_records(self) -> list:
+        self.calls += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return [dict(r) for r in self._records]
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheets: dict):
+        self._worksheets = worksheets
+
+    def worksheet(self, name: str) -> FakeWorksheet:
+        if name not in self._worksheets:
+            raise KeyError(f"worksheet not found: {name}")
+        return self._worksheets[name]
+
+
+class FakeGspreadClient:
+    """{ worksheet名: [行dict, ...] } から作る。スプレッドシート名は問わない。"""
+
+    def __init__(self, sheets: dict, latency_ms: float = 0.0):
+        self.worksheets = {name: FakeWorksheet(rows, latency_ms) for name, rows in sheets.items()}
+
+    def open(self, name: str) -> FakeSpreadsheet:
+        return FakeSpreadsheet(self.worksheets)
+
+
+def build_master_data(persons: int = 50, workcords: int = 2000, pin: str = "1234", pin_hash: str = None) -> dict:
+    """
+    data_services の3つのワークシート分のデータを作る。
+    全員の PIN は同じ（ハッシュ計算は1回だけ）。WorkCord は 100 から連番。
+    """
+    pin_hash = pin_hash or generate_password_hash(pin)
+    return {
+        "wsPersonID": [{"PersonID": pid, "PersonName": f"作業者{pid}", "PINHash": pin_hash}
+                       for pid in range(1, persons + 1)],
+        "wsTableCD": [{"WorkCord": 100 + i, "WorkName": f"作業{i}", "BookName": f"書籍{i % 97}"}
+                      for i in range(workcords)],
+        "wsWorkProcess": [{"WorkProcess": "製本", "UnitPrice": 1.5},
+                          {"WorkProcess": "断裁", "UnitPrice": 2.0},
+                          {"WorkProcess": "丁合", "UnitPrice": 0.8}],
+    }
+
+
+def install(data_services_module, client: FakeGspreadClient, load: bool = True):
+    """data_services のクライアントを差し替え、必要なら3つのマスターデータをロードする。"""
+    data_services_module.client = client
+    if load:
+        data_services_module.load_personid_data()
+        data_services_module.load_workcord_data()
+        data_services_module.load_workprocess_data()
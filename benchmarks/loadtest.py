@@ -0,0 +1,229 @@
+# benchmarks/loadtest.py
+"""
+終業時のアクセス集中（全員がログイン → 数件入力 → /records で確認）を再現する負荷試験。
+起動済みのアプリ（benchmarks/loadtest_app.py）に HTTP でアクセスする。
+
+    python benchmarks/loadtest.py --base-url http://127.0.0.1:10000 \
+        --airtable-url http://127.0.0.1:8765 --users 100 --ramp 30 --profile linear \
+        --entries 3 --think-ms 2000 [--json result.json]
+
+ユーザー1人の流れ（各ステップの間に平均 --think-ms の待ち時間）:
+    login_page → login → (form → worknames → submit → submit_redirect) × entries → records → logout
+
+ランプの形（--profile）:
+  - linear : --ramp 秒かけて一定間隔で開始
+  - step   : --ramp 秒を4段階に分け、各段階の先頭でまとめて開始
+  - burst  : 全員同時に開始（--ramp は無視）
+
+出力はステップごとの件数・エラー率・p50/p95/p99・最大値と、
+Airtable 呼び出し回数 / ユーザー操作数（上流への増幅率）。--json を付けると同じ内容を保存する
+（waitress と gunicorn のワーカー/スレッド構成を比較する用途）。
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+
+import requests
+
+STEPS = ("login_page", "login", "form", "worknames", "submit", "submit_redirect", "records", "logout")
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def start_offsets(users: int, ramp_sec: float, profile: str) -> list:
+    """ユーザーごとの開始時刻（秒）。"""
+    if profile == "burst" or users <= 1 or ramp_sec <= 0:
+        return [0.0] * users
+    if profile == "step":
+        steps = 4
+        return [ramp_sec * (i * steps // users) / steps for i in range(users)]
+    return [ramp_sec * i / users for i in range(users)]
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_samples = {}
+
+    def record(self, step: str, seconds: float, ok: bool, detail: str = ""):
+        with self._lock:
+            self.latencies[step].append(seconds)
+            if not ok:
+                self.errors[step] += 1
+                self.error_samples.setdefault(step, detail)
+
+    def summary(self) -> dict:
+        out = {}
+        for step in STEPS:
+            values = sorted(self.latencies.get(step, []))
+            if not values:
+                continue
+            out[step] = {
+                "count": len(values),
+                "errors": self.errors.get(step, 0),
+                "error_rate": self.errors.get(step, 0) / len(values),
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+        return out
+
+
+class SimulatedUser(threading.Thread):
+    def __init__(self, index: int, args, results: Results, start_at: float):
+        super().__init__(name=f"user-{index}", daemon=True)
+        self.index = index
+        self.args = args
+        self.results = results
+        self.start_at = start_at
+        self.rnd = random.Random(args.seed + index)
+        self.person_id = index % args.persons + 1
+        self.session = requests.Session()
+
+    def think(self):
+        if self.args.think_ms > 0:
+            time.sleep(self.rnd.expovariate(1000.0 / self.args.think_ms))
+
+    def step(self, name: str, method: str, path: str, ok_status=(200,), **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.args.base_url + path, allow_redirects=False,
+                                            timeout=self.args.timeout, **kwargs)
+            ok = response.status_code in ok_status
+            self.results.record(name, time.perf_counter() - started, ok,
+                                "" if ok else f"HTTP {response.status_code} {path}")
+            return response if ok else None
+        except requests.RequestException as e:
+            self.results.record(name, time.perf_counter() - started, False, f"{type(e).__name__}: {e}")
+            return None
+
+    def run(self):
+        delay = self.start_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+        if not self.step("login_page", "GET", "/auth/login"):
+            return
+        self.think()
+        if not self.step("login", "POST", "/auth/login", ok_status=(302,),
+                         data={"personid": str(self.person_id), "pin": self.args.pin}):
+            return
+
+        today = date.today()
+        for n in range(self.args.entries):
+            self.think()
+            if not self.step("form", "GET", "/"):
+                return
+            workcd = str(100 + self.rnd.randrange(self.args.workcords))
+            self.step("worknames", "GET", "/api/get_worknames", params={"workcd": workcd})
+            self.think()
+            response = self.step("submit", "POST", "/", ok_status=(302,), data={
+                "workcd": workcd, "workname": f"作業{int(workcd) - 100}", "bookname_hidden": "",
+                "workoutput": str(self.rnd.randrange(1, 500)), "workprocess": "製本",
+                "workday": today.isoformat(),
+            })
+            if response is not None and re.match(r"^(https?://[^/]+)?/records", response.headers.get("Location", "")):
+                location = re.sub(r"^https?://[^/]+", "", response.headers["Location"])
+                self.step("submit_redirect", "GET", location)
+
+        self.think()
+        self.step("records", "GET", f"/records/{today.year}/{today.month}")
+        self.step("logout", "GET", "/auth/logout", ok_status=(302,))
+
+
+def fetch_airtable_stats(airtable_url: str, reset: bool = False) -> dict:
+    if not airtable_url:
+        return {}
+    try:
+        if reset:
+            requests.post(f"{airtable_url}/__reset", timeout=5)
+            return {}
+        return requests.get(f"{airtable_url}/__stats", timeout=5).json()
+    except requests.RequestException as e:
+        print(f"Airtable 代替サーバーの統計を取得できません: {e}")
+        return {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:10000")
+    parser.add_argument("--airtable-url", default="http://127.0.0.1:8765",
+                        help="fake_airtable.py のサーバー（/v0 を除く）。空なら増幅率を出さない")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--ramp", type=float, default=30.0, help="全員が開始するまでの秒数")
+    parser.add_argument("--profile", choices=("linear", "step", "burst"), default="linear")
+    parser.add_argument("--entries", type=int, default=3, help="1人あたりの入力件数")
+    parser.add_argument("--think-ms", type=float, default=2000.0, help="操作間の平均待ち時間（指数分布）")
+    parser.add_argument("--persons", type=int, default=200, help="LOADTEST_PERSONS と同じ値")
+    parser.add_argument("--workcords", type=int, default=2000)
+    parser.add_argument("--pin", default="1234")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--drain-wait", type=float, default=5.0,
+                        help="終了後、送信箱の送信を待ってから Airtable の統計を取る秒数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--label", default="", help="結果に付ける名前（例: gunicorn-w4-t4）")
+    parser.add_argument("--json", help="結果を JSON で保存するパス")
+    args = parser.parse_args()
+    args.base_url = args.base_url.rstrip("/")
+    args.airtable_url = args.airtable_url.rstrip("/")
+
+    results = Results()
+    fetch_airtable_stats(args.airtable_url, reset=True)
+    started = time.perf_counter()
+    users = [SimulatedUser(i, args, results, started + offset)
+             for i, offset in enumerate(start_offsets(args.users, args.ramp, args.profile))]
+    for u in users:
+        u.start()
+    for u in users:
+        u.join()
+    elapsed = time.perf_counter() - started
+    if args.drain_wait > 0 and args.airtable_url:
+        time.sleep(args.drain_wait)
+    upstream = fetch_airtable_stats(args.airtable_url)
+
+    summary = results.summary()
+    actions = sum(s["count"] for s in summary.values())
+    errors = sum(s["errors"] for s in summary.values())
+    submits = summary.get("submit", {}).get("count", 0)
+    airtable_calls = upstream.get("total", 0)
+
+    print(f"{args.label or args.base_url}: users={args.users} profile={args.profile} ramp={args.ramp}s "
+          f"entries={args.entries} think={args.think_ms}ms elapsed={elapsed:.1f}s")
+    print(f"{'step':<16}{'count':>7}{'err%':>7}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'maxms':>9}")
+    for step, s in summary.items():
+        print(f"{step:<16}{s['count']:>7}{s['error_rate'] * 100:>7.1f}{s['p50_ms']:>9.1f}"
+              f"{s['p95_ms']:>9.1f}{s['p99_ms']:>9.1f}{s['max_ms']:>9.1f}")
+    print(f"total actions={actions} ({actions / elapsed:.1f}/s) errors={errors} "
+          f"({errors / max(1, actions) * 100:.1f}%)")
+    if upstream:
+        print(f"airtable calls={airtable_calls} {dict((k, v) for k, v in upstream.items() if k != 'total')} "
+              f"per action={airtable_calls / max(1, actions):.2f} per submit={airtable_calls / max(1, submits):.2f}")
+    for step, detail in results.error_samples.items():
+        print(f"  first error in {step}: {detail}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({
+                "label": args.label, "config": {k: v for k, v in vars(args).items() if k != "json"},
+                "elapsed_sec": elapsed, "actions": actions, "errors": errors,
+                "steps": summary, "airtable": upstream,
+                "airtable_calls_per_action": airtable_calls / max(1, actions),
+                "airtable_calls_per_submit": airtable_calls / max(1, submits),
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
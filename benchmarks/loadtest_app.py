@@ -0,0 +1,34 @@
+# benchmarks/loadtest_app.py
+"""
+負荷試験用の WSGI エントリポイント。Google Sheets の代わりに fake_gspread のマスターデータを使う。
+Airtable の接続先は AIRTABLE_API_URL で fake_airtable.py のサーバーを指定する。
+
+    python benchmarks/fake_airtable.py --port 8765 --latency-ms 150 --persons 200 &
+    export AIRTABLE_API_URL=http://127.0.0.1:8765/v0 LOADTEST_PERSONS=200
+    cd benchmarks
+    waitress-serve --port 10000 --threads 8 loadtest_app:app
+    gunicorn -c ../gunicorn.conf.py -b 127.0.0.1:10000 -w 4 --threads 4 loadtest_app:app
+
+全員の PIN は 1234（fake_gspread.build_master_data と同じ）。
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("AIRTABLE_TOKEN", "loadtest")
+os.environ.setdefault("AIRTABLE_BASE_ID_BookSKY", "appLoadtest")
+# 全ユーザーが同じ IP (127.0.0.1) から来るので、IP ごとのログイン試行制限を実質無効にする
+os.environ.setdefault("LOGIN_MAX_ATTEMPTS_PER_IP", "1000000000")
+
+import data_services
+from fake_gspread import FakeGspreadClient, build_master_data, install
+
+from app import app  # noqa: E402  (環境変数の設定後に import する)
+
+# マスターデータは gunicorn.conf.py の when_ready（または最初のリクエスト）でロードされる。
+# LOADTEST_SHEETS_LATENCY_MS で Google Sheets の応答時間を再現する
+install(data_services, FakeGspreadClient(build_master_data(persons=int(os.environ.get("LOADTEST_PERSONS", "200"))),
+                                         latency_ms=float(os.environ.get("LOADTEST_SHEETS_LATENCY_MS", "0"))),
+        load=False)
@@ -1,8 +1,21 @@
-from flask import Blueprint, jsonify, request, current_app # current_app をインポート
+from flask import Blueprint, Response, jsonify, request, current_app # current_app をインポート
 # data_services.py から必要な関数をインポート
 # `your_flask_app` は実際のプロジェクトルートフォルダ名に置き換えてください
 # もし `blueprints` フォルダが `data_services.py` と同じ階層の `your_flask_app` 内にある場合
 from data_services import get_cached_workcord_data, get_cached_workprocess_data
+import outbox
+import mirror
+import search_index
+import bulk_import
+from .auth import admin_required
+import hashlib
+import io
+import json
+import logging
+import threading
+
+# 品名・単価の検索は入力中のキー操作ごとに呼ばれるので別ロガーにする（logging_setup で間引かれる）
+lookup_logger = logging.getLogger("blueprints.api.lookup")
 
 api_bp = Blueprint('api_bp', __name__, url_prefix='/api')
 
@@ -19,7 +32,7 @@ def get_worknames():
         workcd_num = int(workcd)
         workcd = str(workcd_num) # 文字列として保持
     except ValueError:
-        current_app.logger.warning(f"/api/get_worknames - 無効なWorkCDが指定されました: {workcd}")
+        lookup_logger.warning("/api/get_worknames - 無効なWorkCDが指定されました: %s", workcd)
         return jsonify({"worknames": [], "error": "WorkCDは数値で入力してください"})
 
     # 部分一致検索ロジック
@@ -43,23 +56,121 @@ def get_worknames():
                         "bookname": item["bookname"]
                     })
     
-    current_app.logger.info(f"/api/get_worknames - WorkCD: {workcd}, Results: {len(results)}件")
+    lookup_logger.info("/api/get_worknames - WorkCD: %s, Results: %d件", workcd, len(results))
     return jsonify({"worknames": results, "error": ""})
 
 
+# 品名・書名検索で返す件数の上限
+SEARCH_DEFAULT_LIMIT = 30
+SEARCH_MAX_LIMIT = 100
+
+@api_bp.route("/search_worknames", methods=["GET"])
+def search_worknames():
+    """
+    品名・書名（と品番コード）の部分一致検索。かな・カナ、全角・半角を区別しない（search_index.py）。
+    応答の形式は /api/get_worknames と同じで、一致の良い順に最大 limit 件。more はさらに候補があるとき true。
+    """
+    query = request.args.get("q", "").strip()
+    try:
+        limit = min(max(int(request.args.get("limit", SEARCH_DEFAULT_LIMIT)), 1), SEARCH_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"worknames": [], "more": False, "error": "limit は数値で指定してください"}), 400
+    if not query:
+        return jsonify({"worknames": [], "more": False, "error": ""})
+
+    matches, more = search_index.search(get_cached_workcord_data(), query, limit)
+    results = [{"code": code, "workname": workname, "bookname": bookname} for code, workname, bookname in matches]
+    lookup_logger.info("/api/search_worknames - q: %s, Results: %d件%s", query, len(results), "以上" if more else "")
+    return jsonify({"worknames": results, "more": more, "error": ""})
+
+
+# ===== マスターデータのカタログ（オフライン入力用） =====
+_catalogue_lock = threading.Lock()
+_catalogue = (None, None, "", b"")  # (workcord_dict, unitprice_dict, ETag, 本文) 作成元の dict が同じ間は使い回す
+
+def _catalogue_body() -> tuple:
+    """(ETag, 本文)。ETag は内容のハッシュなので、どのワーカーでも同じデータなら同じ値になる。"""
+    global _catalogue
+    workcords = get_cached_workcord_data()
+    workprocess_list, unitprice_dict = get_cached_workprocess_data()
+    with _catalogue_lock:
+        cached_workcords, cached_unitprice, etag, body = _catalogue
+        if cached_workcords is not workcords or cached_unitprice is not unitprice_dict:
+            body = json.dumps({
+                "workcords": [[code, item["workname"], item["bookname"]]
+                              for code, items in workcords.items() for item in items],
+                "workprocess": workprocess_list,
+                "unitprice": unitprice_dict,
+            }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            etag = hashlib.sha256(body).hexdigest()[:32]
+            _catalogue = (workcords, unitprice_dict, etag, body)
+    return etag, body
+
+@api_bp.route("/catalogue", methods=["GET"])
+def get_catalogue():
+    """
+    品番コード・品名・書名と行程・単価の一覧（static/sw.js がキャッシュし、オフライン中の検索に使う）。
+    ETag 付き。If-None-Match が一致すれば 304 を返すので、変更が無ければ本文は送らない。
+    """
+    etag, body = _catalogue_body()
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
 @api_bp.route("/get_unitprice", methods=["GET"])
 def get_unitprice():
     workprocess = request.args.get("workprocess", "").strip()
     if not workprocess:
-        current_app.logger.warning("/api/get_unitprice - WorkProcessが指定されていません。")
+        lookup_logger.warning("/api/get_unitprice - WorkProcessが指定されていません。")
         return jsonify({"error": "WorkProcess が指定されていません"}), 400
 
     _, up_dict = get_cached_workprocess_data() # 第1返り値(リスト)は不要なので _ で受ける
 
     if workprocess not in up_dict:
-        current_app.logger.warning(f"/api/get_unitprice - 該当するWorkProcessが見つかりません: {workprocess}")
+        lookup_logger.warning("/api/get_unitprice - 該当するWorkProcessが見つかりません: %s", workprocess)
         return jsonify({"error": "該当する WorkProcess が見つかりません"}), 404
     
     unitprice = up_dict[workprocess]
-    current_app.logger.info(f"/api/get_unitprice - WorkProcess: {workprocess}, UnitPrice: {unitprice}")
-    return jsonify({"unitprice": unitprice})
\ No newline at end of file
+    lookup_logger.info("/api/get_unitprice - WorkProcess: %s, UnitPrice: %s", workprocess, unitprice)
+    return jsonify({"unitprice": unitprice})
+
+
+@api_bp.route("/outbox/stats", methods=["GET"])
+@admin_required
+def get_outbox_stats():
+    """送信箱ドレイナーのスループット・レイテンシ統計（管理者のみ）。"""
+    if not outbox.OUTBOX_ENABLED:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **outbox.get_drainer_stats()})
+
+
+@api_bp.route("/mirror/stats", methods=["GET"])
+@admin_required
+def get_mirror_stats():
+    """ローカルミラーの同期の遅れ・件数/秒などの統計（管理者のみ）。"""
+    if not mirror.MIRROR_ENABLED:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **mirror.get_sync_stats()})
+
+
+@api_bp.route("/import/records", methods=["POST"])
+@admin_required
+def import_records():
+    """
+    作業記録を CSV で一括登録する（管理者のみ）。列の形式は bulk_import.py を参照。
+    multipart の file、または本文そのもの（text/csv）を受け付ける。?dry_run=1 で検証のみ。
+    """
+    upload = request.files.get("file")
+    stream = upload.stream if upload else request.stream
+    # 送信を始める前にファイル全体を読んで文字コードを確かめる（途中で失敗して前半だけ登録されないように）
+    try:
+        text = stream.read().decode("utf-8-sig")  # Excel の BOM 付き CSV も読める
+    except UnicodeDecodeError:
+        return jsonify({"error": "CSV は UTF-8 で保存してください（何も登録していません）"}), 400
+    dry_run = request.args.get("dry_run") == "1"
+    result = bulk_import.import_csv(io.StringIO(text, newline=""), dry_run=dry_run)
+    if "error" in result:
+        return jsonify(result), 400
+    return jsonify(result)
@@ -1,9 +1,14 @@
 # blueprints/auth.py
 from flask import (
-    Blueprint, render_template, request, flash, redirect, url_for, session, current_app
+    Blueprint, render_template, request, flash, redirect, url_for, session, current_app, jsonify
 )
 from functools import wraps
-from werkzeug.security import check_password_hash # PINのハッシュ比較に使用
+import os
+# PINのハッシュ比較は専用スレッドプール・試行回数制限付きの auth_service 経由で行う
+from instrumentation import timed
+from auth_service import (
+    verify_pin, check_login_allowed, record_login_failure, reset_login_failures, LoginBusyError
+)
 
 # data_services.py から PersonID とPINハッシュ情報を取得する関数をインポート
 from data_services import get_cached_personid_data
@@ -14,20 +19,45 @@ auth_bp = Blueprint(
     template_folder='../templates' # templatesフォルダはプロジェクトルートにあるものを参照
 )
 
+def wants_json() -> bool:
+    """JSON の応答を求めるリクエストか（オフライン送信の再送 static/sw.js など。HTML を受け付けないもの）。"""
+    return request.accept_mimetypes.accept_json and not request.accept_mimetypes.accept_html
+
 def login_required(f):
     """
     ログインが必要なルートに適用するデコレータ。
-    未ログインの場合はログインページにリダイレクトする。
+    未ログインの場合はログインページにリダイレクトする（JSON を求めるリクエストには 401 を返す）。
     """
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'logged_in_personid' not in session:
+            if wants_json():
+                return jsonify({"error": "ログインが必要です。"}), 401
             flash("このページにアクセスするにはログインが必要です。", "warning")
             # nextパラメータで行こうとしていたURLを記憶し、ログイン後にそこにリダイレクトする (オプション)
             return redirect(url_for('auth_bp.login', next=request.url))
         return f(*args, **kwargs)
     return decorated_function
 
+def is_admin_personid(person_id) -> bool:
+    """環境変数 ADMIN_PERSON_IDS（カンマ区切り）に含まれる PersonID かどうかを返す。"""
+    admin_ids = {p.strip() for p in os.environ.get("ADMIN_PERSON_IDS", "").split(",") if p.strip()}
+    return person_id is not None and str(person_id) in admin_ids
+
+def admin_required(f):
+    """
+    管理者（ADMIN_PERSON_IDS に含まれる PersonID）のみ許可するデコレータ。
+    未ログインならログインページへ、権限がなければ 403 を返す。
+    """
+    @wraps(f)
+    @login_required
+    def decorated_function(*args, **kwargs):
+        if not is_admin_personid(session.get('logged_in_personid')):
+            current_app.logger.warning(f"管理者権限のないアクセス: PersonID={session.get('logged_in_personid')}, Path={request.path}")
+            return "Forbidden", 403
+        return f(*args, **kwargs)
+    return decorated_function
+
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -48,9 +78,25 @@ def login():
         person_data_dict, _ = get_cached_personid_data() # PERSON_ID_DICT を取得
         user_account_info = person_data_dict.get(person_id)
 
+        # ✅ ハッシュ計算の前に試行回数をチェック（総当たり・連打を安価に弾く）
+        allowed, retry_after = check_login_allowed(person_id, request.remote_addr or "")
+        if not allowed:
+            current_app.logger.warning(f"ログイン試行回数の上限: PersonID={person_id}, IP={request.remote_addr}")
+            flash(f"ログインの試行回数が多すぎます。{retry_after}秒後に再度お試しください。", "error")
+            return render_template('login.html', personid_dict=person_data_dict, next_url=next_url), 429
+
         if user_account_info and user_account_info.get('pin_hash'):
             # PINハッシュを比較
-            if check_password_hash(user_account_info['pin_hash'], pin_entered):
+            try:
+                with timed("pin"):
+                    pin_ok = verify_pin(person_id, user_account_info['pin_hash'], pin_entered)
+            except LoginBusyError:
+                current_app.logger.warning(f"ログイン照合が混雑しています: PersonID={person_id}")
+                flash("ログインが混み合っています。少し待ってから再度お試しください。", "error")
+                return render_template('login.html', personid_dict=person_data_dict, next_url=next_url), 503
+
+            if pin_ok:
+                reset_login_failures(person_id)
                 session['logged_in_personid'] = person_id
                 session['logged_in_personname'] = user_account_info['name']
                 session.permanent = True # セッションを持続させる場合（設定による）
@@ -64,16 +110,17 @@ def login():
                      return redirect(next_url)
                 return redirect(url_for('ui_bp.index')) # デフォルトはメインページへ
             else:
+                record_login_failure(person_id)
                 current_app.logger.warning(f"PIN不一致: PersonID={person_id}")
                 flash("PersonIDまたはPINが間違っています。", "error")
         else:
+            record_login_failure(person_id)
             current_app.logger.warning(f"アカウント情報またはPINハッシュが見つかりません: PersonID={person_id}")
             flash("PersonIDまたはPINが間違っています。", "error")
         
         # 認証失敗時は再度ログインページを表示（エラーメッセージはflashで表示される）
-        # personid_dictを再度渡す必要がある
-        personid_dict_for_template, _ = get_cached_personid_data() 
-        return render_template('login.html', personid_dict=personid_dict_for_template, next_url=next_url)
+        # 取得済みの personid_dict をそのまま渡す
+        return render_template('login.html', personid_dict=person_data_dict, next_url=next_url)
 
 
     # GETリクエストの場合
@@ -83,10 +130,6 @@ def login():
     personid_dict_for_template, _ = get_cached_personid_data()
     next_url_from_query = request.args.get('next', '') # リダイレクト元から渡されたnext URLを取得
 
-    # blueprints/auth.py の login 関数のGETリクエスト処理の最後
-    # return render_template('login.html', ...) の直前に追加
-    current_app.logger.debug(f"login.htmlへ渡す personid_dict: {personid_dict_for_template}") # personid_dict_for_template は実際に渡す変数名
-    
     return render_template('login.html', personid_dict=personid_dict_for_template, next_url=next_url_from_query)
 
 
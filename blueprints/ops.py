@@ -0,0 +1,117 @@
+# blueprints/ops.py
+"""
+運用向けのエンドポイント（メトリクス、死活監視・準備完了チェック）。
+
+/healthz と /readyz はロードバランサーから数秒おきに呼ばれるので、セッションにも上流
+（Google Sheets / Airtable）にも触れず、メモリ上の状態だけで判定する。
+データが古い・接続が冷えている場合は、読み直し・接続準備をバックグラウンドで1つだけ起動する。
+"""
+import hmac
+import os
+import threading
+import time
+
+from flask import Blueprint, Response, jsonify, request, session
+
+import metrics
+import data_services
+import airtable_service
+import circuit_breaker
+from .auth import is_admin_personid
+
+ops_bp = Blueprint('ops_bp', __name__)
+
+
+def _metrics_authorized() -> bool:
+    """Authorization: Bearer <METRICS_TOKEN>（スクレイパー用）か、管理者のログインセッションなら許可。"""
+    token = os.environ.get("METRICS_TOKEN", "")
+    auth_header = request.headers.get("Authorization", "")
+    if token and auth_header.startswith("Bearer ") and hmac.compare_digest(auth_header[7:], token):
+        return True
+    return is_admin_personid(session.get('logged_in_personid'))
+
+
+@ops_bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """全ワーカー分を合算したメトリクス（Prometheus テキスト形式）。"""
+    if not _metrics_authorized():
+        return Response("Forbidden\n", status=403, mimetype="text/plain")
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ===== 死活監視・準備完了チェック =====
+# マスターデータがこれより古ければ準備未完了（通常は CACHE_TTL ごとに読み直される）
+READY_MAX_DATA_AGE_SEC = float(os.environ.get("READY_MAX_DATA_AGE_SEC", "1800"))
+# 0 にすると Airtable に一度も接続できていなくても準備完了とみなす
+READY_REQUIRE_AIRTABLE = os.environ.get("READY_REQUIRE_AIRTABLE", "1") == "1"
+BACKGROUND_MIN_INTERVAL_SEC = 10.0
+
+_background_lock = threading.Lock()
+_background_running = set()
+_background_started_at = {}
+
+
+def _kick_background(name: str, func):
+    """func を別スレッドで実行する（同じ name が実行中、または直近に起動済みなら何もしない）。"""
+    now = time.monotonic()
+    with _background_lock:
+        if name in _background_running or now - _background_started_at.get(name, -1e9) < BACKGROUND_MIN_INTERVAL_SEC:
+            return
+        _background_running.add(name)
+        _background_started_at[name] = now
+
+    def run():
+        try:
+            func()
+        finally:
+            with _background_lock:
+                _background_running.discard(name)
+
+    threading.Thread(target=run, name=f"ops-{name}", daemon=True).start()
+
+
+def _no_store(response):
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+
+@ops_bp.route("/healthz", methods=["GET"])
+def healthz():
+    """生存確認（プロセスが応答できれば常に 200）。"""
+    return _no_store(jsonify({"status": "ok"}))
+
+
+@ops_bp.route("/readyz", methods=["GET"])
+def readyz():
+    """
+    マスターデータがロード済みで新しく、このワーカーが Airtable に一度でも接続できていれば 200、そうでなければ 503。
+    Airtable は最近の応答の有無では判定しない（アクセスが無いだけで冷えたワーカーや、Airtable の障害中でも
+    キャッシュ・ミラー・送信箱で応答できるワーカーを外さないため）。冷えていれば裏で接続し直しておく。
+    """
+    checks = {}
+    ready = True
+
+    stale = False
+    for sheet, status in data_services.get_master_data_status().items():
+        age = status["age_sec"]
+        loaded = status["count"] > 0 and age is not None
+        fresh = loaded and age <= READY_MAX_DATA_AGE_SEC
+        stale = stale or not loaded or age > data_services.CACHE_TTL
+        checks[sheet] = {**status, "ok": fresh}
+        ready = ready and fresh
+    if stale:
+        _kick_background("master-data", data_services.refresh_stale_master_data)
+
+    warm = airtable_service.is_connection_warm()
+    if not warm:
+        _kick_background("airtable-warm", airtable_service.warm_connection)
+    connected = airtable_service.has_connected()
+    checks["airtable"] = {"connected": connected, "warm": warm, "ok": connected or not READY_REQUIRE_AIRTABLE}
+    ready = ready and checks["airtable"]["ok"]
+
+    # ブレーカーが open でもキャッシュ・古いデータで応答できるので、準備完了の判定には使わない（監視用に返すだけ）
+    checks["breakers"] = circuit_breaker.get_breaker_states()
+
+    response = jsonify({"status": "ready" if ready else "not_ready", "checks": checks})
+    response.status_code = 200 if ready else 503
+    return _no_store(response)
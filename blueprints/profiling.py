@@ -0,0 +1,96 @@
+# blueprints/profiling.py
+"""
+管理者用のプロファイリング（CPU のサンプリング・tracemalloc のメモリ差分）。実装は profiling.py。
+
+  POST /admin/profile/cpu?seconds=30            : 30秒の間に始まるリクエストを採取する
+  POST /admin/profile/cpu?requests=50           : この後の50リクエストだけ採取する（interval_ms=10 で間隔を指定）
+  GET  /admin/profile/cpu                       : 状態（JSON）
+  GET  /admin/profile/cpu?format=collapsed      : collapsed 形式（flamegraph.pl / speedscope に渡す）。kind=wall で待ち時間込み
+  DELETE /admin/profile/cpu                     : 途中で止める
+
+  POST /admin/profile/memory?frames=10          : tracemalloc を開始して基準のスナップショットを取る
+  GET  /admin/profile/memory?since=start|last&group_by=lineno|traceback|filename&top=30&include=*airtable_cache.py
+                                                : 基準（または前回の GET）からの増減を確保した場所ごとに
+  DELETE /admin/profile/memory                  : tracemalloc を止める
+
+gunicorn ではワーカーごとの結果になる（応答の pid で確認できる）。
+"""
+from flask import Blueprint, Response, jsonify, request
+
+import profiling
+from .auth import admin_required
+
+profiling_bp = Blueprint('profiling_bp', __name__, url_prefix='/admin/profile')
+
+
+def _float_arg(name: str):
+    value = request.args.get(name)
+    return float(value) if value not in (None, "") else None
+
+
+@profiling_bp.route("/cpu", methods=["POST"])
+@admin_required
+def start_cpu():
+    try:
+        requests_limit = _float_arg("requests")
+        status = profiling.start_cpu_profile(
+            seconds=_float_arg("seconds"),
+            requests=int(requests_limit) if requests_limit is not None else None,
+            interval_ms=_float_arg("interval_ms") or profiling.DEFAULT_INTERVAL_MS,
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(status), 202
+
+
+@profiling_bp.route("/cpu", methods=["GET"])
+@admin_required
+def get_cpu():
+    status = profiling.get_cpu_profile()
+    if request.args.get("format") != "collapsed":
+        return jsonify(status)
+    kind = request.args.get("kind", "cpu")
+    if kind not in ("cpu", "wall"):
+        return jsonify({"error": "kind は cpu か wall です。"}), 400
+    response = Response(profiling.collapsed_stacks(kind), mimetype="text/plain")
+    response.headers["X-Profile-State"] = status["state"]
+    response.headers["X-Profile-Pid"] = str(status["pid"])
+    return response
+
+
+@profiling_bp.route("/cpu", methods=["DELETE"])
+@admin_required
+def stop_cpu():
+    profiling.stop_cpu_profile()
+    return jsonify(profiling.get_cpu_profile())
+
+
+@profiling_bp.route("/memory", methods=["POST"])
+@admin_required
+def start_memory():
+    try:
+        return jsonify(profiling.start_memory_trace(int(request.args.get("frames", 10))))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@profiling_bp.route("/memory", methods=["GET"])
+@admin_required
+def get_memory():
+    if not profiling.get_memory_status()["tracing"]:
+        return jsonify(profiling.get_memory_status())
+    try:
+        return jsonify(profiling.memory_diff(
+            since=request.args.get("since", "start"),
+            group_by=request.args.get("group_by", "lineno"),
+            top=int(request.args.get("top", 30)),
+            include=request.args.get("include") or None,
+        ))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@profiling_bp.route("/memory", methods=["DELETE"])
+@admin_required
+def stop_memory():
+    return jsonify(profiling.stop_memory_trace())
@@ -1,10 +1,16 @@
 # blueprints/ui.py
 
 from flask import (
-    Blueprint, render_template, request, flash, redirect, url_for, session, current_app
+    Blueprint, render_template, request, flash, redirect, url_for, session, current_app,
+    Response, stream_with_context, jsonify, send_from_directory
 )
+from markupsafe import Markup
 from datetime import datetime, date, timedelta
+import csv
+import io
 import json
+import os
+import time
 
 # サービスモジュールから必要な関数をインポート
 from data_services import get_cached_personid_data, get_cached_workprocess_data # forms.pyは使わないので削除
@@ -12,12 +18,21 @@ from data_services import get_cached_personid_data, get_cached_workprocess_data
 # ★★★ airtable_serviceからのインポートを再確認 ★★★
 from airtable_service import (
     create_airtable_record,
-    get_airtable_records_for_month,  # ← この行が重要です！
+    get_airtable_records_for_month_entry,  # ← この行が重要です！（表の描画キャッシュ用にバージョンも受け取る）
     delete_airtable_record,
-    get_airtable_record_details,
-    update_airtable_record_fields
+    get_record_details_cached,
+    update_airtable_record_fields,
+    iter_record_pages_for_range
 )
-from .auth import login_required # auth.py が同じ blueprints フォルダにあると仮定
+from airtable_cache import get_person_version, cache_get, cache_set, fragment_key, MONTH_CACHE_TTL_SEC
+import idempotency
+import metrics
+import outbox
+import realtime
+from .auth import login_required, is_admin_personid, wants_json # auth.py が同じ blueprints フォルダにあると仮定
+
+# records の表（明細・集計）の描画結果をキャッシュする（0 で無効。ベンチマークでの比較用）
+RECORDS_FRAGMENT_CACHE = os.environ.get("RECORDS_FRAGMENT_CACHE", "1") == "1"
 
 # UI用 Blueprint を作成 (変更なし)
 ui_bp = Blueprint(
@@ -28,6 +43,8 @@ ui_bp = Blueprint(
 
 # -------------------------------
 # Flask のルート (入力フォーム) - "/"
+# POST は、オフライン中に保留した送信の再送（static/sw.js）からは Accept: application/json で呼ばれる。
+# その場合は画面を返さず、登録結果を JSON で返す（201/202: 登録済み、400: 入力エラー、502: 登録失敗）。
 @ui_bp.route("/", methods=["GET", "POST"])
 @login_required
 def index():
@@ -48,68 +65,126 @@ def index():
         "workprocess_selected": "",
         "selected_workname_option": "",
         "bookname_hidden": "",
-        "unitprice": "" 
+        "unitprice": "",
+        # 二重送信対策の冪等キー（入力エラーで再表示する場合は同じキーを使い続ける）
+        "idempotency_key": idempotency.new_key()
     }
 
     if request.method == "POST":
+        # 共用の端末でオフライン中に保留された別の人の送信を、今ログインしている人の記録として登録しない
+        form_pid = request.form.get("personid", "").strip()
+        if form_pid and form_pid != str(logged_in_pid):
+            current_app.logger.warning("UI index POST - 別の人のフォームからの送信を拒否: LoggedInPersonID=%s, FormPersonID=%s",
+                                       logged_in_pid, form_pid)
+            message = "⚠ 別の人がログイン中に入力したフォームです。入力した人がログインしてから送信してください。"
+            if wants_json():
+                return jsonify({"errors": [message]}), 409
+            flash(message, "error")
+            return render_template("index.html", **template_context)
+
         workcd = request.form.get("workcd", "").strip()
         workoutput = request.form.get("workoutput", "").strip() or "0"
         workprocess = request.form.get("workprocess", "").strip()
         workday = request.form.get("workday", "").strip()
         selected_option = request.form.get("workname", "").strip()
         bookname_from_hidden = request.form.get("bookname_hidden", "").strip()
+        idempotency_key = request.form.get("idempotency_key", "").strip()
+        if not idempotency.is_valid_key(idempotency_key):
+            idempotency_key = None  # キーの無い古いフォームからの送信は従来どおり毎回登録する
 
         template_context.update({
             "workcd": workcd, "workoutput": workoutput, "workprocess_selected": workprocess,
             "workday": workday, "selected_workname_option": selected_option,
-            "bookname_hidden": bookname_from_hidden
+            "bookname_hidden": bookname_from_hidden,
+            "idempotency_key": idempotency_key or template_context["idempotency_key"]
         })
 
         workname, bookname = "", ""
         workoutput_val = 0
-        error_occurred = False
+        errors = []
 
         if workcd and not workcd.isdigit():
-            flash("⚠ WorkCD は数値で入力してください！", "error"); error_occurred = True
+            errors.append("⚠ WorkCD は数値で入力してください！")
         try:
             workoutput_val = int(workoutput)
         except ValueError:
-            flash("⚠ 数量は数値を入力してください！", "error"); error_occurred = True; workoutput_val = 0
+            errors.append("⚠ 数量は数値を入力してください！"); workoutput_val = 0
         if not workprocess or not workday:
-            flash("⚠ 行程と作業日は入力してください！", "error"); error_occurred = True
+            errors.append("⚠ 行程と作業日は入力してください！")
         else:
             try: datetime.strptime(workday, "%Y-%m-%d")
-            except ValueError: flash("⚠ 作業日はYYYY-MM-DDの形式で入力してください！", "error"); error_occurred = True
+            except ValueError: errors.append("⚠ 作業日はYYYY-MM-DDの形式で入力してください！")
         if not selected_option and workcd:  
-            flash("⚠ WorkCDを入力した場合は品名も選択してください！", "error"); error_occurred = True
+            errors.append("⚠ WorkCDを入力した場合は品名も選択してください！")
         elif selected_option:
             workname = selected_option
             bookname = bookname_from_hidden
         
-        if error_occurred:
+        if errors:
             current_app.logger.warning(f"UI index POST - 入力エラー: LoggedInPersonID={logged_in_pid}, WorkCD={workcd}")
+            if wants_json():
+                return jsonify({"errors": errors}), 400
+            for message in errors:
+                flash(message, "error")
             # unitprice_data_for_js も渡す
             return render_template("index.html", **template_context) # template_contextにunitprice_data_for_jsは既に入っている
 
         unitprice = unitprice_dict_data.get(workprocess, 0.0)
 
-        current_app.logger.info(f"UI index POST - Airtable送信準備: LoggedInPersonID={logged_in_pid}, WorkCD={workcd or 'N/A'}")
-        status_code, response_text, new_record_id = create_airtable_record(
-            str(logged_in_pid), workcd, workname, bookname, workoutput_val, workprocess, unitprice, workday
-        )
+        current_app.logger.info("UI index POST - Airtable送信準備: LoggedInPersonID=%s, WorkCD=%s", logged_in_pid, workcd or 'N/A')
+        # 同じキーでも内容が違う送信（戻るボタンで前のフォームから値を直して送信など）は別の送信として扱う
+        payload_fingerprint = idempotency.fingerprint({
+            "workcd": workcd, "workname": workname, "bookname": bookname, "workprocess": workprocess,
+            "workoutput": workoutput_val, "workday": workday,
+        })
+        def submit():
+            # 送信箱・Airtable upsert 側のキーにも PersonID・内容の指紋を含め、他人のキーや別の内容と衝突しないようにする
+            return create_airtable_record(
+                str(logged_in_pid), workcd, workname, bookname, workoutput_val, workprocess, unitprice, workday,
+                idempotency_key=f"{logged_in_pid}:{idempotency_key}:{payload_fingerprint}" if idempotency_key else None
+            )
+
+        if idempotency_key:
+            (status_code, response_text, new_record_id), duplicate = idempotency.run_once(
+                logged_in_pid, idempotency_key, submit, lambda result: result[0] in (200, 201, 202) and result[2],
+                payload_fingerprint
+            )
+            if duplicate:
+                current_app.logger.info("UI index POST - 二重送信をまとめました: LoggedInPersonID=%s", logged_in_pid)
+        else:
+            status_code, response_text, new_record_id = submit()
+            duplicate = False
 
-        flash(response_text, "success" if status_code in (200, 201) and new_record_id else "error")
+        # 202 は送信箱(outbox)に受け付け済み（Airtable への反映はバックグラウンド）
+        if not wants_json():
+            flash(response_text, "success" if status_code in (200, 201, 202) and new_record_id else "error")
         session['selected_personid'] = str(logged_in_pid) 
         session['workday'] = workday
 
-        if status_code in (200, 201) and new_record_id:
+        if status_code in (200, 201, 202) and new_record_id:
+            _remember_write_version(logged_in_pid)
             session['new_record_id'] = new_record_id
+            if not duplicate:
+                new_row = {
+                    "id": new_record_id, "WorkDay": workday, "WorkCD": int(workcd) if workcd else 0,
+                    "WorkName": workname, "BookName": bookname, "WorkProcess": workprocess,
+                    "UnitPrice": unitprice, "WorkOutput": workoutput_val,
+                    "outbox_status": "pending" if status_code == 202 else None, "outbox_error": None,
+                }
+                new_row["subtotal"] = calc_subtotal(new_row)
+                realtime.publish_record_upsert(logged_in_pid, new_row)
+            if wants_json():
+                return jsonify({"message": response_text, "record_id": new_record_id, "duplicate": duplicate}), \
+                    202 if status_code == 202 else 201
             try:
                 workday_dt = datetime.strptime(workday, "%Y-%m-%d")
                 return redirect(url_for(".records", year=workday_dt.year, month=workday_dt.month))
             except ValueError: 
                 return redirect(url_for(".records")) 
         else:
+            if wants_json():
+                # 再送側は時間をおいて同じ冪等キーで再試行する
+                return jsonify({"error": response_text}), 502
             # unitprice_data_for_js も渡す
             return render_template("index.html", **template_context)
 
@@ -118,6 +193,51 @@ def index():
     return render_template("index.html", **template_context)
 
 
+@ui_bp.route("/sw.js")
+def service_worker():
+    """
+    入力フォームのオフライン対応の Service Worker（static/sw.js）。
+    サイト全体（/）を対象にするため、/static/ ではなくルートから配信する。更新がすぐ届くようキャッシュさせない。
+    """
+    response = send_from_directory(current_app.static_folder, "sw.js", mimetype="application/javascript", max_age=0)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _outbox_row_for_display(item: dict) -> dict:
+    """送信箱の行(fields形式)を records 画面の行形式に変換する。"""
+    return {
+        "id": item["id"],
+        "WorkDay": item.get("WorkDay", "9999-12-31"),
+        "WorkCD": item.get("WorkCord", "不明"),
+        "WorkName": item.get("WorkName", "不明"),
+        "BookName": item.get("BookName", ""),
+        "WorkProcess": item.get("WorkProcess", "不明"),
+        "UnitPrice": item.get("UnitPrice", "不明"),
+        "WorkOutput": item.get("WorkOutput", "0"),
+        # 送信済み(sent)の行は Airtable 上の通常の行として扱う
+        "outbox_status": None if item["outbox_status"] == "sent" else item["outbox_status"],
+        "outbox_error": item.get("outbox_error"),
+    }
+
+def _remember_write_version(person_id):
+    """書き込み成功後、このセッションが最低限見るべきデータのバージョンを記録する（read-your-writes）。"""
+    versions = dict(session.get('data_versions', {}))
+    versions[str(person_id)] = get_person_version(person_id)
+    session['data_versions'] = versions
+
+def calc_subtotal(record_item: dict):
+    """単価 × 数量 の金額を返す（records 画面とエクスポートで共通）。不正値は 0。"""
+    try:
+        unit_price_str = str(record_item.get("UnitPrice", "0")).strip()
+        unit_price = float(unit_price_str) if unit_price_str and unit_price_str != "不明" else 0.0
+        work_output_str = str(record_item.get("WorkOutput", "0")).strip()
+        work_output = int(work_output_str) if work_output_str else 0
+        return unit_price * work_output
+    except ValueError:
+        return 0
+
+
 # ----------------------------------------------------------------------------------
 # 以下、records, edit_record, delete_record ルートは変更なし (前回のUI Blueprint化時点のまま)
 # ----------------------------------------------------------------------------------
@@ -177,33 +297,34 @@ def records(year=None, month=None):
     display_month_str = f"{year}年{month}月"
     
    
-    force_refresh = (request.args.get("refresh") == "1")
-    records_data = get_airtable_records_for_month(person_id_to_use, year, month, force_refresh=force_refresh)
+    # refresh=1 による強制再取得は廃止。自分の書き込みより古いキャッシュの時だけ取り直す
+    min_version = session.get('data_versions', {}).get(person_id_to_use, 0)
+    records_data, data_revision = get_airtable_records_for_month_entry(person_id_to_use, year, month,
+                                                                      min_version=min_version)
 
     
     if records_data is None: records_data = []
 
-    total_amount = 0
-    for record_item in records_data:
+    # ✅ 送信箱の「送信待ち / 送信失敗 / 直近に送信済み（キャッシュ未反映）」の行を補完表示
+    if outbox.OUTBOX_ENABLED:
         try:
-            unit_price_str = str(record_item.get("UnitPrice", "0")).strip()
-            unit_price = float(unit_price_str) if unit_price_str and unit_price_str != "不明" else 0.0
-            work_output_str = str(record_item.get("WorkOutput", "0")).strip()
-            work_output = int(work_output_str) if work_output_str else 0
-            record_item["subtotal"] = unit_price * work_output
-        except ValueError: record_item["subtotal"] = 0
-        total_amount += record_item["subtotal"]
-
-    unique_workdays = set(r["WorkDay"] for r in records_data if r.get("WorkDay") != "9999-12-31")
-    workdays_count = len(unique_workdays)
-    
-    workoutput_total = 0
-    for r_item in records_data:
-        if "分給" in r_item.get("WorkProcess", ""):
-            work_output_value = str(r_item.get("WorkOutput", "0")).strip()
-            if work_output_value and work_output_value.replace('.', '', 1).isdigit():
-                try: workoutput_total += float(work_output_value)
-                except ValueError: pass # ログは既に出力されていると仮定
+            known_ids = {str(r.get("id")) for r in records_data}
+            outbox_rows = [
+                _outbox_row_for_display(r) for r in outbox.list_rows_for_month(person_id_to_use, year, month)
+                if str(r["id"]) not in known_ids
+            ]
+            if outbox_rows:
+                records_data = sorted(list(records_data) + outbox_rows, key=lambda x: x.get("WorkDay", "9999-12-31"))
+        except Exception as e:
+            current_app.logger.warning(f"送信箱の参照に失敗（無視）: {e}")
+            outbox_rows = []
+    else:
+        outbox_rows = []
+
+    # 表の内容は「当月キャッシュの revision + 送信箱の行の状態・編集できる値」で決まるので、同じなら描画済みの HTML を使う
+    source_version = (data_revision, tuple((r["id"], r["outbox_status"], r["outbox_error"], r["WorkDay"], r["WorkOutput"])
+                                           for r in outbox_rows))
+    records_table_html = _render_records_table(person_id_to_use, year, month, records_data, source_version)
 
     first_day_of_current_month = date(year, month, 1)
     prev_month_date = first_day_of_current_month - timedelta(days=1)
@@ -222,14 +343,11 @@ def records(year=None, month=None):
             current_person_name = person_info['name']
     return render_template(
         "records.html",
-        records=records_data,
+        records_table_html=records_table_html,
         current_person_name_for_display=current_person_name, # ★追加
         personid=person_id_to_use, # ログイン中のユーザーID
         personid_dict=personid_dict_data_for_template,
         display_month=display_month_str,
-        total_amount=total_amount,
-        workdays_count=workdays_count,
-        workoutput_total=workoutput_total,
         current_year=year, current_month=month, 
         new_record_id=new_record_id_from_session,
         edited_record_id=edited_record_id_from_session,
@@ -237,6 +355,52 @@ def records(year=None, month=None):
         next_year=next_year, next_month=next_month
     )
 
+def _render_records_table(person_id: str, year: int, month: int, records_data: list, source_version) -> Markup:
+    """
+    records の表（明細・集計）を描画する。source_version が前回と同じなら描画済みの HTML を返す。
+    当月キャッシュは書き込み（作成・更新・削除の差分反映や再取得）のたびに revision が変わるので、
+    古い HTML が使われることはない。取得に失敗した場合（バージョン 0）はキャッシュしない。
+    """
+    started = time.perf_counter()
+    key = fragment_key("records", person_id, year, month)
+    cacheable = RECORDS_FRAGMENT_CACHE and source_version[0]
+    if cacheable:
+        cached = cache_get(key)
+        if cached is not None and cached[0] == source_version:
+            metrics.RECORDS_TABLE_RENDER.observe(time.perf_counter() - started, result="hit")
+            return cached[1]
+
+    total_amount = 0
+    for record_item in records_data:
+        record_item["subtotal"] = calc_subtotal(record_item)
+        if record_item.get("outbox_status") != "failed": # 送信失敗行は合計に含めない
+            total_amount += record_item["subtotal"]
+
+    counted_records = [r for r in records_data if r.get("outbox_status") != "failed"]
+    unique_workdays = set(r["WorkDay"] for r in counted_records if r.get("WorkDay") != "9999-12-31")
+    workdays_count = len(unique_workdays)
+
+    workoutput_total = 0
+    for r_item in counted_records:
+        if "分給" in r_item.get("WorkProcess", ""):
+            work_output_value = str(r_item.get("WorkOutput", "0")).strip()
+            if work_output_value and work_output_value.replace('.', '', 1).isdigit():
+                try: workoutput_total += float(work_output_value)
+                except ValueError: pass # ログは既に出力されていると仮定
+
+    html = Markup(render_template(
+        "_records_table.html",
+        records=records_data,
+        total_amount=total_amount,
+        workdays_count=workdays_count,
+        workoutput_total=workoutput_total,
+        current_year=year, current_month=month,
+    ))
+    if cacheable:
+        cache_set(key, (source_version, html), MONTH_CACHE_TTL_SEC)
+    metrics.RECORDS_TABLE_RENDER.observe(time.perf_counter() - started, result="miss" if cacheable else "disabled")
+    return html
+
 @ui_bp.route("/delete_record/<record_id>", methods=["POST"])
 @login_required
 def delete_record(record_id):
@@ -254,6 +418,7 @@ def delete_record(record_id):
 
     # ✅ キャッシュの当月から record_id を消す（あれば）
     if success:
+        _remember_write_version(logged_in_pid)
         try:
             from airtable_cache import month_cache_remove_record
             ok = month_cache_remove_record(logged_in_pid, year, month, record_id)
@@ -261,6 +426,13 @@ def delete_record(record_id):
                 current_app.logger.info(f"[CACHE] removed record {record_id} from {year}-{month:02d}")
         except Exception as e:
             current_app.logger.warning(f"delete cache update skipped: {e}")
+        if outbox.OUTBOX_ENABLED:
+            try:
+                # 直近に送信済みの行として補完表示され、削除した行が戻ってこないように
+                outbox.mark_deleted(logged_in_pid, record_id)
+            except Exception as e:
+                current_app.logger.warning(f"送信箱の更新に失敗（無視）: {e}")
+        realtime.publish_record_delete(logged_in_pid, record_id, year, month)
 
     return redirect(url_for(".records", year=year, month=month))
 
@@ -286,7 +458,7 @@ def edit_record(record_id):
             new_output_val = int(new_output_str)
         except ValueError:
             flash("❌ 作業量は数値で入力してください。", "error")
-            record_data_for_render, _ = get_airtable_record_details(logged_in_pid, record_id)
+            record_data_for_render, _ = get_record_details_cached(logged_in_pid, record_id, original_year, original_month)
             return render_template(
                 "edit_record.html",
                 record=record_data_for_render,
@@ -322,12 +494,20 @@ def edit_record(record_id):
                 current_app.logger.info(f"[CACHE] updated/moved record {record_id}")
             except Exception as e:
                 current_app.logger.warning(f"edit cache update skipped: {e}")
-
+            if outbox.OUTBOX_ENABLED:
+                try:
+                    # 直近に送信済みの行として、編集前の値・元の月で補完表示されないように
+                    outbox.update_sent(logged_in_pid, record_id, updated_fields)
+                except Exception as e:
+                    current_app.logger.warning(f"送信箱の更新に失敗（無視）: {e}")
+
+            _remember_write_version(logged_in_pid)
             session["edited_record_id"] = record_id
+            _publish_record_edit(logged_in_pid, record_id, original_year, original_month, new_y, new_m)
             return redirect(url_for(".records", year=new_y, month=new_m))  # ← ★これが重要
 
         # 更新失敗時：編集画面に留まる
-        record_data_for_render, _ = get_airtable_record_details(logged_in_pid, record_id)
+        record_data_for_render, _ = get_record_details_cached(logged_in_pid, record_id, original_year, original_month)
         return render_template(
             "edit_record.html",
             record=record_data_for_render,
@@ -337,7 +517,7 @@ def edit_record(record_id):
         )
 
     # --- GET ---
-    record_data, error_message = get_airtable_record_details(logged_in_pid, record_id)
+    record_data, error_message = get_record_details_cached(logged_in_pid, record_id, original_year, original_month)
     if error_message or record_data is None:
         flash(error_message or "❌ レコード取得に失敗しました。", "error")
         return redirect(url_for(".records", year=original_year, month=original_month))
@@ -349,3 +529,110 @@ def edit_record(record_id):
         original_year=original_year,
         original_month=original_month
     )
+
+
+
+def _publish_record_edit(person_id: str, record_id: str, from_year: int, from_month: int, to_year: int, to_month: int):
+    """編集結果を開いている records 画面へ通知する（行は更新後の当月キャッシュから取る）。"""
+    from airtable_cache import month_cache_find_record
+    row = month_cache_find_record(person_id, to_year, to_month, record_id)
+    if row is not None:
+        # 月を跨いだ場合も、元の月の画面は「別の月の行」として受け取って消す
+        row["subtotal"] = calc_subtotal(row)
+        realtime.publish_record_upsert(person_id, row)
+        return
+    # 移動先の月がキャッシュに無く行を組み立てられない場合は、その月の画面に読み直してもらう
+    realtime.publish_month_invalidate(person_id, to_year, to_month)
+    if (from_year, from_month) != (to_year, to_month):
+        realtime.publish_record_delete(person_id, record_id, from_year, from_month)
+
+
+# ----------------------------------------------------------------------------------
+# 給与計算用エクスポート（CSV ストリーミング）
+# ----------------------------------------------------------------------------------
+EXPORT_COLUMNS = ["PersonID", "PersonName", "WorkDay", "WorkCD", "WorkName", "BookName",
+                  "WorkProcess", "UnitPrice", "WorkOutput", "subtotal"]
+# エクスポート CSV の PersonID 列に入る目印（取得に失敗した人の行・最終行）。bulk_import.py も同じ値を見る
+EXPORT_ERROR_MARK = "#ERROR"
+EXPORT_END_MARK = "#END"
+
+def _parse_year_month(value: str, default: date) -> date:
+    """'YYYY-MM' を月初の date に変換する。空や不正値なら default を返す。"""
+    if not value:
+        return default
+    return datetime.strptime(value, "%Y-%m").date().replace(day=1)
+
+def _csv_line(row) -> str:
+    buf = io.StringIO()
+    csv.writer(buf).writerow(row)
+    return buf.getvalue()
+
+@ui_bp.route("/export/records.csv")
+@login_required
+def export_records():
+    """
+    指定月（from〜to、YYYY-MM）のレコードを CSV でストリーミング出力する。
+    Airtable のページを受け取るたびに行を書き出すため、件数に関わらずメモリ使用量は一定。
+    途中で取得に失敗した人は "#ERROR,PersonID,理由" の行を書き、最後に "#END,rows=N,errors=M" の行を書く
+    （給与計算側は最終行で完全な出力か確かめる）。
+      - personid 省略時はログインユーザー本人
+      - personid=all（全員分）は管理者のみ
+    """
+    logged_in_pid = session.get('logged_in_personid')
+    default_month = date(session.get("current_display_year", date.today().year),
+                         session.get("current_display_month", date.today().month), 1)
+    try:
+        start_month = _parse_year_month(request.args.get("from", ""), default_month)
+        end_month = _parse_year_month(request.args.get("to", ""), start_month)
+    except ValueError:
+        return "from/to は YYYY-MM 形式で指定してください。", 400
+    if end_month < start_month:
+        return "to は from 以降の月を指定してください。", 400
+    end_exclusive = (end_month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+    personid_param = request.args.get("personid", "").strip()
+    personid_dict, personid_list = get_cached_personid_data()
+    if personid_param == "all":
+        if not is_admin_personid(logged_in_pid):
+            return "全員分のエクスポートは管理者のみ実行できます。", 403
+        target_pids = list(personid_list)
+    elif personid_param and personid_param != str(logged_in_pid):
+        if not is_admin_personid(logged_in_pid):
+            return "他のユーザーのレコードはエクスポートできません。", 403
+        try:
+            target_pids = [int(personid_param)]
+        except ValueError:
+            return "無効なPersonIDです。", 400
+    else:
+        target_pids = [logged_in_pid]
+
+    current_app.logger.info(f"UI export - LoggedInPersonID={logged_in_pid}, Targets={len(target_pids)}件, "
+                            f"Range={start_month:%Y-%m}〜{end_month:%Y-%m}")
+
+    def generate():
+        yield "\ufeff" + _csv_line(EXPORT_COLUMNS)  # Excel で文字化けしないよう BOM 付き
+        rows, failed = 0, 0
+        for pid in target_pids:
+            pname = personid_dict.get(int(pid), {}).get("name", "")
+            try:
+                for page in iter_record_pages_for_range(str(pid), start_month, end_exclusive):
+                    rows += len(page)
+                    yield "".join(
+                        _csv_line([pid, pname, r["WorkDay"], r["WorkCD"], r["WorkName"], r.get("BookName", ""),
+                                   r["WorkProcess"], r["UnitPrice"], r["WorkOutput"], calc_subtotal(r)])
+                        for r in page
+                    )
+            except Exception as e:
+                # ストリーミング開始後はステータスを変更できないため、CSV に失敗の行を書いて次の人へ進む
+                failed += 1
+                current_app.logger.error(f"UI export - PersonID={pid} の取得に失敗しました: {e}", exc_info=True)
+                yield _csv_line([EXPORT_ERROR_MARK, pid, f"{pname} の行は途中までです（取得に失敗しました）"])
+        # 最終行。これが無い・errors が 0 でない CSV は不完全（途中で切れた・失敗した人がいる）
+        yield _csv_line([EXPORT_END_MARK, f"rows={rows}", f"errors={failed}"])
+
+    filename = f"records_{start_month:%Y%m}-{end_month:%Y%m}.csv"
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
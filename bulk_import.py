@@ -0,0 +1,213 @@
+# bulk_import.py
+"""
+手書きの集計表などを CSV でまとめて登録する（管理者用、/api/import/records から呼ばれる）。
+
+  - 先に全行を読み、取り込み開始時点のマスターデータ（PersonID / WorkCD / 行程・単価）で検証する
+    （文字コードの誤りや行数の超過で途中から取り込めなくなっても、前半だけ作成済みにならないように）
+  - 検証を通った行は PersonID（= Airtable のテーブル）ごとに10件ずつ一括作成する
+  - Airtable のレート制限（1ベースあたり 5 req/sec）を超えないよう、送信間隔を IMPORT_RATE_LIMIT_PER_SEC に抑える
+  - 一括作成は、通信エラー・タイムアウト・5xx では Airtable 側で作成済みのことがあるため再送しない
+    （結果は "unknown"。records 画面で確かめてから、その行だけ取り込み直す）。429 は作成されないので再送する。
+    AIRTABLE_IDEMPOTENCY_FIELD が設定されていれば、行ごとのキー（CSV の内容と行番号から作る）で upsert するので
+    どのエラーでも再送でき、同じ CSV を取り込み直しても重複しない
+
+CSV の列（1行目はヘッダー。給与計算用エクスポートの CSV もそのまま取り込める）:
+  PersonID, WorkDay(YYYY-MM-DD), WorkCD, WorkName, BookName, WorkProcess, WorkOutput
+  - WorkCD が空・0 の行は品名なしとして登録する（入力フォームと同じ。品名なしの行は 0 として保存・エクスポートされる）
+  - WorkName は WorkCD に品名が複数ある場合のみ必須。BookName 省略時はマスターの値を使う
+  - UnitPrice は CSV の値を使わず、行程のマスター単価を使う
+  - エクスポートの最終行（PersonID が "#END"）は読み飛ばす。"#ERROR" の行（取得に失敗した人）はエラーにする
+"""
+import csv
+import hashlib
+import logging
+import os
+import time
+from datetime import datetime
+
+import data_services
+from airtable_service import AIRTABLE_BATCH_SIZE, _build_create_fields, can_upsert_batch, create_airtable_records_batch
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# 画面からの通常の送信の分を残すため、Airtable の上限(5 req/sec)より少し低くする
+IMPORT_RATE_LIMIT_PER_SEC = float(os.environ.get("IMPORT_RATE_LIMIT_PER_SEC", "4"))
+IMPORT_MAX_RETRIES = int(os.environ.get("IMPORT_MAX_RETRIES", "3"))
+IMPORT_MAX_ROWS = int(os.environ.get("IMPORT_MAX_ROWS", "5000"))
+
+REQUIRED_COLUMNS = ("PersonID", "WorkDay", "WorkProcess", "WorkOutput")
+# エクスポート CSV の目印（blueprints/ui.py の EXPORT_ERROR_MARK / EXPORT_END_MARK）
+EXPORT_ERROR_MARK = "#ERROR"
+EXPORT_END_MARK = "#END"
+
+
+# 同時に複数の取り込みが走っても、合計でレート制限を守る
+_rate_limiter = RateLimiter(IMPORT_RATE_LIMIT_PER_SEC)
+
+
+def _snapshot_master_data() -> tuple:
+    """取り込み中に参照するマスターデータ。途中で再ロードされても1回の取り込みの中では同じものを使う。"""
+    persons, _ = data_services.get_cached_personid_data()
+    workcords = data_services.get_cached_workcord_data()
+    _, unitprices = data_services.get_cached_workprocess_data()
+    return {str(pid) for pid in persons}, workcords, unitprices
+
+
+def validate_row(row: dict, person_ids: set, workcords: dict, unitprices: dict) -> tuple:
+    """CSV の1行を検証し、(PersonID, Airtable の fields, エラーのリスト) を返す。"""
+    errors = []
+    value = lambda name: (row.get(name) or "").strip()
+
+    person_id = value("PersonID")
+    if person_id not in person_ids:
+        errors.append(f"PersonID '{person_id}' は登録されていません")
+
+    workday = value("WorkDay")
+    try:
+        datetime.strptime(workday, "%Y-%m-%d")
+    except ValueError:
+        errors.append(f"WorkDay '{workday}' は YYYY-MM-DD 形式ではありません")
+
+    workprocess = value("WorkProcess")
+    unitprice = unitprices.get(workprocess)
+    if unitprice is None:
+        errors.append(f"WorkProcess '{workprocess}' はマスターにありません")
+
+    workoutput = value("WorkOutput") or "0"
+    try:
+        workoutput_val = int(workoutput)
+    except ValueError:
+        errors.append(f"WorkOutput '{workoutput}' は整数ではありません")
+        workoutput_val = 0
+
+    workcd, workname, bookname = value("WorkCD"), value("WorkName"), value("BookName")
+    if workcd.isdigit() and int(workcd) == 0:
+        workcd = ""  # 品名なしの行（エクスポートでは 0 になる）
+    if workcd:
+        candidates = workcords.get(str(int(workcd))) if workcd.isdigit() else None
+        if not candidates:
+            errors.append(f"WorkCD '{workcd}' はマスターにありません")
+        else:
+            matched = [c for c in candidates if c["workname"] == workname] if workname else candidates
+            if len(matched) == 1:
+                workname = matched[0]["workname"]
+                bookname = bookname or matched[0]["bookname"]
+            elif not matched:
+                errors.append(f"WorkName '{workname}' は WorkCD '{workcd}' の品名にありません")
+            else:
+                errors.append(f"WorkCD '{workcd}' には品名が複数あるため WorkName を指定してください")
+
+    if errors:
+        return person_id, None, errors
+    fields = _build_create_fields(person_id, workcd, workname, bookname, workoutput_val, workprocess, unitprice, workday)
+    return person_id, fields, []
+
+
+def _send_with_retry(person_id: str, fields_list: list, idempotency_keys: list) -> tuple:
+    """
+    レート制限に合わせて一括作成し、(status, message, new_ids, 作成されたか不明か) を返す。
+    429 は間隔をあけて再試行する。5xx・通信エラーは upsert できる場合だけ再試行する（できない場合は結果不明）。
+    """
+    retry_safe = can_upsert_batch(idempotency_keys)
+    for attempt in range(IMPORT_MAX_RETRIES + 1):
+        _rate_limiter.wait()
+        status, message, new_ids = create_airtable_records_batch(person_id, fields_list, idempotency_keys)
+        if new_ids:
+            return status, message, new_ids, False
+        # 通信エラー・5xx・成功したが ID が取れなかった場合は、Airtable 側で作成済みのことがある
+        uncertain = status is None or status >= 500 or status in (200, 201)
+        if not (status == 429 or (uncertain and retry_safe)):
+            return status, message, new_ids, uncertain and not retry_safe
+        if attempt < IMPORT_MAX_RETRIES:
+            time.sleep(min(30, 2 ** attempt))
+    return status, message, new_ids, False
+
+
+def import_csv(lines, dry_run: bool = False) -> dict:
+    """
+    CSV（テキストの行のイテラブル）を取り込み、行ごとの結果と集計を返す。
+    dry_run=True の場合は検証のみ行い、Airtable には送信しない。
+    送信中に失敗しても、それまでの行ごとの結果を返す（未送信の行は "failed"）。
+    """
+    started = time.perf_counter()
+    person_ids, workcords, unitprices = _snapshot_master_data()
+    lines = list(lines)  # 送信前に全行を読む（文字コードの誤りはここで UnicodeDecodeError になる）
+    reader = csv.DictReader(lines)
+    missing = [c for c in REQUIRED_COLUMNS if c not in (reader.fieldnames or [])]
+    if missing:
+        return {"error": f"CSV に必要な列がありません: {', '.join(missing)}"}
+    # 行ごとの冪等キーの元（同じ CSV を取り込み直したときだけ同じキーになる）
+    digest = hashlib.sha256("".join(lines).encode("utf-8")).hexdigest()[:16]
+
+    # 1. 全行を検証する
+    results = []
+    pending = {}  # { person_id: [(結果の行, fields, 冪等キー), ...] }
+    for row in reader:
+        line_no = reader.line_num
+        if len(results) >= IMPORT_MAX_ROWS:
+            return {"error": f"1回に取り込めるのは {IMPORT_MAX_ROWS} 行までです（何も登録していません）"}
+        mark = (row.get("PersonID") or "").strip()
+        if mark == EXPORT_END_MARK:
+            continue
+        if mark == EXPORT_ERROR_MARK:
+            results.append({"row": line_no, "status": "invalid",
+                            "errors": ["エクスポートが途中で失敗した人の行です（エクスポートし直してください）"]})
+            continue
+        person_id, fields, errors = validate_row(row, person_ids, workcords, unitprices)
+        result = {"row": line_no, "person_id": person_id}
+        results.append(result)
+        if errors:
+            result.update(status="invalid", errors=errors)
+        elif dry_run:
+            result["status"] = "valid"
+        else:
+            result["status"] = "failed"  # 送信するまでの仮の状態（途中で止まった場合にそのまま返る）
+            pending.setdefault(person_id, []).append((result, fields, f"import:{digest}:{line_no}"))
+
+    # 2. PersonID ごとに一括作成する
+    batches = 0
+    chunk = []
+    try:
+        for person_id, items in pending.items():
+            for i in range(0, len(items), AIRTABLE_BATCH_SIZE):
+                chunk = items[i:i + AIRTABLE_BATCH_SIZE]
+                batches += 1
+                status, message, new_ids, unknown = _send_with_retry(
+                    person_id, [fields for _, fields, _ in chunk], [key for _, _, key in chunk])
+                for j, (result, _, _) in enumerate(chunk):
+                    if new_ids:
+                        result.update(status="created", id=new_ids[j])
+                    elif unknown:
+                        result.update(status="unknown", message=message + "（Airtable に作成されたか不明です。"
+                                      "records 画面で確かめてから、無い行だけ取り込み直してください）")
+                    else:
+                        result.update(status="failed", message=message)
+        chunk = []
+    except Exception as e:
+        logger.error("CSV取り込みの送信中にエラー: %s", e, exc_info=True)
+        for result, _, _ in chunk:  # 送信中だった行は作成済みのことがある
+            if result["status"] == "failed":
+                result.update(status="unknown", message=f"送信中に中断しました（Airtable に作成されたか不明です）: {e}")
+        for r in results:
+            if r["status"] == "failed" and "message" not in r:
+                r["message"] = f"送信前に中断しました: {e}"
+
+    elapsed = time.perf_counter() - started
+    counts = {}
+    for r in results:
+        counts[r["status"]] = counts.get(r["status"], 0) + 1
+    summary = {
+        "rows": len(results),
+        "created": counts.get("created", 0),
+        "valid": counts.get("valid", 0),
+        "invalid": counts.get("invalid", 0),
+        "failed": counts.get("failed", 0),
+        "unknown": counts.get("unknown", 0),
+        "batches": batches,
+        "elapsed_sec": round(elapsed, 3),
+        "rows_per_sec": round(len(results) / elapsed, 1) if elapsed > 0 else None,
+        "dry_run": dry_run,
+    }
+    logger.info("CSV取り込み完了: %s", summary)
+    return {"summary": summary, "rows": results}
@@ -0,0 +1,159 @@
+# circuit_breaker.py
+"""
+上流（Airtable / Google Sheets）ごとのサーキットブレーカーと、観測したレイテンシから決めるタイムアウト。
+
+  - closed   : 通常どおり呼び出す。連続 failure_threshold 回失敗すると open
+  - open     : reset_sec の間は呼び出さずに即座に失敗させる（呼び出し元はキャッシュ・古いデータで応答する）
+  - half_open: reset_sec が過ぎたら1件だけ試しに呼び出す。成功で closed、失敗で再び open
+
+record_* には呼び出しを始めた時刻（started_at, time.monotonic）を渡す。open になる前に始まって遅れて
+終わった呼び出しの結果では状態を変えない（open 中に届いた遅い成功でブレーカーが閉じないように）。
+
+timeout() は直近の成功した呼び出しの所要時間の p99 × TIMEOUT_MULTIPLIER を返す（下限 min_timeout_sec、
+上限は呼び出し元が渡す既定値）。上流が遅くなったときにスレッドが既定値いっぱいまで待たされないようにする。
+途中で打ち切ってよい読み取り（冪等な呼び出し）だけに使う。
+状態はワーカー（プロセス）ごとに持つ。
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT_MULTIPLIER = float(os.environ.get("BREAKER_TIMEOUT_MULTIPLIER", "3"))
+TIMEOUT_MIN_SAMPLES = 20   # これより観測が少ない間は呼び出し元の既定値を使う
+LATENCY_WINDOW = 200       # 操作ごとに保持する直近の所要時間の数
+
+STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+_breakers = {}  # { name: CircuitBreaker }
+
+
+class CircuitBreaker:
+    """1つの上流に対するブレーカー（スレッドセーフ）。"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_sec: float = 30.0, min_timeout_sec: float = 1.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_sec = reset_sec
+        self.min_timeout_sec = min_timeout_sec
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0          # 連続失敗回数
+        self._opened_at = 0.0       # time.monotonic
+        self._probe_in_flight = False
+        self._latencies = {}        # { 操作名: deque(所要時間) }
+        self._timeouts = {}         # { 操作名: 直近に返したタイムアウト }
+        _breakers[name] = self
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def _set_state(self, state: str):
+        """ロックを持った状態で呼ぶ。"""
+        if state == self._state:
+            return
+        previous, self._state = self._state, state
+        metrics.CIRCUIT_BREAKER_TRANSITIONS.inc(upstream=self.name, state=state)
+        if state == "open":
+            self._opened_at = time.monotonic()
+            logger.warning("サーキットブレーカー %s: %s → open（%d回連続で失敗。%.0f秒間は呼び出しを止めます）",
+                           self.name, previous, self._failures, self.reset_sec)
+        else:
+            logger.info("サーキットブレーカー %s: %s → %s", self.name, previous, state)
+
+    def allow_request(self) -> bool:
+        """呼び出してよければ True。False なら呼び出さずに失敗として扱う（record_* は呼ばない）。"""
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < self.reset_sec:
+                    metrics.CIRCUIT_BREAKER_REJECTED.inc(upstream=self.name)
+                    return False
+                self._set_state("half_open")
+            if self._probe_in_flight:
+                metrics.CIRCUIT_BREAKER_REJECTED.inc(upstream=self.name)
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def _is_stale(self, started_at: float | None) -> bool:
+        """
+        ロックを持った状態で呼ぶ。closed 以外のときに、この open より前に始まった呼び出しなら True。
+        open の間は呼び出しを通さないので、open / half_open 中に届く結果のうち試し呼び出しのもの以外はこれに当たる。
+        """
+        if self._state == "closed":
+            return False
+        return started_at is None or started_at < self._opened_at
+
+    def record_success(self, latency_sec: float = None, op: str = "", started_at: float = None):
+        """
+        成功を記録する。started_at は呼び出しを始めた時刻（time.monotonic）。
+        half_open の試し呼び出しの成功でだけ closed に戻す。
+        """
+        with self._lock:
+            if latency_sec is not None:
+                self._latencies.setdefault(op, deque(maxlen=LATENCY_WINDOW)).append(latency_sec)
+            if self._is_stale(started_at):
+                return
+            self._failures = 0
+            self._probe_in_flight = False
+            self._set_state("closed")
+
+    def record_failure(self, latency_sec: float = None, op: str = "", started_at: float = None):
+        """
+        失敗を記録する。タイムアウトで失敗した場合は latency_sec に待った時間を渡す
+        （上流が全体に遅くなったとき、タイムアウトもそれに合わせて伸びるように）。
+        """
+        with self._lock:
+            if latency_sec is not None:
+                self._latencies.setdefault(op, deque(maxlen=LATENCY_WINDOW)).append(latency_sec)
+            if self._is_stale(started_at):
+                return
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                self._set_state("open")
+
+    def timeout(self, default_sec: float, op: str = "") -> float:
+        """
+        op の直近の所要時間から決めたタイムアウト（秒）。default_sec を上限とする。
+        half_open の試し呼び出しは、短すぎるタイムアウトで失敗し続けないよう default_sec で行う。
+        """
+        with self._lock:
+            samples = list(self._latencies.get(op, ()))
+            probing = self._state != "closed"
+        if probing or len(samples) < TIMEOUT_MIN_SAMPLES:
+            value = default_sec
+        else:
+            samples.sort()
+            p99 = samples[min(int(len(samples) * 0.99), len(samples) - 1)]
+            value = min(default_sec, max(self.min_timeout_sec, p99 * TIMEOUT_MULTIPLIER))
+        self._timeouts[op] = value
+        return value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "open_for_sec": round(time.monotonic() - self._opened_at, 1) if self._state != "closed" else 0.0,
+                "timeouts_sec": {op: round(value, 3) for op, value in self._timeouts.items()},
+            }
+
+
+def get_breaker_states() -> dict:
+    """全ブレーカーの状態（/readyz・メトリクス用）。"""
+    return {name: breaker.snapshot() for name, breaker in _breakers.items()}
+
+
+metrics.CIRCUIT_BREAKER_STATE.set_function(
+    lambda: {(name,): STATE_VALUES[breaker.state] for name, breaker in _breakers.items()})
+metrics.UPSTREAM_TIMEOUT.set_function(
+    lambda: {(name, op): value for name, breaker in _breakers.items() for op, value in dict(breaker._timeouts).items()})
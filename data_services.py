@@ -1,18 +1,17 @@
 # data_services.py
 
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 import time
 import os
 import logging
+import functools
+import threading
+
+import metrics
+import search_index
+from circuit_breaker import CircuitBreaker
+from instrumentation import timed_function
 
 logger = logging.getLogger(__name__)
-if not logger.hasHandlers():
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    logger.setLevel(logging.INFO)
 
 # ✅ Google Sheets 設定 (These should ideally come from environment variables or a config file too)
 SERVICE_ACCOUNT_FILE = os.environ.get("SERVICE_ACCOUNT_FILE", "configGooglesheet.json")
@@ -23,24 +22,98 @@ WORKPROCESS_WORKSHEET_NAME = "wsWorkProcess"
 
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
 
-# ★★★ Google Sheets API Client Initialization - ADD THIS BLOCK ★★★
-client = None # Initialize client to None
-try:
-    if os.path.exists(SERVICE_ACCOUNT_FILE):
-        creds = ServiceAccountCredentials.from_json_keyfile_name(SERVICE_ACCOUNT_FILE, scope)
-        client = gspread.authorize(creds)
-        logger.info("Google Sheets client initialized successfully.")
-    else:
-        logger.critical(f"サービスアカウントファイルが見つかりません: {SERVICE_ACCOUNT_FILE}")
-        # client remains None, functions using it will log errors and return early
-except Exception as e:
-    logger.critical(f"Google Sheets クライアントの初期化に失敗しました: {e}", exc_info=True)
-    # client remains None
-# ★★★ END OF CLIENT INITIALIZATION BLOCK ★★★
+# ===== Google Sheets クライアント =====
+# gspread / oauth2client の import と認証は重いので、import 時ではなく最初に使うときに行う（get_client）。
+# ベンチマークでは client に代替クライアントを直接設定する。
+client = None
+CLIENT_RETRY_SEC = 60  # 初期化に失敗した後、再試行するまでの秒数
+_client_lock = threading.Lock()
+_client_failed_at = 0.0
+
+def get_client():
+    """Google Sheets クライアントを返す（初回呼び出し時に初期化。スレッドセーフ）。失敗時は None。"""
+    global client, _client_failed_at
+    if client is not None:
+        return client
+    with _client_lock:
+        if client is not None:
+            return client
+        if _client_failed_at and time.time() - _client_failed_at < CLIENT_RETRY_SEC:
+            return None
+        try:
+            if not os.path.exists(SERVICE_ACCOUNT_FILE):
+                logger.critical("サービスアカウントファイルが見つかりません: %s", SERVICE_ACCOUNT_FILE)
+                _client_failed_at = time.time()
+                return None
+            import gspread
+            from oauth2client.service_account import ServiceAccountCredentials
+            creds = ServiceAccountCredentials.from_json_keyfile_name(SERVICE_ACCOUNT_FILE, scope)
+            client = gspread.authorize(creds)
+            _client_failed_at = 0.0
+            logger.info("Google Sheets client initialized successfully.")
+        except Exception as e:
+            logger.critical("Google Sheets クライアントの初期化に失敗しました: %s", e, exc_info=True)
+            _client_failed_at = time.time()
+        return client
 
 
 CACHE_TTL = 300  # 300秒 (5分間)
 
+# ===== 障害時の扱い =====
+# Google Sheets が連続で失敗したら、しばらく再ロードを試みずに前回ロードしたデータを使い続ける。
+# 1回の HTTP 呼び出しのタイムアウトは、直近のロード時間から決める（SHEETS_TIMEOUT_SEC が上限。gspread の既定は無制限）
+SHEETS_TIMEOUT_SEC = float(os.environ.get("SHEETS_TIMEOUT_SEC", "30"))
+SHEETS_BREAKER = CircuitBreaker(
+    "sheets",
+    failure_threshold=int(os.environ.get("SHEETS_BREAKER_FAILURES", "3")),
+    reset_sec=float(os.environ.get("SHEETS_BREAKER_RESET_SEC", "60")),
+    min_timeout_sec=5.0,
+)
+
+def reset_client_connections():
+    """
+    親プロセスから引き継いだ Google Sheets クライアントの接続プールを閉じる（gunicorn の post_fork から呼ぶ）。
+    認証情報はそのまま使い、次の呼び出しで新しい接続を張る。
+    """
+    session = getattr(getattr(client, "http_client", client), "session", None)
+    if session is not None:
+        session.close()
+
+def _instrumented_load(sheet: str, loaded_at):
+    """
+    load_* 関数の所要時間をフェーズ "sheets" とメトリクスに記録し、SHEETS_BREAKER で失敗を数えるデコレータ。
+    loaded_at() は最終ロード時刻を返す関数で、これが進んだかどうかで成功/失敗を判定する。
+    ブレーカーが open の間はロードせずに戻る（前回ロードしたデータがそのまま使われる）。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        @timed_function("sheets")
+        def wrapper(*args, **kwargs):
+            if not SHEETS_BREAKER.allow_request():
+                logger.info("Google Sheets への接続を一時停止中のため %s の再ロードを見送りました（前回のデータを使います）", sheet)
+                return None
+            admitted_at = time.monotonic()
+            timeout = SHEETS_BREAKER.timeout(SHEETS_TIMEOUT_SEC, op=sheet)
+            sheets_client = get_client()
+            if sheets_client is not None and hasattr(sheets_client, "set_timeout"):
+                sheets_client.set_timeout(timeout)
+            before = loaded_at()
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                if loaded_at() != before:
+                    result = "ok"
+                    SHEETS_BREAKER.record_success(elapsed, op=sheet, started_at=admitted_at)
+                else:
+                    result = "error"
+                    # タイムアウトまで待った失敗だけ所要時間を記録する（遅くなった上流に合わせてタイムアウトを伸ばす）
+                    SHEETS_BREAKER.record_failure(elapsed if elapsed >= timeout else None, op=sheet, started_at=admitted_at)
+                metrics.SHEETS_LOAD_DURATION.observe(elapsed, sheet=sheet, result=result)
+        return wrapper
+    return decorator
+
 # ===== PersonID データ =====
 PERSON_ID_DICT = {}
 # ... (rest of your data_services.py code, like load_personid_data, etc.) ...
@@ -51,8 +124,10 @@ PERSON_ID_DICT = {} # 構造変更: { pid: {"name": "pname", "pin_hash": "hash_v
 PERSON_ID_LIST = [] # これはPIDの数値リストのままでOK
 last_personid_load_time = 0
 
+@_instrumented_load("personid", lambda: last_personid_load_time)
 def load_personid_data():
     global PERSON_ID_DICT, PERSON_ID_LIST, last_personid_load_time
+    client = get_client()
     if not client:
         logger.error("Google Sheets クライアントが初期化されていません。PersonIDデータをロードできません。")
         return
@@ -92,9 +167,8 @@ def load_personid_data():
         last_personid_load_time = time.time()
         logger.info(f"Google Sheets から {len(PERSON_ID_DICT)} 件の PersonID/PersonName/PINHash レコードをロードしました！")
     except Exception as e:
+        # 前回ロードしたデータは残す（Sheets の障害中もログインできるように）
         logger.error(f"Google Sheets の PersonID データ取得に失敗: {e}", exc_info=True)
-        PERSON_ID_DICT = {} # エラー時は空にする
-        PERSON_ID_LIST = []
 
 def get_cached_personid_data():
     # この関数は PERSON_ID_DICT と PERSON_ID_LIST を返すので、
@@ -111,28 +185,35 @@ def get_cached_personid_data():
 workcord_dict = {}
 last_workcord_load_time = 0
 
+@_instrumented_load("workcord", lambda: last_workcord_load_time)
 def load_workcord_data():
     global workcord_dict, last_workcord_load_time
+    client = get_client()
     if not client:
         logger.error("Google Sheets クライアントが初期化されていません。WorkCordデータをロードできません。")
         return
-    workcord_dict = {} # 毎回初期化
     try:
         sheet = client.open(SPREADSHEET_NAME).worksheet(WORKSHEET_NAME)
         records = sheet.get_all_records()
+        temp_dict = {} # 読み込みに成功してから入れ替える（失敗時は前回のデータを残す）
         for row in records:
             workcord = str(row.get("WorkCord", "")).strip()
             workname = str(row.get("WorkName", "")).strip()
             bookname = str(row.get("BookName", "")).strip()
             if workcord and workname: # BookNameは空でも許容するかもしれないので条件から外す場合も
-                if workcord not in workcord_dict:
-                    workcord_dict[workcord] = []
-                workcord_dict[workcord].append({"workname": workname, "bookname": bookname})
+                if workcord not in temp_dict:
+                    temp_dict[workcord] = []
+                temp_dict[workcord].append({"workname": workname, "bookname": bookname})
+        workcord_dict = temp_dict
+        last_workcord_load_time = time.time()
         total_records = sum(len(lst) for lst in workcord_dict.values())
         logger.info(f"Google Sheets から {total_records} 件の WorkCD/WorkName/BookName レコードをロードしました！")
-        last_workcord_load_time = time.time()
     except Exception as e:
         logger.error(f"Google Sheets の WorkCordデータ取得に失敗: {e}", exc_info=True)
+        return
+    # 品名・書名検索のインデックス（/api/search_worknames）は別スレッドで作る。
+    # 作成は数秒かかることがあり、期限切れでロードしたリクエストや Sheets の所要時間・ブレーカーに含めない
+    search_index.rebuild_in_background(temp_dict)
 
 def get_cached_workcord_data():
     if not workcord_dict or (time.time() - last_workcord_load_time > CACHE_TTL):
@@ -145,8 +226,10 @@ workprocess_list_cache = []
 unitprice_dict_cache = {}
 last_workprocess_load_time = 0
 
+@_instrumented_load("workprocess", lambda: last_workprocess_load_time)
 def load_workprocess_data():
     global workprocess_list_cache, unitprice_dict_cache, last_workprocess_load_time
+    client = get_client()
     if not client:
         logger.error("Google Sheets クライアントが初期化されていません。WorkProcessデータをロードできません。")
         return
@@ -178,4 +261,40 @@ def get_cached_workprocess_data():
     if not workprocess_list_cache or (time.time() - last_workprocess_load_time > CACHE_TTL):
         logger.info("WorkProcessキャッシュが無効または期限切れです。再ロードします。")
         load_workprocess_data()
-    return workprocess_list_cache, unitprice_dict_cache
\ No newline at end of file
+    return workprocess_list_cache, unitprice_dict_cache
+
+def get_master_data_load_times() -> dict:
+    """マスターデータごとの最終ロード時刻（未ロードは0）。"""
+    return {
+        "personid": last_personid_load_time,
+        "workcord": last_workcord_load_time,
+        "workprocess": last_workprocess_load_time,
+    }
+
+def get_master_data_status() -> dict:
+    """
+    マスターデータごとの件数と最終ロードからの経過秒数（未ロードは None）。
+    ロードや Google Sheets へのアクセスは行わない（/readyz 用）。
+    """
+    now = time.time()
+    counts = {
+        "personid": len(PERSON_ID_DICT),
+        "workcord": len(workcord_dict),
+        "workprocess": len(workprocess_list_cache),
+    }
+    return {
+        sheet: {"count": counts[sheet], "age_sec": round(now - loaded, 1) if loaded else None}
+        for sheet, loaded in get_master_data_load_times().items()
+    }
+
+def refresh_stale_master_data():
+    """CACHE_TTL を過ぎたマスターデータだけを読み直す（アクセスの無いワーカーでも古くならないように）。"""
+    get_cached_personid_data()
+    get_cached_workcord_data()
+    get_cached_workprocess_data()
+
+def _master_data_ages() -> dict:
+    now = time.time()
+    return {(sheet,): now - loaded for sheet, loaded in get_master_data_load_times().items() if loaded}
+
+metrics.MASTER_DATA_AGE.set_function(_master_data_ages)
@@ -0,0 +1,95 @@
+# gunicorn.conf.py
+"""
+gunicorn の設定（Procfile: web: gunicorn -c gunicorn.conf.py app:app）。
+
+  - preload_app: マスターで app を1回だけ import し、マスターデータ（Google Sheets）もマスターで
+    ロードしてから fork する。ワーカーはコピーオンライトで共有し、起動直後に各ワーカーが
+    一斉に Sheets を読みに行かない
+  - post_fork: 親から引き継いではいけないもの（HTTP 接続プール、イベントループ、
+    送信箱ドレイナー・ログ出力のスレッド、メトリクスの値、SocketIO の配信元ID）をワーカーごとに作り直す
+  - worker_exit: 終了するワーカーのメトリクスを最後に書き出す（/metrics の合算から漏れないように）
+
+環境変数: PORT, WEB_CONCURRENCY（ワーカー数）, GUNICORN_THREADS, GUNICORN_TIMEOUT,
+          GUNICORN_PRELOAD=0（preload を無効にして比較する場合）
+"""
+import os
+import tempfile
+import threading
+import time
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '10000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+# records 画面の WebSocket 接続（realtime.py）は開いている間スレッドを1つ使うので多めにする
+threads = int(os.environ.get("GUNICORN_THREADS", "32"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+keepalive = 5
+preload_app = os.environ.get("GUNICORN_PRELOAD", "1") == "1"
+
+# 複数ワーカーの /metrics を合算するための書き出し先（metrics.py が import される前に設定する）
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "skyandsea-metrics"))
+
+
+def _load_master_data(server):
+    import data_services
+    import search_index
+    started = time.perf_counter()
+    data_services.load_personid_data()
+    data_services.load_workcord_data()
+    data_services.load_workprocess_data()
+    # 品名検索インデックスもマスターで作り終えてから fork する（ワーカーで作り直さない）
+    search_index.rebuild(data_services.workcord_dict)
+    server.log.info("マスターデータをロードしました (%.2fs)", time.perf_counter() - started)
+
+
+def when_ready(server):
+    """マスターで、最初のワーカーを fork する直前に1回だけ呼ばれる。"""
+    import metrics
+    import mirror
+    import outbox
+
+    metrics.reset_dir()
+    _load_master_data(server)
+    # app の import 時にマスターで起動したドレイナーは止める（送信はワーカーで行う）
+    outbox.stop_drainer()
+    mirror.stop_sync()
+    metrics.flush(force=True)
+
+
+def pre_fork(server, worker):
+    """ワーカーの再起動時、マスターのデータが古い（または未ロードの）場合は fork 前に読み直す。"""
+    import data_services
+    loaded = min(data_services.get_master_data_load_times().values())
+    if time.time() - loaded > data_services.CACHE_TTL:
+        _load_master_data(server)
+
+
+def post_fork(server, worker):
+    import airtable_service
+    import airtable_service_async
+    import data_services
+    import logging_setup
+    import metrics
+    import realtime
+    import search_index
+
+    logging_setup.reinit_after_fork()
+    metrics.reset_after_fork()
+    metrics.start_flusher()
+    realtime.reset_after_fork()
+    airtable_service.reset_http_session()
+    airtable_service_async.reset_background_loop()
+    data_services.reset_client_connections()
+    search_index.reset_after_fork()
+    # auth_service の照合用スレッドプールと outbox / mirror の SQLite 接続はプロセスIDを見て自動で作り直される
+    airtable_service.start_outbox_drainer()
+    # ミラーの同期はリースを取れた1ワーカーだけが行う
+    airtable_service.start_mirror_sync()
+    # Airtable への接続を先に張っておく（/readyz は一度接続できるまで 503）
+    threading.Thread(target=airtable_service.warm_connection, name="airtable-warm", daemon=True).start()
+
+
+def worker_exit(server, worker):
+    """ワーカーの終了時（ワーカー側）に、前回の書き出し以降の値を書き出す。"""
+    import metrics
+    metrics.flush(force=True)
@@ -0,0 +1,112 @@
+# idempotency.py
+"""
+入力フォームの二重送信（ダブルクリック・タイムアウト後の再送）を1回の登録にまとめる。
+
+  - new_key()  : フォームに埋め込む冪等キーを発行する
+  - fingerprint() : 送信内容の指紋
+  - run_once() : (PersonID, キー, 送信内容の指紋) ごとに処理を1回だけ実行する
+      * 同じキーの処理が実行中なら、新たに実行せずその完了を待って同じ結果を返す
+      * 成功済みなら IDEMPOTENCY_TTL_SEC の間、最初の結果をそのまま返す
+      * 失敗した結果は保存しない（同じキーでの再試行は改めて実行する）
+      * キーが同じでも内容が違えば別の送信として実行する（戻るボタンで前のフォームに戻り、
+        値を直して送信した場合など。最初の結果を返すと新しい入力が黙って捨てられる）
+
+記録はプロセス内のみ。ワーカーをまたいだ重複は、送信箱(outbox)の一意キーと
+AIRTABLE_IDEMPOTENCY_FIELD による upsert で1件にまとまる。
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_SEC = int(os.environ.get("IDEMPOTENCY_TTL_SEC", "600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+IDEMPOTENCY_WAIT_SEC = float(os.environ.get("IDEMPOTENCY_WAIT_SEC", "30"))
+
+_KEY_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+_lock = threading.Lock()
+_results = OrderedDict()  # { (person_id, key, 指紋): (result, expire_at) }  登録順 = 期限順
+_in_flight = {}           # { (person_id, key, 指紋): _Call }
+
+
+class _Call:
+    """実行中の処理。待機中のスレッドは done を待って result を受け取る。"""
+    __slots__ = ("done", "result")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+def new_key() -> str:
+    return secrets.token_urlsafe(24)
+
+
+def is_valid_key(key) -> bool:
+    return bool(key) and bool(_KEY_PATTERN.match(key))
+
+
+def fingerprint(payload: dict) -> str:
+    """送信内容（正規化済みの値の dict）の指紋。キーの順序によらない。"""
+    data = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()[:16]
+
+
+def _prune(now: float):
+    """期限切れと上限超過分を古い順に捨てる（_lock 取得中に呼ぶ）。"""
+    while _results:
+        _, expire_at = next(iter(_results.values()))
+        if expire_at > now and len(_results) <= IDEMPOTENCY_MAX_ENTRIES:
+            break
+        _results.popitem(last=False)
+
+
+def run_once(person_id, key: str, func, is_success, payload_fingerprint: str = "") -> tuple:
+    """
+    func() を (person_id, key, payload_fingerprint) ごとに1回だけ実行し、(結果, 重複だったか) を返す。
+    is_success(結果) が真の結果だけを IDEMPOTENCY_TTL_SEC の間保存する。
+    payload_fingerprint には fingerprint(送信内容) を渡す。func の中で使う下流のキー（送信箱など）にも
+    同じ指紋を含めること（含めないと、内容の違う送信が下流で前の送信にまとめられる）。
+    """
+    entry_key = (str(person_id), key, payload_fingerprint)
+    with _lock:
+        _prune(time.monotonic())
+        cached = _results.get(entry_key)
+        if cached:
+            metrics.IDEMPOTENT_SUBMISSIONS.inc(result="replayed")
+            return cached[0], True
+        call = _in_flight.get(entry_key)
+        owner = call is None
+        if owner:
+            call = _in_flight[entry_key] = _Call()
+
+    if not owner:
+        metrics.IDEMPOTENT_SUBMISSIONS.inc(result="collapsed")
+        logger.info("二重送信を検出（処理中の送信の完了を待ちます）: PersonID=%s", person_id)
+        if not call.done.wait(IDEMPOTENCY_WAIT_SEC):
+            return (None, "⚠ 同じ内容を送信中です。しばらくしてから一覧を確認してください。", None), True
+        if call.result is None:  # 最初の送信が例外で終わった
+            return (None, "⚠ 送信に失敗しました。もう一度送信してください。", None), True
+        return call.result, True
+
+    metrics.IDEMPOTENT_SUBMISSIONS.inc(result="executed")
+    try:
+        call.result = func()
+        return call.result, False
+    finally:
+        with _lock:
+            # 失敗は保存しない（待機中のスレッドには call.result で同じ結果を返す）
+            if call.result is not None and is_success(call.result):
+                _results[entry_key] = (call.result, time.monotonic() + IDEMPOTENCY_TTL_SEC)
+            del _in_flight[entry_key]
+        call.done.set()
@@ -0,0 +1,111 @@
+# instrumentation.py
+"""
+リクエストごとの処理時間の計測。
+
+  - timed("airtable") のように処理区間（フェーズ）を計測し、リクエスト内で合計する
+  - レスポンスに Server-Timing ヘッダを付ける（ブラウザの開発者ツールで内訳が見える）
+      例: Server-Timing: airtable;dur=412.3;desc="2 calls", cache;dur=0.1, render;dur=8.2, total;dur=430.0
+  - ルート（エンドポイント）ごとのレイテンシを metrics.HTTP_REQUEST_DURATION に集計する
+
+リクエストコンテキスト外（バックグラウンドスレッドなど）での timed() は何もしない。
+"""
+import functools
+import json
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request, before_render_template, template_rendered
+
+import metrics
+
+
+def get_route_latency_summary() -> dict:
+    """このプロセスでのルートごとの件数・平均・p50/p95/p99（ミリ秒）を返す。"""
+    hist = metrics.HTTP_REQUEST_DURATION
+    summary = {}
+    for key in hist.label_values():
+        method, endpoint, status = key
+        labels = {"method": method, "endpoint": endpoint, "status": status}
+        snap = hist.dump()[json.dumps(key)]
+        summary[f"{method} {endpoint} {status}"] = {
+            "count": snap["count"],
+            "avg_ms": snap["sum"] / snap["count"] * 1000 if snap["count"] else 0.0,
+            "p50_ms": hist.percentile(0.50, **labels) * 1000,
+            "p95_ms": hist.percentile(0.95, **labels) * 1000,
+            "p99_ms": hist.percentile(0.99, **labels) * 1000,
+        }
+    return summary
+
+
+def record_phase(phase: str, duration_sec: float):
+    """現在のリクエストにフェーズの所要時間を加算する（リクエスト外では何もしない）。"""
+    if not has_request_context():
+        return
+    phases = g.setdefault("_timing_phases", {})
+    total, calls = phases.get(phase, (0.0, 0))
+    phases[phase] = (total + duration_sec, calls + 1)
+
+
+@contextmanager
+def timed(phase: str):
+    """with timed("airtable"): ... の区間をフェーズとして計測する。"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(phase, time.perf_counter() - started)
+
+
+def timed_function(phase: str):
+    """関数全体をフェーズとして計測するデコレータ。"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(phase):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _on_before_render(sender, template, context, **extra):
+    g.setdefault("_render_started", []).append(time.perf_counter())
+
+
+def _on_rendered(sender, template, context, **extra):
+    stack = g.get("_render_started")
+    if stack:
+        record_phase("render", time.perf_counter() - stack.pop())
+
+
+def _before_request():
+    g._timing_started = time.perf_counter()
+
+
+def _after_request(response):
+    started = g.pop("_timing_started", None)
+    if started is None:
+        return response
+    total_ms = (time.perf_counter() - started) * 1000
+    phases = g.pop("_timing_phases", {})
+
+    entries = []
+    for phase, (duration, calls) in phases.items():
+        entry = f"{phase};dur={duration * 1000:.1f}"
+        if calls > 1:
+            entry += f';desc="{calls} calls"'
+        entries.append(entry)
+    entries.append(f"total;dur={total_ms:.1f}")
+    response.headers.add("Server-Timing", ", ".join(entries))
+
+    metrics.HTTP_REQUEST_DURATION.observe(
+        total_ms / 1000, method=request.method, endpoint=request.endpoint or "unmatched", status=response.status_code)
+    metrics.flush()
+    return response
+
+
+def init_app(app):
+    """Flask アプリに計測用のフックを登録する。"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_rendered, app)
@@ -0,0 +1,202 @@
+# logging_setup.py
+"""
+アプリ全体のログ設定（app.py から一度だけ init_logging() を呼ぶ）。
+
+  - ルートロガーに QueueHandler だけを付け、実際の出力（標準出力）は QueueListener のスレッドで行う
+    → リクエスト処理のスレッドが stdout の書き込みで待たされない。キューが一杯なら捨てて数える
+  - LOG_FORMAT=json（既定）なら1行1レコードの JSON、text なら従来の人が読む形式
+  - 高頻度のイベント（キャッシュヒット、品名検索など）はロガーごとに間引く（WARNING 以上は間引かない）
+      LOG_SAMPLE_RATES="airtable_service.cache=0.05,blueprints.api.lookup=0.05"  （1.0 = 全件）
+  - 各モジュールでは logger.info("... %s", value) の遅延フォーマットを使う
+    （間引かれた・レベルで捨てられたレコードは文字列化されない）
+
+gunicorn の fork 後は出力スレッドが引き継がれないので、ワーカーで reinit_after_fork() を呼ぶ。
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+import metrics
+
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+DEFAULT_SAMPLE_RATES = {
+    "airtable_service.cache": 0.05,   # [CACHE HIT] など。ページ表示のたびに出る
+    "blueprints.api.lookup": 0.05,    # 品名・単価の検索。入力中のキー操作ごとに出る
+}
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s [in %(module)s:%(lineno)d]"
+
+# JSON に含めない LogRecord の標準属性（extra= で渡された値だけを出力する）
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_state_lock = threading.Lock()
+_listener = None
+_listener_pid = None
+_queue_handler = None
+
+
+class JsonFormatter(logging.Formatter):
+    """1レコードを1行の JSON にする。extra= で渡した値もキーとして出力する。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    ロガー名（と親ロガー名）ごとの割合でレコードを間引く。WARNING 以上は常に通す。
+    メッセージのテンプレート（%s を埋める前の文字列）ごとに数え、1/rate 件に1件を通す。
+    通したレコードには sample_rate を付ける（集計時に件数を割り戻せるように）。
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = {name: rate for name, rate in rates.items() if rate < 1.0}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def _rate_for(self, name: str):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate_for(record.name)
+        if rate is None:
+            return True
+        if rate <= 0:
+            return False
+        every = max(1, round(1 / rate))
+        key = (record.name, record.msg)
+        with self._lock:
+            n = self._counts.get(key, 0)
+            self._counts[key] = n + 1
+            if len(self._counts) > 10000:
+                self._counts.clear()
+        if n % every:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """キューが一杯でもブロックせず、レコードを捨てて数える。"""
+
+    _exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        # 出力用の整形は出力スレッドで行う。ここでは引数の埋め込みと例外の文字列化だけ
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_RECORDS_DROPPED.inc()
+
+
+def parse_sample_rates(text: str) -> dict:
+    """ "name=0.1,other=0.5" 形式を辞書にする（不正な項目は無視）。"""
+    rates = {}
+    for item in (text or "").split(","):
+        name, _, value = item.partition("=")
+        try:
+            rates[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return rates
+
+
+def _build_formatter(fmt: str) -> logging.Formatter:
+    return JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+
+
+def init_logging(level=logging.INFO, fmt: str = None, stream=None, sample_rates: dict = None):
+    """
+    ルートロガーを設定する。何度呼んでも、最後の呼び出しの設定で置き換えられる。
+    stream を省略すると標準出力。sample_rates を省略すると DEFAULT_SAMPLE_RATES + LOG_SAMPLE_RATES。
+    """
+    global _listener, _listener_pid, _queue_handler
+    fmt = (fmt or LOG_FORMAT).lower()
+    if sample_rates is None:
+        sample_rates = {**DEFAULT_SAMPLE_RATES, **parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", ""))}
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(_build_formatter(fmt))
+
+    with _state_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            _listener.stop()
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _queue_handler = DroppingQueueHandler(log_queue)
+        _queue_handler.addFilter(SamplingFilter(sample_rates))
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        _listener_pid = os.getpid()
+
+
+def reinit_after_fork():
+    """fork 後の子プロセスで出力スレッドを作り直す（出力先は引き継ぎ、キューは作り直す）。"""
+    global _listener, _listener_pid
+    with _state_lock:
+        if _listener is None or _listener_pid == os.getpid():
+            return
+        handlers = _listener.handlers
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        _queue_handler.queue = log_queue
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        _listener_pid = os.getpid()
+
+
+def shutdown_logging():
+    """キューに残ったレコードを書き出して出力スレッドを止める。"""
+    global _listener
+    with _state_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
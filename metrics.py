@@ -0,0 +1,385 @@
+# metrics.py
+"""
+プロセス内のカウンタ・ヒストグラム・ゲージと、Prometheus テキスト形式での出力。
+
+gunicorn などで複数ワーカーが動く場合は環境変数 METRICS_DIR にワーカー共通のディレクトリを指定する。
+各ワーカーは自分の値を METRICS_DIR/metrics_<pid>.json に定期的に書き出し、/metrics を受けたワーカーが
+全ファイルを読み込んで合算する（カウンタ・ヒストグラムは合計、ゲージは定義ごとに max / sum）。
+終了したワーカーのカウンタ・ヒストグラムも合計に残る（Prometheus のカウンタが減らないように）。
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.environ.get("METRICS_DIR", "")
+FLUSH_INTERVAL_SEC = 5.0
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = {}  # { name: metric }
+_registry_lock = threading.Lock()
+
+
+def _format_labels(labelnames, values, extra=()) -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        with _registry_lock:
+            _registry[name] = self
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dump(self) -> dict:
+        with self._lock:
+            return {json.dumps(k): v for k, v in self._values.items()}
+
+    @staticmethod
+    def merge(dumps: list) -> dict:
+        merged = {}
+        for d in dumps:
+            for k, v in d.items():
+                merged[k] = merged.get(k, 0.0) + v
+        return merged
+
+    def render(self, merged: dict) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, json.loads(k))} {_format_value(v)}"
+                for k, v in sorted(merged.items())]
+
+
+class Gauge(_Metric):
+    """
+    ゲージ。set() で値を設定するか、set_function() でスクレイプ時に値を計算する。
+    multiprocess_mode: ワーカー間の合算方法（"max" / "min" / "sum"）。
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), multiprocess_mode="max"):
+        super().__init__(name, documentation, labelnames)
+        self.multiprocess_mode = multiprocess_mode
+        self._function = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def set_function(self, func):
+        """func() -> { (label値, ...): value } をスクレイプ・書き出し時に呼んで値を更新する。"""
+        self._function = func
+
+    def dump(self) -> dict:
+        if self._function is not None:
+            try:
+                for key, value in self._function().items():
+                    self.set(value, **dict(zip(self.labelnames, key)))
+            except Exception:
+                pass
+        with self._lock:
+            return {json.dumps(k): v for k, v in self._values.items()}
+
+    def merge(self, dumps: list) -> dict:
+        merged = {}
+        for d in dumps:
+            for k, v in d.items():
+                if k not in merged:
+                    merged[k] = v
+                elif self.multiprocess_mode == "sum":
+                    merged[k] += v
+                elif self.multiprocess_mode == "min":
+                    merged[k] = min(merged[k], v)
+                else:
+                    merged[k] = max(merged[k], v)
+        return merged
+
+    def render(self, merged: dict) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, json.loads(k))} {_format_value(v)}"
+                for k, v in sorted(merged.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            entry["counts"][idx] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def dump(self) -> dict:
+        with self._lock:
+            return {json.dumps(k): {"counts": list(v["counts"]), "sum": v["sum"], "count": v["count"]}
+                    for k, v in self._values.items()}
+
+    @staticmethod
+    def merge(dumps: list) -> dict:
+        merged = {}
+        for d in dumps:
+            for k, v in d.items():
+                m = merged.get(k)
+                if m is None:
+                    merged[k] = {"counts": list(v["counts"]), "sum": v["sum"], "count": v["count"]}
+                else:
+                    m["counts"] = [a + b for a, b in zip(m["counts"], v["counts"])]
+                    m["sum"] += v["sum"]
+                    m["count"] += v["count"]
+        return merged
+
+    def percentile(self, q: float, **labels) -> float:
+        """このプロセスの値から、バケット上限による近似パーセンタイルを返す。"""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            if not entry or not entry["count"]:
+                return 0.0
+            target = entry["count"] * q
+            seen = 0
+            for i, n in enumerate(entry["counts"]):
+                seen += n
+                if seen >= target:
+                    return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def label_values(self) -> list:
+        with self._lock:
+            return list(self._values)
+
+    def render(self, merged: dict) -> list:
+        lines = []
+        for k, v in sorted(merged.items()):
+            values = json.loads(k)
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), v["counts"]):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, values)} {_format_value(v['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, values)} {v['count']}")
+        return lines
+
+
+# ===== 書き出し・合算 =====
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def _dump_all() -> dict:
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {m.name: m.dump() for m in metrics}
+
+
+def _worker_file(pid: int) -> str:
+    return os.path.join(METRICS_DIR, f"metrics_{pid}.json")
+
+
+def flush(force: bool = False):
+    """このプロセスの値を METRICS_DIR に書き出す（前回から FLUSH_INTERVAL_SEC 未満なら省略）。"""
+    global _last_flush
+    if not METRICS_DIR:
+        return
+    now = time.time()
+    if not force and now - _last_flush < FLUSH_INTERVAL_SEC:
+        return
+    with _flush_lock:
+        _last_flush = now
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = _worker_file(os.getpid())
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"pid": os.getpid(), "metrics": _dump_all()}, f)
+        os.replace(tmp, path)
+
+
+_flusher_thread = None
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _flusher_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL_SEC)
+        try:
+            flush()
+        except OSError as e:
+            logger.warning("メトリクスを書き出せませんでした: %s", e)
+
+
+def start_flusher():
+    """
+    リクエストが無い間も FLUSH_INTERVAL_SEC ごとに書き出すスレッドを起動する（METRICS_DIR 未設定なら何もしない）。
+    after_request の書き出しだけでは、暇になったワーカーの最後の値やドレイナー・ミラー同期のスレッドが
+    数えた値が /metrics の合算に出てこないため。
+    """
+    global _flusher_thread, _flusher_pid
+    if not METRICS_DIR:
+        return
+    with _flusher_lock:
+        if _flusher_thread is not None and _flusher_thread.is_alive() and _flusher_pid == os.getpid():
+            return
+        _flusher_thread = threading.Thread(target=_flusher_loop, name="metrics-flusher", daemon=True)
+        _flusher_thread.start()
+        _flusher_pid = os.getpid()
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def _collect_dumps() -> list:
+    """全ワーカーの書き出し結果を返す。各要素は (pid, alive, {metric_name: dump})。"""
+    if not METRICS_DIR:
+        return [(os.getpid(), True, _dump_all())]
+    flush(force=True)
+    dumps = []
+    for filename in os.listdir(METRICS_DIR):
+        if not (filename.startswith("metrics_") and filename.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, filename), encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        pid = data.get("pid", 0)
+        dumps.append((pid, pid == os.getpid() or _pid_alive(pid), data.get("metrics", {})))
+    return dumps
+
+
+def render_prometheus() -> str:
+    """全ワーカー分を合算した Prometheus テキスト形式を返す。"""
+    dumps = _collect_dumps()
+    with _registry_lock:
+        metrics = list(_registry.values())
+    lines = []
+    for m in metrics:
+        # ゲージは生きているワーカーの値だけを使う
+        parts = [d.get(m.name, {}) for pid, alive, d in dumps if alive or m.kind != "gauge"]
+        merged = m.merge(parts)
+        lines.append(f"# HELP {m.name} {m.documentation}")
+        lines.append(f"# TYPE {m.name} {m.kind}")
+        lines.extend(m.render(merged))
+    return "\n".join(lines) + "\n"
+
+
+def reset_after_fork():
+    """
+    fork した子プロセスで、親から引き継いだカウンタ・ヒストグラムの値を捨てる
+    （親の値は親のファイルで数えられるので、ワーカーごとに重複して合算されないように）。
+    """
+    global _last_flush
+    with _registry_lock:
+        metrics = list(_registry.values())
+    for m in metrics:
+        if m.kind != "gauge":
+            with m._lock:
+                m._values.clear()
+    _last_flush = 0.0
+
+
+def reset_dir():
+    """METRICS_DIR の古い書き出しファイルを削除する（サーバー起動時に一度だけ呼ぶ）。"""
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return
+    for filename in os.listdir(METRICS_DIR):
+        if filename.startswith("metrics_"):
+            try:
+                os.remove(os.path.join(METRICS_DIR, filename))
+            except OSError:
+                pass
+
+
+# ===== アプリ共通のメトリクス定義 =====
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Request latency by route.", ("method", "endpoint", "status"))
+CACHE_EVENTS = Counter(
+    "cache_events_total", "airtable_cache lookups by key class and result (hit/miss/expired/invalidated/stale).",
+    ("key_class", "result"))
+AIRTABLE_REQUESTS = Counter(
+    "airtable_requests_total", "Airtable API requests by method and status.", ("method", "status"))
+AIRTABLE_REQUEST_DURATION = Histogram(
+    "airtable_request_duration_seconds", "Airtable API request latency.", ("method",))
+SHEETS_LOAD_DURATION = Histogram(
+    "sheets_load_duration_seconds", "Google Sheets master data load duration.", ("sheet", "result"),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+MASTER_DATA_AGE = Gauge(
+    "master_data_age_seconds", "Seconds since the master data snapshot was loaded (max over workers).", ("sheet",))
+OUTBOX_PENDING = Gauge(
+    "outbox_pending", "Outbox rows waiting to be sent to Airtable.", (), multiprocess_mode="max")
+RECORDS_TABLE_RENDER = Histogram(
+    "records_table_render_seconds", "Time to produce the records table fragment by fragment cache result (hit/miss).",
+    ("result",), buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+REALTIME_CONNECTIONS = Gauge(
+    "realtime_connections", "Open records-page WebSocket connections.", (), multiprocess_mode="sum")
+REALTIME_EVENTS = Counter(
+    "realtime_events_total", "Record change events pushed to open records pages.", ("event",))
+IDEMPOTENT_SUBMISSIONS = Counter(
+    "idempotent_submissions_total", "Form submissions by idempotency outcome (executed/collapsed/replayed).",
+    ("result",))
+MIRROR_SYNC_LAG = Gauge(
+    "mirror_sync_lag_seconds", "Seconds since the least recently synced person table was synced to the local mirror.",
+    (), multiprocess_mode="max")
+MIRROR_SYNC_ROWS = Counter(
+    "mirror_sync_rows_total", "Rows handled by the mirror sync by mode (full/incremental) and result.",
+    ("mode", "result"))
+MIRROR_SYNC_DURATION = Histogram(
+    "mirror_sync_duration_seconds", "Time to sync one person table to the local mirror.", ("mode", "result"),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+CIRCUIT_BREAKER_STATE = Gauge(
+    "circuit_breaker_state", "Upstream circuit breaker state (0=closed, 1=half_open, 2=open; max over workers).",
+    ("upstream",), multiprocess_mode="max")
+CIRCUIT_BREAKER_TRANSITIONS = Counter(
+    "circuit_breaker_transitions_total", "Circuit breaker state changes by upstream and new state.",
+    ("upstream", "state"))
+CIRCUIT_BREAKER_REJECTED = Counter(
+    "circuit_breaker_rejected_total", "Upstream calls failed fast because the circuit breaker was open.", ("upstream",))
+UPSTREAM_TIMEOUT = Gauge(
+    "upstream_timeout_seconds", "Current adaptive timeout per upstream operation (max over workers).",
+    ("upstream", "op"), multiprocess_mode="max")
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped_total", "Log records dropped because the logging queue was full.")
@@ -0,0 +1,483 @@
+# mirror.py
+"""
+Airtable の全 TablePersonID_* を同じホストの SQLite に写しておく「ミラー」と、その差分同期。
+
+records 画面の月表示・CSV エクスポートは、ミラーが新しければ Airtable に問い合わせずに
+ここから（PersonID, WorkDay のインデックスで）読む。
+
+  - start_sync()      : 同期スレッドを起動する。PERSON_ID_LIST の全員について
+                        前回の同期以降に更新された行だけを取得する（LAST_MODIFIED_TIME で絞り込み）
+  - upsert_record() / patch_record() / delete_record()
+                      : このアプリからの書き込みを、次の同期を待たずにミラーへ反映する
+  - is_ready()        : その人のミラーを読みに使ってよいか（全件同期済みで、遅れが MIRROR_MAX_LAG_SEC 以内）
+  - list_records()    : WorkDay の範囲で行を返す（Airtable の {"id", "fields"} 形式）
+  - get_sync_stats()  : 同期の遅れ・件数/秒などの統計
+
+差分同期では削除を検出できないので、MIRROR_FULL_SYNC_SEC ごとに全件を取り直して消えた行を削除する。
+ワーカーが複数でも同期するのは1プロセスだけ（SQLite 上のリースで決める）。
+Airtable の取得・キャッシュの無効化は呼び出し元（airtable_service.start_mirror_sync）から関数で渡す。
+"""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import metrics
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+MIRROR_ENABLED = os.environ.get("MIRROR_ENABLED", "1") == "1"
+MIRROR_DB_PATH = os.environ.get("MIRROR_DB_PATH", "mirror.sqlite3")
+MIRROR_SYNC_INTERVAL_SEC = float(os.environ.get("MIRROR_SYNC_INTERVAL_SEC", "30"))
+MIRROR_FULL_SYNC_SEC = float(os.environ.get("MIRROR_FULL_SYNC_SEC", "3600"))
+# これより同期が遅れている人は、ミラーを使わず Airtable から読む
+MIRROR_MAX_LAG_SEC = float(os.environ.get("MIRROR_MAX_LAG_SEC", "300"))
+# 画面・一括取り込みの分を残すため、Airtable の上限(5 req/sec)より低くする
+MIRROR_RATE_LIMIT_PER_SEC = float(os.environ.get("MIRROR_RATE_LIMIT_PER_SEC", "2"))
+# 差分取得の基準時刻を、このぶん前にずらす（Airtable との時計のずれ・更新の反映待ちの保険。重複して取っても結果は同じ）
+CURSOR_OVERLAP_SEC = 60.0
+LEASE_TTL_SEC = max(MIRROR_SYNC_INTERVAL_SEC * 3, 120.0)
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    person_id   TEXT NOT NULL,
+    record_id   TEXT NOT NULL,
+    work_day    TEXT NOT NULL,
+    fields_json TEXT NOT NULL,
+    synced_at   REAL NOT NULL,
+    PRIMARY KEY (person_id, record_id)
+);
+CREATE INDEX IF NOT EXISTS idx_records_person_day ON records (person_id, work_day);
+-- このアプリで削除した行（同期中に取得した古いページで復活させないため。全件同期で片付ける）
+CREATE TABLE IF NOT EXISTS tombstones (
+    person_id  TEXT NOT NULL,
+    record_id  TEXT NOT NULL,
+    deleted_at REAL NOT NULL,
+    PRIMARY KEY (person_id, record_id)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    person_id    TEXT PRIMARY KEY,
+    cursor       REAL NOT NULL DEFAULT 0,   -- 次の差分同期で「この時刻以降に更新された行」を取る
+    last_sync_at REAL NOT NULL DEFAULT 0,   -- 最後に同期が成功した時刻（差分・全件）
+    last_full_at REAL NOT NULL DEFAULT 0,   -- 最後に全件同期が成功した時刻
+    last_error   TEXT
+);
+CREATE TABLE IF NOT EXISTS lease (
+    name       TEXT PRIMARY KEY,
+    owner      TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    """スレッドごとの接続を返す（初回はスキーマ作成）。"""
+    global _schema_ready
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "pid", None) == os.getpid():
+        return conn
+    conn = sqlite3.connect(MIRROR_DB_PATH, timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with _schema_lock:
+        if not _schema_ready:
+            conn.executescript(_SCHEMA)
+            _schema_ready = True
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def _dumps(fields: dict) -> str:
+    return json.dumps(fields, ensure_ascii=False, sort_keys=True)
+
+
+def _month_of(work_day: str):
+    try:
+        return int(work_day[:4]), int(work_day[5:7])
+    except (TypeError, ValueError):
+        return None
+
+
+# ===== このアプリからの書き込み =====
+def upsert_record(person_id, record_id: str, fields: dict):
+    """作成したレコードをミラーに反映する（失敗しても呼び出し元は止めない。次の同期で追いつく）。"""
+    if not MIRROR_ENABLED or not record_id:
+        return
+    try:
+        _connect().execute(
+            "INSERT INTO records (person_id, record_id, work_day, fields_json, synced_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (person_id, record_id) DO UPDATE SET "
+            "work_day = excluded.work_day, fields_json = excluded.fields_json, synced_at = excluded.synced_at",
+            (str(person_id), record_id, fields.get("WorkDay", ""), _dumps(fields), time.time()),
+        )
+    except Exception as e:
+        logger.warning("ミラーへの反映に失敗しました（無視）: PersonID=%s, RecordID=%s, %s", person_id, record_id, e)
+
+
+def patch_record(person_id, record_id: str, fields_to_update: dict):
+    """更新したフィールドをミラーの行に重ねる。ミラーに無い行は次の同期に任せる。"""
+    if not MIRROR_ENABLED:
+        return
+    try:
+        conn = _connect()
+        row = conn.execute("SELECT fields_json FROM records WHERE person_id = ? AND record_id = ?",
+                           (str(person_id), record_id)).fetchone()
+        if row is None:
+            return
+        fields = {**json.loads(row["fields_json"]), **fields_to_update}
+        conn.execute(
+            "UPDATE records SET work_day = ?, fields_json = ?, synced_at = ? WHERE person_id = ? AND record_id = ?",
+            (fields.get("WorkDay", ""), _dumps(fields), time.time(), str(person_id), record_id),
+        )
+    except Exception as e:
+        logger.warning("ミラーへの反映に失敗しました（無視）: PersonID=%s, RecordID=%s, %s", person_id, record_id, e)
+
+
+def delete_record(person_id, record_id: str):
+    """削除したレコードをミラーから消す。"""
+    if not MIRROR_ENABLED:
+        return
+    try:
+        conn = _connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM records WHERE person_id = ? AND record_id = ?", (str(person_id), record_id))
+            conn.execute("INSERT OR REPLACE INTO tombstones (person_id, record_id, deleted_at) VALUES (?, ?, ?)",
+                         (str(person_id), record_id, time.time()))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    except Exception as e:
+        logger.warning("ミラーへの反映に失敗しました（無視）: PersonID=%s, RecordID=%s, %s", person_id, record_id, e)
+
+
+# ===== 読み出し =====
+def is_ready(person_id, allow_stale: bool = False) -> bool:
+    """
+    その人のミラーが全件同期済みで、遅れが MIRROR_MAX_LAG_SEC 以内なら True。
+    allow_stale=True なら遅れは問わない（Airtable に接続できないときの代わりに使う場合）。
+    """
+    if not MIRROR_ENABLED:
+        return False
+    try:
+        row = _connect().execute("SELECT last_sync_at, last_full_at FROM sync_state WHERE person_id = ?",
+                                 (str(person_id),)).fetchone()
+    except Exception as e:
+        logger.warning("ミラーの状態を確認できませんでした: %s", e)
+        return False
+    return bool(row and row["last_full_at"] > 0
+                and (allow_stale or time.time() - row["last_sync_at"] <= MIRROR_MAX_LAG_SEC))
+
+
+def list_records(person_id, start_day: str, end_day_exclusive: str) -> list[dict]:
+    """start_day 以上 end_day_exclusive 未満（YYYY-MM-DD）の行を WorkDay 順に返す。"""
+    rows = _connect().execute(
+        "SELECT record_id, fields_json FROM records WHERE person_id = ? AND work_day >= ? AND work_day < ? "
+        "ORDER BY work_day, record_id",
+        (str(person_id), start_day, end_day_exclusive),
+    ).fetchall()
+    return [{"id": row["record_id"], "fields": json.loads(row["fields_json"])} for row in rows]
+
+
+def get_record(person_id, record_id: str):
+    """1件の fields を返す（無ければ None）。"""
+    row = _connect().execute("SELECT fields_json FROM records WHERE person_id = ? AND record_id = ?",
+                             (str(person_id), record_id)).fetchone()
+    return json.loads(row["fields_json"]) if row else None
+
+
+# ===== 同期 =====
+def _apply_page(conn, person_id: str, records: list, now: float, fetched_at: float, changed_months: set) -> int:
+    """
+    取得した1ページをミラーに書き込み、内容が変わった行数を返す。
+    fetched_at（そのページの取得を始めた時刻）より後にこのアプリから書き込まれた行は、ページの方が古いので上書きしない
+    （次の差分同期で、書き込み後の内容を取り直す）。
+    """
+    ids = [r["id"] for r in records if r.get("id")]
+    if not ids:
+        return 0
+    marks = ",".join("?" * len(ids))
+    existing = {row["record_id"]: row for row in conn.execute(
+        f"SELECT record_id, work_day, fields_json, synced_at FROM records WHERE person_id = ? AND record_id IN ({marks})",
+        (person_id, *ids))}
+    deleted = {row["record_id"] for row in conn.execute(
+        f"SELECT record_id FROM tombstones WHERE person_id = ? AND record_id IN ({marks})", (person_id, *ids))}
+
+    changes = []
+    for record in records:
+        record_id = record.get("id")
+        if not record_id or record_id in deleted:
+            continue
+        fields = record.get("fields", {})
+        fields_json = _dumps(fields)
+        old = existing.get(record_id)
+        if old is not None and (old["fields_json"] == fields_json or old["synced_at"] > fetched_at):
+            continue
+        work_day = fields.get("WorkDay", "")
+        changes.append((person_id, record_id, work_day, fields_json, now))
+        for day in (work_day, old["work_day"] if old is not None else None):
+            month = _month_of(day)
+            if month:
+                changed_months.add(month)
+    if changes:
+        conn.executemany(
+            "INSERT INTO records (person_id, record_id, work_day, fields_json, synced_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (person_id, record_id) DO UPDATE SET "
+            "work_day = excluded.work_day, fields_json = excluded.fields_json, synced_at = excluded.synced_at",
+            changes,
+        )
+    return len(changes)
+
+
+def _remove_missing(conn, person_id: str, seen: set, started: float, changed_months: set) -> int:
+    """全件同期で見つからなかった行（Airtable で削除された行）を消す。同期中に書き込まれた行は残す。"""
+    stale = [row for row in conn.execute(
+        "SELECT record_id, work_day FROM records WHERE person_id = ? AND synced_at < ?", (person_id, started))
+        if row["record_id"] not in seen]
+    if stale:
+        conn.executemany("DELETE FROM records WHERE person_id = ? AND record_id = ?",
+                         [(person_id, row["record_id"]) for row in stale])
+        for row in stale:
+            month = _month_of(row["work_day"])
+            if month:
+                changed_months.add(month)
+    conn.execute("DELETE FROM tombstones WHERE person_id = ? AND deleted_at < ?", (person_id, started))
+    return len(stale)
+
+
+def sync_person(person_id, fetch_pages, full: bool = False, limiter: RateLimiter = None) -> dict:
+    """
+    1人分を同期して {"fetched", "changed", "deleted", "months"} を返す。
+    fetch_pages(person_id, since) は Airtable のレコード（{"id", "fields"}）のリストをページごとに yield する。
+    since が None なら全件、数値（UNIX 時刻）ならそれ以降に更新された行だけ。
+    """
+    person_id = str(person_id)
+    conn = _connect()
+    state = conn.execute("SELECT cursor, last_full_at FROM sync_state WHERE person_id = ?", (person_id,)).fetchone()
+    full = full or state is None or state["last_full_at"] <= 0
+    since = None if full else max(state["cursor"] - CURSOR_OVERLAP_SEC, 0.0)
+    started = time.time()
+    result = {"fetched": 0, "changed": 0, "deleted": 0, "months": set()}
+    seen = set()
+
+    try:
+        pages = iter(fetch_pages(person_id, since))
+        while True:
+            if limiter is not None:
+                limiter.wait()
+            fetched_at = time.time()
+            page = next(pages, None)
+            if page is None:
+                break
+            result["fetched"] += len(page)
+            seen.update(r.get("id") for r in page)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result["changed"] += _apply_page(conn, person_id, page, started, fetched_at, result["months"])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if full:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result["deleted"] = _remove_missing(conn, person_id, seen, started, result["months"])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    except Exception as e:
+        conn.execute(
+            "INSERT INTO sync_state (person_id, last_error) VALUES (?, ?) "
+            "ON CONFLICT (person_id) DO UPDATE SET last_error = excluded.last_error",
+            (person_id, str(e)[:500]),
+        )
+        raise
+
+    conn.execute(
+        "INSERT INTO sync_state (person_id, cursor, last_sync_at, last_full_at, last_error) VALUES (?, ?, ?, ?, NULL) "
+        "ON CONFLICT (person_id) DO UPDATE SET cursor = excluded.cursor, last_sync_at = excluded.last_sync_at, "
+        "last_full_at = CASE WHEN ? THEN excluded.last_full_at ELSE sync_state.last_full_at END, last_error = NULL",
+        (person_id, started, started, started if full else 0, full),
+    )
+    return result
+
+
+# ===== 統計 =====
+_stats_lock = threading.Lock()
+_rounds = deque(maxlen=100)   # 直近の同期ラウンド（mode / persons / fetched / changed / deleted / errors / duration_sec）
+
+
+def _record_round(mode: str, summary: dict):
+    with _stats_lock:
+        _rounds.append({"mode": mode, "finished_at": time.time(), **summary})
+
+
+def get_lag_sec() -> float:
+    """同期の遅れ（最も古く同期された人の、最後の同期からの経過秒数）。未同期の人がいれば inf。"""
+    if not MIRROR_ENABLED:
+        return 0.0
+    row = _connect().execute("SELECT MIN(last_sync_at) AS oldest, COUNT(*) AS n FROM sync_state").fetchone()
+    if not row["n"] or not row["oldest"]:
+        return float("inf")
+    return max(time.time() - row["oldest"], 0.0)
+
+
+def get_sync_stats() -> dict:
+    """ミラーの件数・同期の遅れと、直近の同期ラウンドの件数/秒（全件・差分）。"""
+    conn = _connect()
+    with _stats_lock:
+        rounds = list(_rounds)
+
+    def last_of(mode: str):
+        for summary in reversed(rounds):
+            if summary["mode"] == mode:
+                duration = summary["duration_sec"]
+                return {**summary, "rows_per_sec": summary["fetched"] / duration if duration > 0 else 0.0}
+        return None
+
+    lag = get_lag_sec()
+    return {
+        "rows": conn.execute("SELECT COUNT(*) AS n FROM records").fetchone()["n"],
+        "persons": conn.execute("SELECT COUNT(*) AS n FROM sync_state WHERE last_full_at > 0").fetchone()["n"],
+        "errors": conn.execute("SELECT COUNT(*) AS n FROM sync_state WHERE last_error IS NOT NULL").fetchone()["n"],
+        "lag_sec": None if lag == float("inf") else lag,
+        "syncing_here": _sync_thread is not None and _sync_thread.is_alive() and _sync_pid == os.getpid(),
+        "last_full": last_of("full"),
+        "last_incremental": last_of("incremental"),
+    }
+
+
+if MIRROR_ENABLED:
+    metrics.MIRROR_SYNC_LAG.set_function(lambda: {(): min(get_lag_sec(), 1e9)})
+
+
+def sync_round(person_ids, fetch_pages, on_changed=None, limiter: RateLimiter = None, renew=None) -> dict:
+    """
+    全員を1回ずつ同期する。全件同期の時期が来ている人は全件、それ以外は差分。
+    on_changed(person_id, {(year, month), ...}): 行が変わった月の通知（キャッシュの無効化など）
+    renew(): 1人終わるごとに呼ぶ（同期のリースの延長）
+    """
+    now = time.time()
+    due_full = {row["person_id"] for row in _connect().execute(
+        "SELECT person_id FROM sync_state WHERE last_full_at > ?", (now - MIRROR_FULL_SYNC_SEC,))}
+    totals = {"full": {"persons": 0, "fetched": 0, "changed": 0, "deleted": 0, "errors": 0, "duration_sec": 0.0},
+              "incremental": {"persons": 0, "fetched": 0, "changed": 0, "deleted": 0, "errors": 0, "duration_sec": 0.0}}
+    for person_id in person_ids:
+        person_id = str(person_id)
+        mode = "incremental" if person_id in due_full else "full"
+        started = time.perf_counter()
+        try:
+            result = sync_person(person_id, fetch_pages, full=(mode == "full"), limiter=limiter)
+        except Exception as e:
+            logger.warning("ミラーの同期に失敗しました: PersonID=%s, mode=%s, %s", person_id, mode, e)
+            totals[mode]["errors"] += 1
+            metrics.MIRROR_SYNC_DURATION.observe(time.perf_counter() - started, mode=mode, result="error")
+            continue
+        finally:
+            totals[mode]["duration_sec"] += time.perf_counter() - started
+            if renew is not None:
+                renew()
+        metrics.MIRROR_SYNC_DURATION.observe(time.perf_counter() - started, mode=mode, result="ok")
+        metrics.MIRROR_SYNC_ROWS.inc(result["fetched"], mode=mode, result="fetched")
+        metrics.MIRROR_SYNC_ROWS.inc(result["changed"], mode=mode, result="changed")
+        metrics.MIRROR_SYNC_ROWS.inc(result["deleted"], mode=mode, result="deleted")
+        totals[mode]["persons"] += 1
+        for name in ("fetched", "changed", "deleted"):
+            totals[mode][name] += result[name]
+        if result["months"] and on_changed is not None:
+            try:
+                on_changed(person_id, result["months"])
+            except Exception as e:
+                logger.warning("ミラー同期後の処理に失敗（無視）: %s", e)
+
+    for mode, summary in totals.items():
+        if summary["persons"] or summary["errors"]:
+            _record_round(mode, summary)
+            logger.info("ミラー同期(%s): %d人, 取得=%d, 変更=%d, 削除=%d, 失敗=%d, %.2fs", mode, summary["persons"],
+                        summary["fetched"], summary["changed"], summary["deleted"], summary["errors"],
+                        summary["duration_sec"])
+    return totals
+
+
+def _lease_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _acquire_lease() -> bool:
+    """同期のリースを取る（自分が持っていれば延長）。他のプロセスが持っていて期限内なら False。"""
+    now = time.time()
+    owner = _lease_owner()
+    conn = _connect()
+    conn.execute(
+        "INSERT INTO lease (name, owner, expires_at) VALUES ('sync', ?, ?) "
+        "ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+        "WHERE lease.owner = excluded.owner OR lease.expires_at < ?",
+        (owner, now + LEASE_TTL_SEC, now),
+    )
+    row = conn.execute("SELECT owner FROM lease WHERE name = 'sync'").fetchone()
+    return row is not None and row["owner"] == owner
+
+
+def _release_lease():
+    try:
+        _connect().execute("DELETE FROM lease WHERE name = 'sync' AND owner = ?", (_lease_owner(),))
+    except Exception as e:
+        logger.warning("ミラー同期のリースを解放できませんでした: %s", e)
+
+
+# ===== 同期スレッド =====
+_sync_thread = None
+_sync_pid = None
+_sync_lock = threading.Lock()
+_stop = threading.Event()
+_rate_limiter = RateLimiter(MIRROR_RATE_LIMIT_PER_SEC)
+
+
+def _sync_loop(list_person_ids, fetch_pages, on_changed):
+    while not _stop.is_set():
+        try:
+            if _acquire_lease():
+                sync_round(list_person_ids(), fetch_pages, on_changed, limiter=_rate_limiter, renew=_acquire_lease)
+        except Exception as e:
+            logger.error("ミラー同期スレッドでエラー: %s", e, exc_info=True)
+        _stop.wait(MIRROR_SYNC_INTERVAL_SEC)
+    _release_lease()
+
+
+def start_sync(list_person_ids, fetch_pages, on_changed=None):
+    """
+    このプロセスで同期スレッドを起動する（起動済みなら何もしない。fork 後は再起動）。
+    list_person_ids(): 同期する PersonID の一覧（PERSON_ID_LIST）
+    """
+    global _sync_thread, _sync_pid
+    if not MIRROR_ENABLED:
+        return
+    with _sync_lock:
+        if _sync_thread is not None and _sync_thread.is_alive() and _sync_pid == os.getpid():
+            return
+        _stop.clear()
+        _sync_thread = threading.Thread(
+            target=_sync_loop, args=(list_person_ids, fetch_pages, on_changed), name="mirror-sync", daemon=True
+        )
+        _sync_thread.start()
+        _sync_pid = os.getpid()
+        logger.info("ミラー同期スレッドを起動しました: DB=%s, 間隔=%ss", MIRROR_DB_PATH, MIRROR_SYNC_INTERVAL_SEC)
+
+
+def stop_sync(timeout: float = 5.0):
+    _stop.set()
+    if _sync_thread is not None:
+        _sync_thread.join(timeout)
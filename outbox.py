@@ -0,0 +1,339 @@
+# outbox.py
+"""
+Airtable への新規レコード送信を一旦ローカルの SQLite に書き込んでから（write-ahead）
+バックグラウンドのドレイナーで順次 Airtable に送る「送信箱」。
+
+  - enqueue()        : 送信内容を永続化して即座に返る（Airtable が遅い・落ちていても入力は失われない）
+  - start_drainer()  : 送信待ちを取り出して send_func で送信。失敗時は指数バックオフで再試行
+  - list_rows_for_month() : records 画面に「送信待ち」行を表示するための一覧
+  - update_sent() / mark_deleted() : 送信済みの行を画面から編集・削除したときに、補完表示を合わせる
+  - get_drainer_stats()   : スループット・レイテンシなどの統計
+
+各行は idempotency_key（一意）を持ち、同じキーでの二重登録は1行にまとまる。
+"""
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_ENABLED = os.environ.get("OUTBOX_ENABLED", "1") == "1"
+OUTBOX_DB_PATH = os.environ.get("OUTBOX_DB_PATH", "outbox.sqlite3")
+
+POLL_INTERVAL_SEC = 1.0       # 送信待ちが無いときの待機間隔
+BATCH_SIZE = 10               # 1回に取り出す件数
+BACKOFF_BASE_SEC = 2.0        # 再試行の待ち時間 = BASE * 2^(試行回数-1)（上限あり、ジッター付き）
+BACKOFF_MAX_SEC = 300.0
+SENDING_TIMEOUT_SEC = 60.0    # 'sending' のまま放置された行（プロセス異常終了など）を再送対象に戻すまでの時間
+SENT_RETENTION_SEC = 24 * 3600  # 送信済み・送信失敗行の保持期間
+RECENTLY_SENT_SEC = 120.0     # 送信済みでも一覧に補完表示する期間（他ワーカーのキャッシュが古い場合の保険）
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id              INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    person_id       TEXT NOT NULL,
+    work_day        TEXT NOT NULL,
+    fields_json     TEXT NOT NULL,
+    status          TEXT NOT NULL DEFAULT 'pending',  -- pending / sending / sent / failed / deleted
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    claimed_at      REAL,
+    created_at      REAL NOT NULL,
+    sent_at         REAL,
+    airtable_id     TEXT,
+    last_error      TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_outbox_person_day ON outbox (person_id, work_day);
+"""
+
+
+def _connect() -> sqlite3.Connection:
+    """スレッドごとの接続を返す（初回はスキーマ作成）。"""
+    global _schema_ready
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "pid", None) == os.getpid():
+        return conn
+    conn = sqlite3.connect(OUTBOX_DB_PATH, timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    with _schema_lock:
+        if not _schema_ready:
+            conn.executescript(_SCHEMA)
+            _schema_ready = True
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def outbox_row_id(row_id: int) -> str:
+    """records 画面などで使う送信待ち行の表示用ID。"""
+    return f"outbox-{row_id}"
+
+
+def enqueue(person_id: str, fields: dict, idempotency_key: str = None) -> tuple[int, bool]:
+    """
+    送信内容を永続化する。戻り値は (行ID, 新規に登録したか)。
+    同じ idempotency_key が既にあれば登録せず、既存の行IDを返す。
+    """
+    key = idempotency_key or uuid.uuid4().hex
+    now = time.time()
+    conn = _connect()
+    cur = conn.execute(
+        "INSERT OR IGNORE INTO outbox (idempotency_key, person_id, work_day, fields_json, next_attempt_at, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (key, str(person_id), fields.get("WorkDay", ""), json.dumps(fields, ensure_ascii=False), now, now),
+    )
+    if cur.rowcount:
+        _wakeup.set()
+        return cur.lastrowid, True
+    row = conn.execute("SELECT id FROM outbox WHERE idempotency_key = ?", (key,)).fetchone()
+    return row["id"], False
+
+
+def get_entry(row_id: int):
+    """行IDから送信箱の行(dict)を返す。無ければ None。"""
+    row = _connect().execute("SELECT * FROM outbox WHERE id = ?", (row_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def list_rows_for_month(person_id: str, year: int, month: int) -> list[dict]:
+    """
+    指定月の「送信待ち / 送信失敗 / 直近に送信済み」の行を返す（records 画面での補完表示用）。
+    各行は fields に加えて id（送信済みなら Airtable のID、未送信なら outbox-N）と outbox_status を持つ。
+    """
+    prefix = f"{year:04d}-{month:02d}-"
+    rows = _connect().execute(
+        "SELECT * FROM outbox WHERE person_id = ? AND work_day >= ? AND work_day < ? "
+        "AND (status IN ('pending', 'sending', 'failed') OR (status = 'sent' AND sent_at >= ?)) "
+        "ORDER BY work_day, id",
+        (str(person_id), prefix, prefix + "~", time.time() - RECENTLY_SENT_SEC),
+    ).fetchall()
+    result = []
+    for row in rows:
+        item = json.loads(row["fields_json"])
+        item["id"] = row["airtable_id"] if row["status"] == "sent" else outbox_row_id(row["id"])
+        item["outbox_status"] = row["status"]
+        item["outbox_error"] = row["last_error"]
+        result.append(item)
+    return result
+
+
+def update_sent(person_id: str, airtable_id: str, fields: dict):
+    """
+    送信済みの行（Airtable ID）を編集した内容に合わせる。直近に送信済みの行の補完表示で
+    編集前の値・元の月に表示されないようにする（WorkDay が変われば表示される月も変わる）。
+    """
+    conn = _connect()
+    row = conn.execute("SELECT id, fields_json FROM outbox WHERE person_id = ? AND airtable_id = ? AND status = 'sent'",
+                       (str(person_id), airtable_id)).fetchone()
+    if row is None:
+        return
+    merged = {**json.loads(row["fields_json"]), **fields}
+    conn.execute("UPDATE outbox SET fields_json = ?, work_day = ? WHERE id = ?",
+                 (json.dumps(merged, ensure_ascii=False), merged.get("WorkDay", ""), row["id"]))
+
+
+def mark_deleted(person_id: str, airtable_id: str):
+    """送信済みの行（Airtable ID）を削除したとき、補完表示に出ないようにする。"""
+    _connect().execute("UPDATE outbox SET status = 'deleted' WHERE person_id = ? AND airtable_id = ? AND status = 'sent'",
+                       (str(person_id), airtable_id))
+
+
+def count_pending() -> int:
+    row = _connect().execute("SELECT COUNT(*) AS n FROM outbox WHERE status IN ('pending', 'sending')").fetchone()
+    return row["n"]
+
+
+if OUTBOX_ENABLED:
+    metrics.OUTBOX_PENDING.set_function(lambda: {(): count_pending()})
+
+
+def _claim_batch(limit: int) -> list[sqlite3.Row]:
+    """送信対象を 'sending' にして取り出す（複数ワーカーが同じDBを共有しても二重送信しない）。"""
+    now = time.time()
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(
+            "SELECT * FROM outbox WHERE (status = 'pending' AND next_attempt_at <= ?) "
+            "OR (status = 'sending' AND claimed_at < ?) ORDER BY id LIMIT ?",
+            (now, now - SENDING_TIMEOUT_SEC, limit),
+        ).fetchall()
+        if rows:
+            conn.executemany(
+                "UPDATE outbox SET status = 'sending', claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                [(now, r["id"]) for r in rows],
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return rows
+
+
+def _mark_sent(row_id: int, airtable_id: str):
+    _connect().execute(
+        "UPDATE outbox SET status = 'sent', sent_at = ?, airtable_id = ?, last_error = NULL WHERE id = ?",
+        (time.time(), airtable_id, row_id),
+    )
+
+
+def _mark_retry(row_id: int, attempts: int, error: str):
+    delay = min(BACKOFF_BASE_SEC * (2 ** max(attempts - 1, 0)), BACKOFF_MAX_SEC)
+    delay *= random.uniform(0.8, 1.2)
+    _connect().execute(
+        "UPDATE outbox SET status = 'pending', next_attempt_at = ?, last_error = ? WHERE id = ?",
+        (time.time() + delay, error, row_id),
+    )
+
+
+def _mark_failed(row_id: int, error: str):
+    _connect().execute("UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?", (error, row_id))
+
+
+def _purge_old_sent():
+    """保持期間を過ぎた送信済み・送信失敗・削除済みの行を削除する。"""
+    _connect().execute(
+        "DELETE FROM outbox WHERE status IN ('sent', 'failed', 'deleted') AND created_at < ?",
+        (time.time() - SENT_RETENTION_SEC,),
+    )
+
+
+# ===== 統計 =====
+_stats_lock = threading.Lock()
+_stats = {"sent": 0, "retried": 0, "failed": 0}
+_send_latencies = deque(maxlen=1000)    # Airtable 呼び出し1回あたりの所要時間（秒）
+_queue_latencies = deque(maxlen=1000)   # 登録から送信完了までの時間（秒）
+_sent_times = deque(maxlen=5000)        # 送信完了時刻（スループット算出用）
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def get_drainer_stats(window_sec: float = 60.0) -> dict:
+    """ドレイナーの統計。throughput_per_sec は直近 window_sec 秒間の送信件数/秒。"""
+    now = time.time()
+    with _stats_lock:
+        send_lat = list(_send_latencies)
+        queue_lat = list(_queue_latencies)
+        recent = sum(1 for t in _sent_times if t >= now - window_sec)
+        counters = dict(_stats)
+    return {
+        **counters,
+        "pending": count_pending(),
+        "throughput_per_sec": recent / window_sec,
+        "send_latency_p50_sec": _percentile(send_lat, 0.50),
+        "send_latency_p95_sec": _percentile(send_lat, 0.95),
+        "queue_latency_p50_sec": _percentile(queue_lat, 0.50),
+        "queue_latency_p95_sec": _percentile(queue_lat, 0.95),
+    }
+
+
+# ===== ドレイナー =====
+_drainer_thread = None
+_drainer_pid = None
+_drainer_lock = threading.Lock()
+_stop = threading.Event()
+_wakeup = threading.Event()
+
+
+def drain_once(send_func, on_sent=None) -> int:
+    """
+    送信待ちを1バッチ送信して、処理した件数を返す。
+    send_func(person_id, fields, idempotency_key) -> (status, message, airtable_id)
+      - 成功: status 200/201 かつ airtable_id あり
+      - status が 429 / 5xx / None（通信エラー）: 再試行
+      - それ以外の 4xx: 入力内容の問題なので失敗として残す
+    on_sent(person_id, airtable_id, fields): 送信成功時のコールバック（キャッシュ反映など）
+    """
+    rows = _claim_batch(BATCH_SIZE)
+    for row in rows:
+        fields = json.loads(row["fields_json"])
+        started = time.time()
+        try:
+            status, message, airtable_id = send_func(row["person_id"], fields, row["idempotency_key"])
+        except Exception as e:
+            status, message, airtable_id = None, str(e), None
+        finished = time.time()
+
+        with _stats_lock:
+            _send_latencies.append(finished - started)
+        if status in (200, 201) and airtable_id:
+            _mark_sent(row["id"], airtable_id)
+            with _stats_lock:
+                _stats["sent"] += 1
+                _queue_latencies.append(finished - row["created_at"])
+                _sent_times.append(finished)
+            if on_sent:
+                try:
+                    on_sent(row["person_id"], airtable_id, fields)
+                except Exception as e:
+                    logger.warning(f"送信箱: 送信後処理に失敗（無視）: {e}")
+        elif status is None or status == 429 or status >= 500:
+            _mark_retry(row["id"], row["attempts"] + 1, message)
+            with _stats_lock:
+                _stats["retried"] += 1
+            logger.warning(f"送信箱: 送信失敗のため再試行します: OutboxID={row['id']}, 試行={row['attempts'] + 1}, {message}")
+        else:
+            _mark_failed(row["id"], message)
+            with _stats_lock:
+                _stats["failed"] += 1
+            logger.error(f"送信箱: 送信できませんでした（再試行しません）: OutboxID={row['id']}, {message}")
+    return len(rows)
+
+
+def _drainer_loop(send_func, on_sent):
+    last_purge = 0.0
+    while not _stop.is_set():
+        try:
+            processed = drain_once(send_func, on_sent)
+            if time.time() - last_purge > 3600:
+                _purge_old_sent()
+                last_purge = time.time()
+        except Exception as e:
+            logger.error(f"送信箱ドレイナーでエラー: {e}", exc_info=True)
+            processed = 0
+        if processed == 0:
+            _wakeup.wait(POLL_INTERVAL_SEC)
+            _wakeup.clear()
+
+
+def start_drainer(send_func, on_sent=None):
+    """このプロセスでドレイナースレッドを起動する（起動済みなら何もしない。fork 後は再起動）。"""
+    global _drainer_thread, _drainer_pid
+    with _drainer_lock:
+        if _drainer_thread is not None and _drainer_thread.is_alive() and _drainer_pid == os.getpid():
+            return
+        _stop.clear()
+        _drainer_thread = threading.Thread(
+            target=_drainer_loop, args=(send_func, on_sent), name="outbox-drainer", daemon=True
+        )
+        _drainer_thread.start()
+        _drainer_pid = os.getpid()
+        logger.info(f"送信箱ドレイナーを起動しました: DB={OUTBOX_DB_PATH}")
+
+
+def stop_drainer(timeout: float = 5.0):
+    _stop.set()
+    _wakeup.set()
+    if _drainer_thread is not None:
+        _drainer_thread.join(timeout)
@@ -0,0 +1,353 @@
+# profiling.py
+"""
+本番ワーカーで必要なときだけ有効にするプロファイラー（管理者用。エンドポイントは blueprints/profiling.py）。
+
+CPU: サンプリングプロファイラー
+  - start_cpu_profile(seconds=...)  : 指定秒数の間に始まるリクエストのスタックを一定間隔で採取する
+  - start_cpu_profile(requests=N)   : この後に始まる N 件のリクエストの間だけ採取する
+  - get_cpu_profile() / collapsed_stacks() : 結果を flamegraph.pl・speedscope で読める collapsed 形式
+    （"関数 (ファイル:行);関数 (ファイル:行);... μs"）で返す
+  スレッドの CPU 時間を "cpu"、待ち（Airtable の応答待ちなど）を含む経過時間を "wall" として集計する。
+  採取中のリクエストは呼び出しのたびに時刻を見るぶん遅くなる（benchmarks/bench_profiling.py）。
+
+メモリ: tracemalloc のスナップショットの差分
+  - start_memory_trace()  : 追跡を開始し、基準のスナップショットを取る
+  - memory_diff()         : 現在のスナップショットと基準（または前回）との差分を、確保した場所ごとに大きい順で返す
+  - stop_memory_trace()   : 追跡を止める（有効な間はメモリ確保が遅くなるので、調べ終わったら止める）
+
+無効な間のコストは before_request/teardown_request での確認だけ。
+状態はワーカー（プロセス）ごとなので、結果はエンドポイントを受けたワーカーのもの（応答に pid を含める）。
+"""
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from flask import g, request
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MAX_SEC = 300          # CPU プロファイルの最長時間（requests 指定でもこれで打ち切る）
+PROFILE_MAX_REQUESTS = 10000
+DEFAULT_INTERVAL_MS = 10.0
+MAX_STACK_DEPTH = 128
+CPU_CHECK_SEC = 0.0001         # スレッドの CPU 時間を読む間隔（システムコールなので毎回は読まない）
+MEMORY_MAX_FRAMES = 25
+
+_APP_ROOT = os.path.dirname(os.path.abspath(__file__)) + os.sep
+_lock = threading.Lock()
+
+
+def _frame_label(code) -> str:
+    """flamegraph の1段分の名前（collapsed 形式の区切りの ; は使えないので置き換える）。"""
+    filename = code.co_filename
+    if filename.startswith(_APP_ROOT):
+        filename = filename[len(_APP_ROOT):]
+    else:
+        filename = "/".join(filename.replace("\\", "/").split("/")[-2:])
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+# ===== CPU =====
+class _CpuSession:
+    def __init__(self, seconds: float, requests_limit: int, interval_sec: float):
+        self.started_at = time.time()
+        self.deadline = time.monotonic() + seconds
+        self.requests_limit = requests_limit      # 0 なら時間指定
+        self.requests_started = 0
+        self.interval_sec = interval_sec
+        self.tracked = set()                      # 採取中のスレッド（リクエスト処理中）
+        self.carry = {}                           # { スレッド: [経過時間, CPU 時間] } 次のサンプルまでの持ち越し
+        self.wall = collections.Counter()         # { (frame, ...): 経過時間(μs) }
+        self.cpu = collections.Counter()          # { (frame, ...): CPU 時間(μs) }
+        self.samples = 0
+        self.finished_at = None
+
+    def summary(self) -> dict:
+        return {
+            "state": "done" if self.finished_at else "running",
+            "pid": os.getpid(),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "interval_ms": self.interval_sec * 1000,
+            "requests_limit": self.requests_limit or None,
+            "requests_profiled": self.requests_started,
+            "samples": self.samples,
+            "wall_ms": round(sum(self.wall.values()) / 1000, 1),
+            "cpu_ms": round(sum(self.cpu.values()) / 1000, 1),
+            "stacks": len(self.wall),
+        }
+
+
+_cpu_session = None   # 実行中または最後に終わったセッション
+_cpu_active = False   # リクエストのフックが見る（無効時はこれだけ確認して戻る）
+
+
+def start_cpu_profile(seconds: float = None, requests: int = None,
+                      interval_ms: float = DEFAULT_INTERVAL_MS) -> dict:
+    """
+    CPU プロファイルを開始して状態を返す。実行中なら ValueError。
+    requests を指定した場合は、この後に始まる requests 件のリクエストが終わるまで（最長 PROFILE_MAX_SEC 秒）。
+    """
+    global _cpu_session, _cpu_active
+    if requests is not None and not 1 <= requests <= PROFILE_MAX_REQUESTS:
+        raise ValueError(f"requests は 1〜{PROFILE_MAX_REQUESTS} で指定してください。")
+    seconds = PROFILE_MAX_SEC if seconds is None else seconds
+    if not 0 < seconds <= PROFILE_MAX_SEC:
+        raise ValueError(f"seconds は 0〜{PROFILE_MAX_SEC} で指定してください。")
+    interval_sec = max(float(interval_ms), 0.1) / 1000
+    with _lock:
+        _expire_locked()
+        if _cpu_active:
+            raise ValueError("CPU プロファイルは実行中です。")
+        _cpu_session = _CpuSession(seconds, requests or 0, interval_sec)
+        _cpu_active = True
+    logger.info("CPU プロファイルを開始しました: seconds=%s, requests=%s, interval=%.1fms",
+                seconds, requests, interval_sec * 1000)
+    return _cpu_session.summary()
+
+
+def stop_cpu_profile():
+    """実行中の CPU プロファイルを止める（結果は残る。処理中のリクエストは終わるまで採取される）。"""
+    with _lock:
+        if _cpu_active:
+            _finish_locked()
+
+
+def _finish_locked():
+    global _cpu_active
+    session = _cpu_session
+    _cpu_active = False
+    session.finished_at = time.time()
+    logger.info("CPU プロファイルを終了しました: samples=%d, requests=%d", session.samples, session.requests_started)
+
+
+def _expire_locked():
+    """時間切れ・指定件数のリクエストが終わっていれば終了する（ロックを持った状態で呼ぶ）。"""
+    session = _cpu_session
+    if not _cpu_active:
+        return
+    if time.monotonic() >= session.deadline or (
+            session.requests_limit and session.requests_started >= session.requests_limit and not session.tracked):
+        _finish_locked()
+
+
+def get_cpu_profile() -> dict:
+    """実行中または最後の CPU プロファイルの状態（無ければ {"state": "idle"}）。"""
+    with _lock:
+        _expire_locked()
+        session = _cpu_session
+        if session is None:
+            return {"state": "idle", "pid": os.getpid()}
+        return session.summary()
+
+
+def collapsed_stacks(kind: str = "cpu") -> str:
+    """最後の CPU プロファイルの collapsed 形式のテキスト（kind は "cpu" か "wall"。値はμs）。"""
+    with _lock:
+        session = _cpu_session
+        if session is None:
+            return ""
+        counts = dict(session.cpu if kind == "cpu" else session.wall)
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in sorted(counts.items()) if stack and count)
+
+
+def _make_sampler(session: _CpuSession, carry: list):
+    """
+    リクエストを処理するスレッド自身に sys.setprofile で仕掛けるサンプラーと、終了時に呼ぶ関数を返す。
+    関数の呼び出し・戻りのたびに時刻だけを見て、経過時間が interval に達したらそのときのスタックに経過時間を、
+    スレッドの CPU 時間が interval に達したら CPU 時間を加算する（CPU 時間は CPU_CHECK_SEC ごとに確認する。
+    間隔が粗いと、GIL を待っていた直前の CPU 時間が待ち終わった位置に付いてしまう）。
+    別スレッドから sys._current_frames() で採取すると、GIL を手放す位置（zlib・ロック・ソケット）ばかりが
+    採取されて偏るため、この方式にしている。
+    carry は前のリクエストで interval に満たなかった [経過時間, CPU 時間]（短いリクエストも採取されるように）。
+    """
+    interval = session.interval_sec
+    check_step = min(interval / 10, CPU_CHECK_SEC)
+    perf_counter, thread_time = time.perf_counter, time.thread_time
+    # 前回のサンプルの時刻を持ち越しぶんだけ過去にずらす
+    last_wall, last_cpu = perf_counter() - carry[0], thread_time() - carry[1]
+    wall_due, cpu_due = last_wall + interval, last_cpu + interval
+    cpu_check = perf_counter() + check_step
+    next_check = min(wall_due, cpu_check)
+
+    def sample(frame, event, arg, wall_us, cpu_us):
+        stack = []
+        if event in ("c_call", "c_return", "c_exception"):
+            stack.append(f"{getattr(arg, '__qualname__', arg)} (builtin)".replace(";", ":"))
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        stack = tuple(reversed(stack))
+        with _lock:
+            if wall_us:
+                session.wall[stack] += wall_us
+                session.samples += 1
+            if cpu_us:
+                session.cpu[stack] += cpu_us
+
+    def sampler(frame, event, arg):
+        nonlocal last_wall, last_cpu, wall_due, cpu_due, cpu_check, next_check
+        now = perf_counter()
+        if now < next_check:
+            return
+        wall_us = cpu_us = 0
+        if now >= wall_due:
+            wall_us = int((now - last_wall) * 1e6)
+            last_wall, wall_due = now, now + interval
+        if now >= cpu_check:
+            cpu_check = now + check_step
+            cpu_now = thread_time()
+            if cpu_now >= cpu_due:
+                cpu_us = int((cpu_now - last_cpu) * 1e6)
+                last_cpu, cpu_due = cpu_now, cpu_now + interval
+        next_check = min(wall_due, cpu_check)
+        if wall_us or cpu_us:
+            sample(frame, event, arg, wall_us, cpu_us)
+
+    def finish() -> list:
+        return [perf_counter() - last_wall, thread_time() - last_cpu]
+
+    return sampler, finish
+
+
+def _before_request():
+    if not _cpu_active or request.blueprint == "profiling_bp":
+        return
+    ident = threading.get_ident()
+    with _lock:
+        _expire_locked()
+        session = _cpu_session
+        if not _cpu_active or (session.requests_limit and session.requests_started >= session.requests_limit):
+            return
+        session.requests_started += 1
+        session.tracked.add(ident)
+        carry = session.carry.get(ident, [0.0, 0.0])
+    sampler, g._profiling_finish = _make_sampler(session, carry)
+    g._profiling_previous = sys.getprofile()
+    sys.setprofile(sampler)
+
+
+def _teardown_request(exc=None):
+    if "_profiling_previous" not in g:
+        return
+    sys.setprofile(g.pop("_profiling_previous"))
+    carry = g.pop("_profiling_finish")()
+    ident = threading.get_ident()
+    with _lock:
+        _cpu_session.carry[ident] = carry
+        _cpu_session.tracked.discard(ident)
+        _expire_locked()
+
+
+def init_app(app):
+    """CPU プロファイルの対象リクエストにサンプラーを仕掛けるフックを登録する。"""
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
+
+
+# ===== メモリ =====
+_baseline = None       # (時刻, スナップショット)
+_previous = None
+
+
+def _take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+
+def start_memory_trace(frames: int = 10) -> dict:
+    """tracemalloc を開始して基準のスナップショットを取る（開始済みなら基準を取り直す）。"""
+    global _baseline, _previous
+    frames = min(max(int(frames), 1), MEMORY_MAX_FRAMES)
+    with _lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            logger.info("tracemalloc を開始しました: frames=%d", frames)
+        _baseline = _previous = (time.time(), _take_snapshot())
+    return get_memory_status()
+
+
+def stop_memory_trace() -> dict:
+    global _baseline, _previous
+    with _lock:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logger.info("tracemalloc を停止しました")
+        _baseline = _previous = None
+    return get_memory_status()
+
+
+def get_memory_status() -> dict:
+    tracing = tracemalloc.is_tracing()
+    status = {"pid": os.getpid(), "tracing": tracing}
+    if tracing:
+        current, peak = tracemalloc.get_traced_memory()
+        status.update({
+            "frames": tracemalloc.get_traceback_limit(),
+            "traced_kb": round(current / 1024, 1),
+            "traced_peak_kb": round(peak / 1024, 1),
+            "tracemalloc_overhead_kb": round(tracemalloc.get_tracemalloc_memory() / 1024, 1),
+            "baseline_at": _baseline[0] if _baseline else None,
+        })
+    return status
+
+
+def memory_diff(since: str = "start", group_by: str = "lineno", top: int = 30, include: str = None) -> dict:
+    """
+    現在のスナップショットと、基準（since="start"）または前回の memory_diff（since="last"）との差分を返す。
+    group_by: "lineno"（確保した行）/ "traceback"（呼び出し経路ごと）/ "filename"
+    include : ファイル名のパターン（例: "*airtable_cache.py"）。呼び出し経路のどこかに含む確保だけを集計する
+    tracemalloc が開始されていなければ ValueError。
+    """
+    global _previous
+    if group_by not in ("lineno", "traceback", "filename"):
+        raise ValueError("group_by は lineno / traceback / filename のいずれかです。")
+    if since not in ("start", "last"):
+        raise ValueError("since は start か last です。")
+    with _lock:
+        if not tracemalloc.is_tracing() or _baseline is None:
+            raise ValueError("tracemalloc が開始されていません。")
+        base_at, base = _baseline if since == "start" else _previous
+        now = time.time()
+        snapshot = _take_snapshot()
+        _previous = (now, snapshot)
+    if include:
+        filters = [tracemalloc.Filter(True, include, all_frames=True)]
+        snapshot, base = snapshot.filter_traces(filters), base.filter_traces(filters)
+
+    stats = snapshot.compare_to(base, group_by)
+    result = []
+    for stat in stats[:max(1, min(int(top), 500))]:
+        frame = stat.traceback[-1]  # 確保した場所（traceback は古い呼び出しから順）
+        item = {
+            "site": f"{_short_path(frame.filename)}:{frame.lineno}",
+            "size_kb": round(stat.size / 1024, 1),
+            "size_diff_kb": round(stat.size_diff / 1024, 1),
+            "count": stat.count,
+            "count_diff": stat.count_diff,
+        }
+        if group_by == "traceback":
+            item["traceback"] = [f"{_short_path(f.filename)}:{f.lineno}" for f in stat.traceback]
+        result.append(item)
+    return {
+        **get_memory_status(),
+        "since": since,
+        "interval_sec": round(now - base_at, 1),
+        "total_diff_kb": round(sum(s.size_diff for s in stats) / 1024, 1),
+        "top": result,
+    }
+
+
+def _short_path(filename: str) -> str:
+    if filename.startswith(_APP_ROOT):
+        return filename[len(_APP_ROOT):]
+    return "/".join(filename.replace("\\", "/").split("/")[-2:])
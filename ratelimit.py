@@ -0,0 +1,21 @@
+# ratelimit.py
+"""Airtable のレート制限（1ベースあたり 5 req/sec）に合わせて送信間隔をあける（bulk_import / mirror で使う）。"""
+import threading
+import time
+
+
+class RateLimiter:
+    """送信の間隔を 1/per_sec 秒以上あける（複数スレッドから呼ばれても全体で per_sec 以下）。"""
+
+    def __init__(self, per_sec: float):
+        self.interval = 1.0 / per_sec if per_sec > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait_sec = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait_sec > 0:
+            time.sleep(wait_sec)
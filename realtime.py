@@ -0,0 +1,168 @@
+# realtime.py
+"""
+records 画面へのリアルタイム通知（Flask-SocketIO）。
+
+別の端末で作成・編集・削除した行を、開いている records 画面へ PersonID ごとのルームで送り、
+画面側（static/records_realtime.js）がその行だけを書き換える。再読み込み（全体の再描画・Airtable の再取得）をしなくてよい。
+
+  - init_app()                : app に SocketIO を組み込む（REALTIME_ENABLED=0 なら何もしない）
+  - publish_record_upsert()   : 行の作成・更新（描画済みの <tr> を送る）
+  - publish_record_delete()   : 行の削除
+  - publish_month_invalidate(): 行の内容を組み立てられない場合に、その月を開いている画面に再読み込みを促す
+
+構成:
+  - async_mode="threading"（gunicorn の gthread ワーカーで動く）、WebSocket のみ（ロングポーリングは使わない。
+    ワーカーが複数でもスティッキーセッションが要らない）
+  - ワーカー間の配信は同じホストの SQLite（REALTIME_DB_PATH、realtime_pubsub.py）を介して行う。
+    複数ホストで動かす場合は SOCKETIO_MESSAGE_QUEUE（例: redis://...）を設定する
+  - flask_socketio は最初の WebSocket 接続か通知のときに import・初期化する（import app を軽くするため）
+"""
+import logging
+import os
+import tempfile
+import threading
+import uuid
+
+from flask import get_template_attribute, session
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+REALTIME_ENABLED = os.environ.get("REALTIME_ENABLED", "1") == "1"
+SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE", "")
+REALTIME_DB_PATH = os.environ.get("REALTIME_DB_PATH", os.path.join(tempfile.gettempdir(), "skyandsea-realtime.sqlite3"))
+
+_app = None
+_socketio_app = None  # flask_socketio.SocketIO（_get_socketio() で作る）
+_init_lock = threading.Lock()
+_connections = 0
+_connections_lock = threading.Lock()
+metrics.REALTIME_CONNECTIONS.set_function(lambda: {(): _connections})
+
+
+def init_app(app):
+    """
+    app に SocketIO を組み込む（REALTIME_ENABLED=0 なら何もしない）。
+    flask_socketio（python-socketio・engineio・requests も読み込まれる）の import と初期化は、
+    最初の WebSocket 接続か通知のときに行う（import app を軽くするため）。
+    """
+    global _app
+    if not REALTIME_ENABLED:
+        return
+    _app = app
+    app.wsgi_app = _LazySocketIOMiddleware(app.wsgi_app)
+
+
+class _LazySocketIOMiddleware:
+    """/socket.io/ への最初のリクエストで SocketIO を初期化し、以降は SocketIO のミドルウェアに任せる。"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO", "").startswith("/socket.io/"):
+            # 初期化後は app.wsgi_app が SocketIO のミドルウェアに置き換わるので、ここを通るのは初期化前に
+            # 受け付けたリクエストだけ
+            return _get_socketio().sockio_mw(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+
+def _get_socketio():
+    """flask_socketio.SocketIO を返す（最初に呼ばれたときに import して app に組み込む。スレッドセーフ）。"""
+    global _socketio_app
+    if _socketio_app is None:
+        with _init_lock:
+            if _socketio_app is None:
+                from flask_socketio import SocketIO
+                from realtime_pubsub import SqlitePubSubManager
+
+                options = {}
+                if SOCKETIO_MESSAGE_QUEUE:
+                    options["message_queue"] = SOCKETIO_MESSAGE_QUEUE
+                else:
+                    options["client_manager"] = SqlitePubSubManager(REALTIME_DB_PATH)
+                sio = SocketIO()
+                sio.on("connect")(_on_connect)
+                sio.on("disconnect")(_on_disconnect)
+                sio.init_app(_app, async_mode="threading", transports=["websocket"], logger=False,
+                             engineio_logger=False, **options)
+                _socketio_app = sio
+    return _socketio_app
+
+
+def reset_after_fork():
+    """
+    preload で親から引き継いだクライアントマネージャーの host_id を作り直す
+    （同じ host_id のままだと、他ワーカーからの通知を自分の送信とみなして捨ててしまう）。
+    """
+    global _connections
+    # 未初期化なら何もしなくてよい（このワーカーで初期化するときに新しい host_id になる）
+    manager = getattr(_socketio_app.server, "manager", None) if _socketio_app is not None else None
+    if manager is not None and hasattr(manager, "host_id"):
+        manager.host_id = uuid.uuid4().hex
+    with _connections_lock:
+        _connections = 0
+
+
+def person_room(person_id) -> str:
+    return f"person:{person_id}"
+
+
+def _on_connect(auth=None):
+    from flask_socketio import join_room
+
+    person_id = session.get("logged_in_personid")
+    if person_id is None:
+        return False  # 未ログインの接続は拒否する
+    join_room(person_room(person_id))
+    global _connections
+    with _connections_lock:
+        _connections += 1
+
+
+def _on_disconnect(*args):
+    global _connections
+    with _connections_lock:
+        _connections = max(0, _connections - 1)
+
+
+def _emit(person_id, event: str, payload: dict):
+    """
+    送信に失敗しても呼び出し元（書き込み処理）は止めない。
+    このワーカーに接続が無くても、他のワーカーの接続へ配信するため SocketIO を初期化して送る。
+    """
+    if not REALTIME_ENABLED or _app is None:
+        return
+    try:
+        _get_socketio().emit(event, payload, to=person_room(person_id))
+        metrics.REALTIME_EVENTS.inc(event=event)
+    except Exception as e:
+        logger.warning("リアルタイム通知に失敗しました（無視）: %s %s", event, e)
+
+
+def publish_record_upsert(person_id, row: dict, replaces: str = None):
+    """
+    行の作成・更新を通知する。row は records 画面の行形式（subtotal を含む）。
+    replaces: 置き換える行のID（送信待ちの行が Airtable のIDに変わった場合など）。
+    """
+    if not REALTIME_ENABLED:
+        return
+    workday = str(row.get("WorkDay", ""))
+    try:
+        year, month = int(workday[:4]), int(workday[5:7])
+    except ValueError:
+        return
+    record_row = get_template_attribute("_record_row.html", "record_row")
+    _emit(person_id, "record_upsert", {
+        "year": year, "month": month, "id": str(row["id"]), "workday": workday, "replaces": replaces,
+        "html": str(record_row(row, year, month)),
+    })
+
+
+def publish_record_delete(person_id, record_id: str, year: int, month: int):
+    _emit(person_id, "record_delete", {"year": year, "month": month, "id": str(record_id)})
+
+
+def publish_month_invalidate(person_id, year: int, month: int):
+    _emit(person_id, "month_invalidate", {"year": year, "month": month})
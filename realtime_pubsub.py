@@ -0,0 +1,71 @@
+# realtime_pubsub.py
+"""
+realtime.py のワーカー間配信（同じホストの SQLite を介する python-socketio のクライアントマネージャー）。
+socketio を import するので、realtime.py が SocketIO を初期化するときに読み込む。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import socketio
+
+REALTIME_POLL_SEC = 0.2       # 他ワーカーからの通知を確認する間隔
+REALTIME_RETENTION_SEC = 60   # 配信済みの通知を SQLite に残す時間
+
+
+class SqlitePubSubManager(socketio.PubSubManager):
+    """
+    同じホストのワーカー間で emit を配信する python-socketio のクライアントマネージャー。
+    _publish で SQLite に書き込み、各ワーカーの受信スレッドが新しい行を読んで自分の接続へ送る。
+    """
+    name = "sqlite"
+
+    _SCHEMA = """
+    CREATE TABLE IF NOT EXISTS messages (
+        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+        channel    TEXT NOT NULL,
+        payload    TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, path: str, channel: str = "socketio", write_only: bool = False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = path
+        self._local = threading.local()
+        self._last_purge = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "pid", None) == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self._SCHEMA)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _publish(self, data):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("INSERT INTO messages (channel, payload, created_at) VALUES (?, ?, ?)",
+                     (self.channel, json.dumps(data, ensure_ascii=False), now))
+        if now - self._last_purge > REALTIME_RETENTION_SEC:
+            self._last_purge = now
+            conn.execute("DELETE FROM messages WHERE created_at < ?", (now - REALTIME_RETENTION_SEC,))
+
+    def _listen(self):
+        conn = self._connect()
+        last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+        while True:
+            rows = conn.execute("SELECT id, payload FROM messages WHERE id > ? AND channel = ? ORDER BY id",
+                                (last_id, self.channel)).fetchall()
+            for row_id, payload in rows:
+                last_id = row_id
+                yield payload
+            if not rows:
+                time.sleep(REALTIME_POLL_SEC)
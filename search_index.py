@@ -0,0 +1,164 @@
+# search_index.py
+"""
+品名（WorkName）・書名（BookName）・品番コードの文字 n-gram 転置インデックス（/api/search_worknames 用）。
+
+正規化（normalize）:
+  - NFKC（全角英数字・記号 → 半角、半角カナ → 全角カナ）
+  - 大文字小文字を区別しない（casefold）
+  - カタカナ → ひらがな（「ほん」で「ホン」も見つかる）
+  - 空白・記号を除く（「上巻 (改訂版)」は「上巻改訂版」として扱う）
+  漢字の読みは扱わない（「ほん」で「本」は見つからない）。
+
+インデックスは項目（品番コード・品名・書名）ごとに、正規化後の文字（1-gram）と連続する2文字（2-gram）から引く。
+検索語の 2-gram のうち最も該当の少ないものの項目だけを、部分一致で確かめる。
+順位: 品番コードの前方一致 > 品名 > 書名。それぞれ短いほど上（完全一致が先頭）、同じならシートの順。
+
+data_services.load_workcord_data がロードのたびに rebuild_in_background() で別スレッドで作り直す。
+作成中も検索は前のインデックスで続けられ、完成したら参照ごと入れ替える。
+"""
+import logging
+import re
+import threading
+import time
+import unicodedata
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# カタカナ（ァ〜ヶ・ヽヾ）→ ひらがな
+_KANA_FOLD = {code: code - 0x60 for code in list(range(0x30A1, 0x30F7)) + [0x30FD, 0x30FE]}
+_SEPARATORS = re.compile(r"[\W_]+")
+
+
+def normalize(text: str) -> str:
+    """検索用の正規化（インデックスと検索語で同じものを使う）。"""
+    text = unicodedata.normalize("NFKC", text).casefold().translate(_KANA_FOLD)
+    return _SEPARATORS.sub("", text)
+
+
+def _grams(text: str):
+    """text の 1-gram と 2-gram。"""
+    yield from text
+    for i in range(len(text) - 1):
+        yield text[i:i + 2]
+
+
+FIELDS = ("code", "workname", "bookname")  # 順位の優先順
+
+
+class SearchIndex:
+    """workcord_dict のスナップショット1つ分のインデックス（作成後は変更しない）。"""
+
+    def __init__(self, workcord_dict: dict):
+        self.source = workcord_dict  # 作成元（同じ dict なら作り直さない）
+        self.entries = []            # [(code, workname, bookname)]
+        texts = []                   # [(正規化後の code, workname, bookname)]
+        for code, items in workcord_dict.items():
+            norm_code = normalize(code)
+            for item in items:
+                self.entries.append((code, item["workname"], item["bookname"]))
+                texts.append((norm_code, normalize(item["workname"]), normalize(item["bookname"])))
+        self.texts = texts
+        # 項目ごとに { gram: [項目番号] }。項目番号はその項目の文字数の短い順（同じならシートの順）に並べておき、
+        # 検索は先頭から確かめて limit 件そろったところで止める
+        self.postings = []
+        for field_index in range(len(FIELDS)):
+            postings = {}
+            order = sorted(range(len(texts)), key=lambda i: len(texts[i][field_index]))
+            for entry_id in order:
+                for gram in set(_grams(texts[entry_id][field_index])):
+                    ids = postings.get(gram)
+                    if ids is None:
+                        postings[gram] = [entry_id]
+                    else:
+                        ids.append(entry_id)
+            # list より小さい array で持つ
+            self.postings.append({gram: array("I", ids) for gram, ids in postings.items()})
+
+    def search(self, query: str, limit: int = 30):
+        """
+        ([(code, workname, bookname)] 最大 limit 件, さらに該当があるか)。
+        順位: 品番コードの前方一致 > 品名の部分一致 > 書名の部分一致。それぞれ短いほど上（完全一致が先頭になる）。
+        """
+        q = normalize(query)
+        if not q:
+            return [], False
+        grams = set(q) if len(q) == 1 else {q[i:i + 2] for i in range(len(q) - 1)}
+        found, seen = [], set()
+        for field_index, postings in enumerate(self.postings):
+            # 該当の最も少ない gram の項目だけを確かめる
+            candidates = None
+            for gram in grams:
+                ids = postings.get(gram)
+                if ids is None:
+                    candidates = None
+                    break
+                if candidates is None or len(ids) < len(candidates):
+                    candidates = ids
+            if candidates is None:
+                continue
+            texts = self.texts
+            for entry_id in candidates:
+                field = texts[entry_id][field_index]
+                if (field.startswith(q) if field_index == 0 else q in field) and entry_id not in seen:
+                    if len(found) == limit:
+                        return [self.entries[i] for i in found], True
+                    found.append(entry_id)
+                    seen.add(entry_id)
+        return [self.entries[i] for i in found], False
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.entries),
+            "grams": {field: len(postings) for field, postings in zip(FIELDS, self.postings)},
+            "postings": sum(len(ids) for postings in self.postings for ids in postings.values()),
+        }
+
+
+_index = SearchIndex({})
+_build_lock = threading.Lock()
+
+
+def rebuild(workcord_dict: dict) -> SearchIndex:
+    """workcord_dict からインデックスを作り直して入れ替える（同じ dict から作成済みなら何もしない）。"""
+    global _index
+    with _build_lock:
+        if _index.source is workcord_dict:
+            return _index
+        started = time.perf_counter()
+        index = SearchIndex(workcord_dict)
+        _index = index
+    logger.info("品名検索インデックスを作成しました: %d 件, %.0fms",
+                len(index.entries), (time.perf_counter() - started) * 1000)
+    return index
+
+
+def _rebuild_logged(workcord_dict: dict):
+    try:
+        rebuild(workcord_dict)
+    except Exception as e:
+        # 前のインデックスは残る。次の search() で作り直す
+        logger.error("品名検索インデックスの作成に失敗しました: %s", e, exc_info=True)
+
+
+def rebuild_in_background(workcord_dict: dict):
+    """rebuild() を別スレッドで行う（呼び出し元のリクエストを待たせない）。"""
+    threading.Thread(target=_rebuild_logged, args=(workcord_dict,), name="search-index", daemon=True).start()
+
+
+def reset_after_fork():
+    """fork 前に作成中だったスレッドのロックを引き継がないよう作り直す（作成中だった分は次の search() で作る）。"""
+    global _build_lock
+    _build_lock = threading.Lock()
+
+
+def search(workcord_dict: dict, query: str, limit: int = 30):
+    """
+    workcord_dict の品名・書名・品番コードを検索する。([(code, workname, bookname)], さらに該当があるか)。
+    インデックスが workcord_dict から作られていなければ先に作る（ロード以外で dict が差し替えられた場合・作成に失敗した場合）。
+    別スレッドで作成中なら、完成を待たずに前のインデックスで答える（最初の作成だけは待つ）。
+    """
+    index = _index
+    if index.source is not workcord_dict and not (index.entries and _build_lock.locked()):
+        index = rebuild(workcord_dict)
+    return index.search(query, limit)
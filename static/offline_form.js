@@ -0,0 +1,127 @@
+// static/offline_form.js
+// 入力フォーム（index.html）のオフライン対応の画面側。本体は Service Worker（static/sw.js）。
+// Service Worker を登録し、保留中・送信できなかった記録の件数を #offline-status に表示する。
+(function () {
+    'use strict';
+
+    const form = document.querySelector('form[data-offline-form]');
+    const status = document.getElementById('offline-status');
+    if (!form || !status || !('serviceWorker' in navigator)) return;
+
+    const script = document.currentScript;
+    const swUrl = (script && script.dataset.swUrl) || '/sw.js';
+    const recordsUrl = (script && script.dataset.recordsUrl) || '';
+    const keyInput = form.querySelector('input[name="idempotency_key"]');
+    const personId = form.dataset.personid || '';  // 保留した送信はこの人の分だけ送る・表示する
+    const USED_KEYS = 'usedIdempotencyKeys';
+    const USED_KEYS_MAX = 50;
+
+    // ---- 冪等キー ----
+    // キャッシュから表示したフォームの冪等キーは、前に送信したものと同じことがある。
+    // 同じキーのままだと別の記録が前の送信にまとめられてしまうので、送信済みなら作り直す
+    function newKey() {
+        if (window.crypto.randomUUID) return window.crypto.randomUUID();
+        const bytes = window.crypto.getRandomValues(new Uint8Array(16));
+        return Array.from(bytes, (b) => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    function usedKeys() {
+        try {
+            return JSON.parse(localStorage.getItem(USED_KEYS) || '[]');
+        } catch (e) {
+            return [];
+        }
+    }
+
+    if (keyInput && usedKeys().includes(keyInput.value)) {
+        keyInput.value = newKey();
+    }
+    form.addEventListener('submit', () => {
+        if (!keyInput) return;
+        const keys = usedKeys().filter((key) => key !== keyInput.value);
+        keys.push(keyInput.value);
+        try {
+            localStorage.setItem(USED_KEYS, JSON.stringify(keys.slice(-USED_KEYS_MAX)));
+        } catch (e) { /* 保存できなくても送信は続ける */ }
+    });
+
+    // ---- 表示 ----
+    const queuedNow = new URLSearchParams(location.search).has('queued');
+    if (queuedNow) {
+        history.replaceState(null, '', location.pathname);  // 再読み込みで同じ表示を出さない
+    }
+
+    function paragraph(className, text) {
+        const p = document.createElement('p');
+        p.className = className;
+        p.textContent = text;
+        return p;
+    }
+
+    function render(data) {
+        status.replaceChildren();
+        if (queuedNow && data.pending > 0) {
+            status.appendChild(paragraph('warning',
+                '⚠ 通信できないため送信を保留しました。接続が戻ると自動で送信します。'));
+        }
+        if (data.sent > 0) {
+            const p = paragraph('success', `✅ 保留していた ${data.sent} 件を送信しました。`);
+            if (recordsUrl) {
+                const link = document.createElement('a');
+                link.href = recordsUrl;
+                link.textContent = '記録を確認';
+                p.append(' ', link);
+            }
+            status.appendChild(p);
+        }
+        if (data.pending > 0) {
+            status.appendChild(paragraph('info', data.needLogin
+                ? `未送信の記録が ${data.pending} 件あります。ログインし直すと送信します。`
+                : `未送信の記録が ${data.pending} 件あります。接続が戻ると自動で送信します。`));
+        }
+        if (data.held > 0) {
+            status.appendChild(paragraph('info',
+                `別の人の未送信の記録が ${data.held} 件あります。入力した人がログインすると送信します。`));
+        }
+        if (data.rejected && data.rejected.length > 0) {
+            const box = paragraph('error', `❌ 送信できなかった記録が ${data.rejected.length} 件あります（入力し直してください）:`);
+            const list = document.createElement('ul');
+            data.rejected.forEach((item) => {
+                const li = document.createElement('li');
+                li.textContent = `${item.workday || ''} ${item.workname || ''} ${item.workprocess || ''} ` +
+                    `${item.workoutput || ''} — ${(item.errors || []).join(' ')}`;
+                list.appendChild(li);
+            });
+            const discard = document.createElement('button');
+            discard.type = 'button';
+            discard.textContent = '破棄';
+            discard.addEventListener('click', () => post({ type: 'discard-rejected', personId: personId }));
+            box.append(list, discard);
+            status.appendChild(box);
+        }
+        status.hidden = status.childElementCount === 0;
+    }
+
+    // ---- Service Worker ----
+    function post(message) {
+        navigator.serviceWorker.ready.then((registration) => {
+            if (registration.active) registration.active.postMessage(message);
+        });
+    }
+
+    navigator.serviceWorker.addEventListener('message', (event) => {
+        const data = event.data || {};
+        if (data.type !== 'submissions') return;
+        if (data.loggedOut) {
+            location.reload();  // キャッシュのフォームは消えているので、ログイン画面へ移る
+            return;
+        }
+        render(data);
+    });
+
+    navigator.serviceWorker.register(swUrl).catch((error) => {
+        console.error('Service Worker を登録できませんでした:', error);
+    });
+    window.addEventListener('online', () => post({ type: 'replay', personId: personId }));
+    post({ type: 'replay', personId: personId });  // 保留中があれば送り、件数を表示する
+})();
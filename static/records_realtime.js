@@ -0,0 +1,141 @@
+// static/records_realtime.js
+// records 画面のリアルタイム更新（サーバー側は realtime.py）。
+// 別の端末での作成・編集・削除を WebSocket で受け取り、表の該当行と集計だけを書き換える。
+// Socket.IO のクライアントライブラリは使わず、必要な分（Engine.IO v4 / Socket.IO v5 の受信）だけを実装している。
+(function () {
+    'use strict';
+
+    const table = document.getElementById('records-table');
+    if (!table || !('WebSocket' in window)) return;
+
+    const pageYear = Number(table.dataset.year);
+    const pageMonth = Number(table.dataset.month);
+    const tbody = document.getElementById('records-body');
+    const emptyRow = document.getElementById('records-empty');
+    const summary = document.getElementById('records-summary');
+
+    // ---- 表の書き換え ----
+    function isThisMonth(data) {
+        return data.year === pageYear && data.month === pageMonth;
+    }
+
+    function dataRows() {
+        return Array.from(tbody.querySelectorAll('tr[data-workday]'));
+    }
+
+    function findRow(id) {
+        return id ? document.getElementById('record-' + id) : null;
+    }
+
+    function recalcSummary() {
+        const rows = dataRows();
+        let total = 0, workoutput = 0;
+        const workdays = new Set();
+        rows.forEach((row) => {
+            if (row.dataset.counted !== '1') return;  // 送信失敗行は集計に含めない
+            total += Number(row.dataset.subtotal) || 0;
+            if (row.dataset.workday !== '9999-12-31') workdays.add(row.dataset.workday);
+            if (row.dataset.process.includes('分給')) workoutput += Number(row.dataset.output) || 0;
+        });
+        document.getElementById('summary-workdays').textContent = workdays.size;
+        document.getElementById('summary-workoutput').textContent =
+            workoutput.toLocaleString('en-US', { minimumFractionDigits: 2, maximumFractionDigits: 2 });
+        document.getElementById('summary-total').textContent = Math.round(total).toLocaleString('en-US');
+        emptyRow.hidden = rows.length > 0;
+        summary.hidden = rows.length === 0;
+    }
+
+    function flash(row) {
+        row.classList.add('highlight');
+        setTimeout(() => row.classList.remove('highlight'), 2000);
+    }
+
+    function upsert(data) {
+        if (!isThisMonth(data)) {
+            // 別の月へ移動した行は、この月の表から消す
+            const moved = findRow(data.id) || findRow(data.replaces);
+            if (moved) { moved.remove(); recalcSummary(); }
+            return;
+        }
+        const template = document.createElement('template');
+        template.innerHTML = data.html.trim();
+        const newRow = template.content.firstElementChild;
+        const existing = findRow(data.id) || findRow(data.replaces);
+        if (existing) {
+            existing.remove();
+        }
+        // 作業日順（同じ日は後ろ）に差し込む
+        const next = dataRows().find((row) => row.dataset.workday > data.workday);
+        tbody.insertBefore(newRow, next || emptyRow);
+        recalcSummary();
+        flash(newRow);
+    }
+
+    function remove(data) {
+        const row = findRow(data.id);
+        if (row) { row.remove(); recalcSummary(); }
+    }
+
+    // 行を組み立てられない変更・取りこぼしの可能性がある場合は、画面が見えているときに読み直す
+    let reloadPending = false;
+    function reloadWhenVisible() {
+        if (document.visibilityState === 'visible') {
+            location.reload();
+        } else {
+            reloadPending = true;
+        }
+    }
+    document.addEventListener('visibilitychange', () => {
+        if (reloadPending && document.visibilityState === 'visible') location.reload();
+    });
+
+    const handlers = {
+        record_upsert: upsert,
+        record_delete: remove,
+        month_invalidate: (data) => { if (isThisMonth(data)) reloadWhenVisible(); },
+    };
+
+    // ---- Socket.IO（WebSocket のみ） ----
+    const MAX_FAILURES_BEFORE_CONNECT = 5;  // 一度もつながらない環境（WebSocket 非対応のサーバー）では諦める
+    let attempts = 0;
+    let everConnected = false;
+    let stopped = false;
+
+    function connect() {
+        const scheme = location.protocol === 'https:' ? 'wss' : 'ws';
+        const ws = new WebSocket(`${scheme}://${location.host}/socket.io/?EIO=4&transport=websocket`);
+        let opened = false;
+
+        ws.onmessage = (event) => {
+            const msg = String(event.data);
+            if (msg[0] === '0') {            // Engine.IO open → 既定の名前空間に接続
+                ws.send('40');
+            } else if (msg === '2') {        // ping → pong
+                ws.send('3');
+            } else if (msg.startsWith('40')) {   // 接続完了
+                if (everConnected) reloadWhenVisible();  // 切断中の通知を取りこぼしている可能性がある
+                everConnected = true;
+                opened = true;
+                attempts = 0;
+            } else if (msg.startsWith('44')) {   // 接続拒否（未ログインなど）
+                stopped = true;
+                ws.close();
+            } else if (msg.startsWith('42')) {   // イベント ["name", data]
+                try {
+                    const [name, data] = JSON.parse(msg.slice(2));
+                    if (handlers[name]) handlers[name](data);
+                } catch (e) {
+                    console.warn('realtime: invalid event', e);
+                }
+            }
+        };
+        ws.onclose = () => {
+            if (stopped) return;
+            attempts += 1;
+            if (!everConnected && !opened && attempts >= MAX_FAILURES_BEFORE_CONNECT) return;
+            setTimeout(connect, Math.min(30000, 1000 * 2 ** Math.min(attempts, 5)));
+        };
+    }
+
+    connect();
+})();
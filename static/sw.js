@@ -0,0 +1,386 @@
+// static/sw.js（/sw.js として配信する。ルートは blueprints/ui.py の service_worker）
+// 入力フォームのオフライン対応。画面側は static/offline_form.js。
+//  - 入力フォーム（/）・静的ファイル・マスターデータのカタログ（/api/catalogue）をキャッシュする。
+//    フォームはキャッシュから即座に表示し、裏で取り直してキャッシュを更新する
+//  - 品名・単価の検索（/api/get_worknames・search_worknames・get_unitprice）は、通信できなければカタログから答える
+//  - フォームの送信が通信できずに失敗したら IndexedDB に保留し、接続が戻ったら同じ冪等キーで / へ再送する。
+//    届いていた送信を再送しても、サーバー側（idempotency.py・送信箱の一意キー）で1件にまとまる
+//  - 保留した送信は入力した人の PersonID と一緒に保存し、その人がログイン中のときだけ再送する
+//    （共用の端末で別の人の記録として登録しない。サーバー側もフォームの PersonID が違えば 409 で断る）
+'use strict';
+
+const CACHE = 'booksky-v1';
+const SHELL_URL = '/';
+const CATALOGUE_URL = '/api/catalogue';
+const PRECACHE = ['/static/styles.css', '/static/images/logo.jpg', '/static/offline_form.js'];
+const SUBMIT_TIMEOUT_MS = 15000;  // これより応答が遅ければ保留する（届いていても再送はまとめられる）
+const LOOKUP_TIMEOUT_MS = 4000;
+const SYNC_TAG = 'booksky-submissions';
+const DB_NAME = 'booksky-offline';
+const STORE = 'submissions';
+
+self.addEventListener('install', (event) => {
+    event.waitUntil((async () => {
+        const cache = await caches.open(CACHE);
+        await Promise.all(PRECACHE.map((url) => cache.add(url).catch(() => {})));
+        await Promise.all([refreshShell().catch(() => {}), refreshCatalogue().catch(() => {})]);
+        await self.skipWaiting();
+    })());
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil((async () => {
+        const names = await caches.keys();
+        await Promise.all(names.filter((name) => name !== CACHE).map((name) => caches.delete(name)));
+        await self.clients.claim();
+    })());
+});
+
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) return;
+
+    if (request.method === 'POST' && request.mode === 'navigate' && url.pathname === SHELL_URL) {
+        event.respondWith(submitForm(request));
+        return;
+    }
+    if (request.method !== 'GET') return;
+    if (request.mode === 'navigate') {
+        if (url.pathname === SHELL_URL) {
+            event.respondWith(serveShell(event, request));
+        } else if (url.pathname.startsWith('/auth/')) {
+            // ログイン・ログアウトの後に前の人のフォームを表示しない
+            event.waitUntil(forgetShell());
+        }
+        return;
+    }
+    if (url.pathname.startsWith('/static/')) {
+        event.respondWith(staleWhileRevalidate(event, request));
+    } else if (LOOKUPS[url.pathname]) {
+        event.respondWith(lookup(request, url));
+    }
+});
+
+self.addEventListener('sync', (event) => {
+    if (event.tag !== SYNC_TAG) return;
+    event.waitUntil(replay().then((result) => {
+        // 送れなかった分は、ブラウザに後で sync を呼び直してもらう
+        if (result.pending > 0 && !result.needLogin) throw new Error('pending submissions');
+    }));
+});
+
+self.addEventListener('message', (event) => {
+    const type = event.data && event.data.type;
+    if (type === 'replay') {
+        event.waitUntil(replay(event.data.personId));
+    } else if (type === 'discard-rejected') {
+        event.waitUntil(discardRejected(event.data.personId).then(() => notifyClients({}, event.data.personId)));
+    }
+});
+
+// ===== 共通 =====
+function withTimeout(promise, ms) {
+    return new Promise((resolve, reject) => {
+        const timer = setTimeout(() => reject(new Error('timeout')), ms);
+        promise.then((value) => { clearTimeout(timer); resolve(value); },
+                     (error) => { clearTimeout(timer); reject(error); });
+    });
+}
+
+function jsonResponse(data, status = 200) {
+    return new Response(JSON.stringify(data), {
+        status: status, headers: { 'Content-Type': 'application/json; charset=utf-8' },
+    });
+}
+
+async function staleWhileRevalidate(event, request) {
+    const cache = await caches.open(CACHE);
+    const cached = await cache.match(request, { ignoreSearch: true });
+    const network = fetch(request).then((response) => {
+        if (response.ok) cache.put(request, response.clone());
+        return response;
+    });
+    if (cached) {
+        event.waitUntil(network.catch(() => {}));
+        return cached;
+    }
+    return network;
+}
+
+// ===== 入力フォーム =====
+function isLoginRedirect(response) {
+    return response.redirected && new URL(response.url).pathname.startsWith('/auth/');
+}
+
+async function refreshShell() {
+    const response = await fetch(SHELL_URL, { credentials: 'same-origin' });
+    if (isLoginRedirect(response)) {
+        await forgetShell();
+        await notifyClients({ loggedOut: true });
+    } else if (response.ok && !response.redirected) {
+        // フラッシュメッセージ（「ログインしました」など）はキャッシュに残さない
+        const html = (await response.clone().text()).replace(/<div id="flash-message">[\s\S]*?<\/div>/, '');
+        const cache = await caches.open(CACHE);
+        await cache.put(SHELL_URL, new Response(html, { headers: { 'Content-Type': 'text/html; charset=utf-8' } }));
+    }
+    return response;
+}
+
+// ログイン中の人の PersonID（キャッシュしたフォームの data-personid から。ログアウト中などで分からなければ null）
+async function currentPersonId() {
+    const cache = await caches.open(CACHE);
+    const cached = await cache.match(SHELL_URL);
+    if (!cached) return null;
+    const match = (await cached.text()).match(/data-personid="([^"]*)"/);
+    return match && match[1] ? match[1] : null;
+}
+
+async function forgetShell() {
+    const cache = await caches.open(CACHE);
+    await cache.delete(SHELL_URL);
+}
+
+async function serveShell(event, request) {
+    const cache = await caches.open(CACHE);
+    const cached = await cache.match(SHELL_URL);
+    if (cached) {
+        // 表示はキャッシュから。裏でフォーム・カタログを取り直し、通信できれば保留中の送信も送る
+        event.waitUntil(refreshShell()
+            .then(() => Promise.all([refreshCatalogue(), replay()]))
+            .catch(() => {}));
+        return cached;
+    }
+    try {
+        const response = await refreshShell();
+        event.waitUntil(refreshCatalogue().catch(() => {}));
+        return response;
+    } catch (error) {
+        return new Response(
+            '<!DOCTYPE html><html lang="ja"><meta charset="UTF-8">' +
+            '<meta name="viewport" content="width=device-width, initial-scale=1.0">' +
+            '<p>通信できません。接続を確認してから再読み込みしてください。</p></html>',
+            { status: 503, headers: { 'Content-Type': 'text/html; charset=utf-8' } });
+    }
+}
+
+// ===== 送信の保留と再送 =====
+function openDb() {
+    return new Promise((resolve, reject) => {
+        const open = indexedDB.open(DB_NAME, 1);
+        open.onupgradeneeded = () => open.result.createObjectStore(STORE, { keyPath: 'key' });
+        open.onsuccess = () => resolve(open.result);
+        open.onerror = () => reject(open.error);
+    });
+}
+
+async function withStore(mode, action) {
+    const db = await openDb();
+    return new Promise((resolve, reject) => {
+        const transaction = db.transaction(STORE, mode);
+        const request = action(transaction.objectStore(STORE));
+        transaction.oncomplete = () => { db.close(); resolve(request ? request.result : undefined); };
+        transaction.onerror = () => { db.close(); reject(transaction.error); };
+    });
+}
+
+const putSubmission = (item) => withStore('readwrite', (store) => store.put(item));
+const deleteSubmission = (key) => withStore('readwrite', (store) => store.delete(key));
+const allSubmissions = () => withStore('readonly', (store) => store.getAll());
+
+// 保存した送信が personId の人のものか（PersonID を持たない古い保存分は誰のものとしても扱う）
+function ownedBy(item, personId) {
+    return !personId || !item.personId || item.personId === personId;
+}
+
+async function discardRejected(personId) {
+    const items = await allSubmissions();
+    await Promise.all(items.filter((item) => item.status === 'rejected' && ownedBy(item, personId))
+        .map((item) => deleteSubmission(item.key)));
+}
+
+function newKey() {
+    if (self.crypto.randomUUID) return self.crypto.randomUUID();
+    const bytes = self.crypto.getRandomValues(new Uint8Array(16));
+    return Array.from(bytes, (b) => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function submitForm(request) {
+    const params = new URLSearchParams(await request.clone().text());
+    if (!params.get('idempotency_key')) params.set('idempotency_key', newKey());
+    try {
+        return await withTimeout(fetch(request), SUBMIT_TIMEOUT_MS);
+    } catch (error) {
+        await putSubmission({
+            key: params.get('idempotency_key'),
+            personId: params.get('personid') || '',
+            body: params.toString(),
+            queuedAt: Date.now(),
+            status: 'pending',
+            errors: [],
+        });
+        if (self.registration.sync) {
+            await self.registration.sync.register(SYNC_TAG).catch(() => {});
+        }
+        await notifyClients({});
+        return Response.redirect(SHELL_URL + '?queued=1', 303);
+    }
+}
+
+let replaying = null;
+
+function replay(personId) {
+    // 同時に2回送らない（重複してもサーバー側でまとまるが、無駄な通信になる）
+    if (!replaying) replaying = replayAll(personId).finally(() => { replaying = null; });
+    return replaying;
+}
+
+async function replayAll(personId) {
+    // 画面から PersonID が届かないとき（バックグラウンドの sync）はキャッシュしたフォームから調べる。
+    // それでも分からなければ全件を送り、別の人の分はサーバーの 409 で残す
+    personId = personId || await currentPersonId();
+    const items = (await allSubmissions())
+        .filter((item) => item.status === 'pending' && ownedBy(item, personId))
+        .sort((a, b) => a.queuedAt - b.queuedAt);
+    let sent = 0;
+    let needLogin = false;
+    for (const item of items) {
+        let response;
+        try {
+            response = await withTimeout(fetch(SHELL_URL, {
+                method: 'POST',
+                body: item.body,
+                headers: { 'Content-Type': 'application/x-www-form-urlencoded', 'Accept': 'application/json' },
+                credentials: 'same-origin',
+                redirect: 'manual',
+            }), SUBMIT_TIMEOUT_MS);
+        } catch (error) {
+            break;  // まだ通信できない
+        }
+        if (response.status === 201 || response.status === 202) {
+            await deleteSubmission(item.key);
+            sent += 1;
+        } else if (response.status === 400) {
+            // 入力エラーは再送しても通らないので、画面に出して利用者に任せる
+            const data = await response.json().catch(() => ({}));
+            await putSubmission({ ...item, status: 'rejected', errors: data.errors || ['入力エラー'] });
+        } else if (response.status === 401) {
+            needLogin = true;
+            break;
+        } else if (response.status === 409) {
+            continue;  // 別の人の送信。その人がログインするまで残す
+        } else {
+            break;  // 502 など。後で同じキーで再試行する
+        }
+    }
+    const pending = (await allSubmissions())
+        .filter((item) => item.status === 'pending' && ownedBy(item, personId)).length;
+    await notifyClients({ sent: sent, needLogin: needLogin }, personId);
+    return { sent: sent, pending: pending, needLogin: needLogin };
+}
+
+// 件数はログイン中の人の分だけ数え、別の人の保留分は held として件数だけ知らせる
+async function notifyClients(extra, personId) {
+    personId = personId || await currentPersonId();
+    const items = await allSubmissions();
+    const mine = items.filter((item) => ownedBy(item, personId));
+    const message = {
+        type: 'submissions',
+        pending: mine.filter((item) => item.status === 'pending').length,
+        held: items.length - mine.length,
+        rejected: mine.filter((item) => item.status === 'rejected').map((item) => {
+            const params = new URLSearchParams(item.body);
+            return {
+                workday: params.get('workday'), workname: params.get('workname'),
+                workprocess: params.get('workprocess'), workoutput: params.get('workoutput'),
+                errors: item.errors,
+            };
+        }),
+        ...extra,
+    };
+    const windows = await self.clients.matchAll({ type: 'window', includeUncontrolled: true });
+    windows.forEach((client) => client.postMessage(message));
+}
+
+// ===== 品名・単価の検索（オフライン時はカタログから） =====
+let catalogueMemo = { etag: null, data: null };
+
+async function refreshCatalogue() {
+    const cache = await caches.open(CACHE);
+    const cached = await cache.match(CATALOGUE_URL);
+    const headers = {};
+    if (cached && cached.headers.get('ETag')) headers['If-None-Match'] = cached.headers.get('ETag');
+    const response = await fetch(CATALOGUE_URL, { headers: headers, cache: 'no-store' });
+    if (response.status === 200) await cache.put(CATALOGUE_URL, response);
+}
+
+async function loadCatalogue() {
+    const cache = await caches.open(CACHE);
+    const cached = await cache.match(CATALOGUE_URL);
+    if (!cached) return null;
+    const etag = cached.headers.get('ETag');
+    if (catalogueMemo.data === null || catalogueMemo.etag !== etag) {
+        catalogueMemo = { etag: etag, data: await cached.json() };
+    }
+    return catalogueMemo.data;
+}
+
+// search_index.normalize と同じ正規化（NFKC・小文字・カタカナ → ひらがな・空白記号を除く）
+function normalize(text) {
+    return (text || '').normalize('NFKC').toLowerCase()
+        .replace(/[ァ-ヶヽヾ]/g, (ch) => String.fromCharCode(ch.charCodeAt(0) - 0x60))
+        .replace(/[^\p{L}\p{N}]+/gu, '');
+}
+
+function worknameItem(row) {
+    return { code: row[0], workname: row[1], bookname: row[2] };
+}
+
+const LOOKUPS = {
+    // /api/get_worknames と同じ: 3桁以上で、完全一致 → 前方一致
+    '/api/get_worknames': (catalogue, params) => {
+        const raw = normalize(params.get('workcd'));
+        if (!raw) return { worknames: [], error: '' };
+        if (!/^\d+$/.test(raw)) return { worknames: [], error: 'WorkCDは数値で入力してください' };
+        const workcd = String(Number(raw));
+        if (workcd.length < 3) return { worknames: [], error: '' };
+        const exact = catalogue.workcords.filter((row) => row[0] === workcd);
+        const prefix = catalogue.workcords.filter((row) => row[0] !== workcd && row[0].startsWith(workcd));
+        return { worknames: exact.concat(prefix).map(worknameItem), error: '' };
+    },
+    // /api/search_worknames と同じ順位: 品番コードの前方一致 > 品名 > 書名、それぞれ短いほど上
+    '/api/search_worknames': (catalogue, params) => {
+        const q = normalize(params.get('q'));
+        const limit = Math.min(Math.max(Number(params.get('limit')) || 30, 1), 100);
+        if (!q) return { worknames: [], more: false, error: '' };
+        const tiers = [[], [], []];
+        catalogue.workcords.forEach((row, index) => {
+            const fields = [normalize(row[0]), normalize(row[1]), normalize(row[2])];
+            if (fields[0].startsWith(q)) tiers[0].push([fields[0].length, index]);
+            else if (fields[1].includes(q)) tiers[1].push([fields[1].length, index]);
+            else if (fields[2].includes(q)) tiers[2].push([fields[2].length, index]);
+        });
+        const ranked = [].concat(...tiers.map((tier) => tier.sort((a, b) => a[0] - b[0] || a[1] - b[1])));
+        return {
+            worknames: ranked.slice(0, limit).map(([, index]) => worknameItem(catalogue.workcords[index])),
+            more: ranked.length > limit,
+            error: '',
+        };
+    },
+    '/api/get_unitprice': (catalogue, params) => {
+        const workprocess = (params.get('workprocess') || '').trim();
+        if (!(workprocess in catalogue.unitprice)) return { error: '該当する WorkProcess が見つかりません' };
+        return { unitprice: catalogue.unitprice[workprocess] };
+    },
+};
+
+async function lookup(request, url) {
+    try {
+        return await withTimeout(fetch(request), LOOKUP_TIMEOUT_MS);
+    } catch (error) {
+        const catalogue = await loadCatalogue();
+        if (!catalogue) return jsonResponse({ error: 'オフラインのため検索できません' }, 503);
+        const result = LOOKUPS[url.pathname](catalogue, url.searchParams);
+        return jsonResponse(result, url.pathname === '/api/get_unitprice' && result.error ? 404 : 200);
+    }
+}